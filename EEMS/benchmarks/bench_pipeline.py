@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import platform
+import tempfile
+import contextlib
+import subprocess
+import multiprocessing
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import pyarrow.parquet as pq
+
+from make_synthetic_toray import make_dataset
+
+'''
+End-to-end benchmark: step1, step2, step3_1, step3_2 and step4 on synthetic TORAY exports
+(make_synthetic_toray.py) at several data scales.
+
+Each stage runs in a fresh process, so 'peak RSS' is the stage's own high-water mark; 'rows/s'
+is the number of rows the stage consumed (csv rows for step1/step2, decomposed rows for step3_1,
+24h chunk rows for step3_2, summary rows for step4) per second. Plots are skipped (plot_mode='none'
+for step3_1, specs only for step3_2); bench_plot_downsample.py covers rendering.
+
+Every run is appended to results/pipeline_history.jsonl with the git commit, and the table shows
+the change against the latest run of an earlier commit at the same scale, so regressions are
+visible across commits.
+
+Usage:
+    python bench_pipeline.py [rows_per_file ...] [--files-per-line N] [--no-save]
+'''
+
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+HISTORY_PATH = Path(__file__).resolve().parent / "results" / "pipeline_history.jsonl"
+STAGES = ['step1', 'step2', 'step3_1', 'step3_2', 'step4']
+
+
+def parquet_rows(paths) -> int:
+    return sum(pq.ParquetFile(p).metadata.num_rows for p in paths)
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process (MB). VmHWM is used on Linux because ru_maxrss is
+    inherited across exec, i.e. a spawned child would report its parent's peak.
+    """
+    try:
+        for line in Path('/proc/self/status').read_text().splitlines():
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+def run_stage(stage: str, data_dir: Path) -> dict:
+    """Run one stage on `data_dir` (in the current process) and return its timing record."""
+    sys.path.insert(0, str(SRC_DIR))
+    work_dir = data_dir / "src"  # steps write logs / results relative to cwd
+    work_dir.mkdir(exist_ok=True)
+    os.chdir(work_dir)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        start = time.perf_counter()
+        if stage == 'step1':
+            from step1_data_filter import run_step1_main
+            out = run_step1_main(data_dir / "original", data_dir / "filtered", include_power=True, workers=1)
+            rows = parquet_rows(out.glob("*.parquet"))
+        elif stage == 'step2':
+            from step2_data_decomposed import run_step2
+            in_dir = data_dir / "filtered" / "parquet_active_power"
+            run_step2(in_dir, data_dir / "decomposed")
+            rows = parquet_rows(in_dir.glob("*.parquet"))
+        elif stage == 'step3_1':
+            from step3_1_data_split_chunk import run_step3
+            run_step3(data_dir / "decomposed", data_dir / "chunked", include_power=True, plot_mode='none')
+            rows = parquet_rows((data_dir / "decomposed").glob("*.parquet"))
+        elif stage == 'step3_2':
+            from step3_2_data_split_chunk_operating_visualization import process_motor_dir
+            motor_dirs = sorted(p for p in (data_dir / "chunked").iterdir() if p.is_dir())
+            for motor_dir in motor_dirs:
+                process_motor_dir(motor_dir, data_dir / "well_plots", plot_specs=[])
+            rows = parquet_rows((data_dir / "chunked").rglob("*.parquet"))
+        elif stage == 'step4':
+            from step4_select_max_diffrate_date import run_step4
+            run_step4(data_dir / "chunked", data_dir / "analysis_results")
+            with open(data_dir / "chunked" / "saved_24h_summary.csv") as f:
+                rows = sum(1 for _ in f) - 1
+        else:
+            raise ValueError(f"Unknown stage: {stage}")
+        seconds = time.perf_counter() - start
+
+    return {'stage': stage, 'seconds': seconds, 'rows': rows,
+            'rows_per_s': rows / seconds if seconds > 0 else None, 'peak_rss_mb': peak_rss_mb()}
+
+
+def run_stage_isolated(stage: str, data_dir: Path) -> dict:
+    """Run a stage in a fresh (spawned) process so its peak RSS is not mixed with other stages."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run_stage, stage, data_dir).result()
+
+
+def git_commit() -> str:
+    """Short commit hash of the working tree ('+dirty' if it has uncommitted changes)."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SRC_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--', str(SRC_DIR)], cwd=SRC_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ('+dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def load_history() -> list[dict]:
+    if not HISTORY_PATH.exists():
+        return []
+    return [json.loads(line) for line in HISTORY_PATH.read_text(encoding='utf-8').splitlines() if line.strip()]
+
+
+def previous_run(history: list[dict], commit: str, rows_per_file: int, stage: str) -> dict | None:
+    """Latest record of the same scale and stage from another commit."""
+    for rec in reversed(history):
+        if rec['commit'] != commit and rec['rows_per_file'] == rows_per_file and rec['stage'] == stage:
+            return rec
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('rows_per_file', nargs='*', type=int, default=[250_000, 1_000_000])
+    parser.add_argument('--files-per-line', type=int, default=2)
+    parser.add_argument('--no-save', action='store_true', help="do not append to results/pipeline_history.jsonl")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    history = load_history()
+    records = []
+
+    print(f"commit {commit} | {platform.python_version()} | {os.cpu_count()} cpu")
+    print(f"{'rows/file':>10} {'stage':<8} {'seconds':>9} {'rows':>11} {'rows/s':>12} {'peak RSS':>10} {'vs prev':>9}")
+    for rows_per_file in args.rows_per_file:
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = Path(tmp)
+            make_dataset(data_dir / "original", rows_per_file, args.files_per_line)
+
+            for stage in STAGES:
+                rec = run_stage_isolated(stage, data_dir)
+                rec.update({'commit': commit, 'date': datetime.now().isoformat(timespec='seconds'),
+                            'rows_per_file': rows_per_file, 'files_per_line': args.files_per_line,
+                            'cpus': os.cpu_count(), 'python': platform.python_version()})
+                records.append(rec)
+
+                prev = previous_run(history, commit, rows_per_file, stage)
+                change = f"{(rec['seconds'] / prev['seconds'] - 1) * 100:+.0f}%" if prev else '-'
+                print(f"{rows_per_file:>10,} {stage:<8} {rec['seconds']:>9.2f} {rec['rows']:>11,} "
+                      f"{rec['rows_per_s'] or 0:>12,.0f} {rec['peak_rss_mb']:>8.0f}MB {change:>9}")
+
+    if not args.no_save:
+        HISTORY_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(HISTORY_PATH, 'a', encoding='utf-8') as f:
+            for rec in records:
+                f.write(json.dumps(rec) + '\n')
+        print(f"Saved: {HISTORY_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import sys
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+from plot_render import render_spec
+
+'''
+Benchmark: render time and PNG size of the step3 plots with all points vs. min-max / LTTB downsampling.
+
+A synthetic 24h chunk (~23,500 points, idle night + operating day with steps) is rendered as the
+step3_1 'daily' plot and the step3_2 'operating' plot. 'pixel diff' is the share of pixels that
+differ from the all-points image (after converting both to grayscale), as a visual-identity check.
+
+Usage:
+    python bench_plot_downsample.py [dpi]
+'''
+
+
+def make_chunk(n_rows: int = 23_500, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    t = pd.Timestamp("2024-06-05") + pd.to_timedelta(np.linspace(0, 86_399, n_rows), unit='s')
+    hours = (t - t[0]).total_seconds().to_numpy() / 3600
+    running = (hours > 7) & (hours < 19)
+    rate = np.where(running, 2.0 + (hours > 12) * 1.5, 0.0) * rng.uniform(0.8, 1.2, n_rows)
+    energy = 217_286.2 + np.cumsum(rate)
+    return pd.DataFrame({'collect_time': t, 'Load_Total_Power_Consumption': energy.astype(np.float32)})
+
+
+def render(spec: dict, data: pd.DataFrame, repeat: int = 3) -> tuple[float, int]:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render_spec(spec, data=data)
+        best = min(best, time.perf_counter() - start)
+    return best, Path(spec['out_path']).stat().st_size
+
+
+def pixel_diff(a: Path, b: Path) -> float:
+    img_a = np.asarray(Image.open(a).convert('L'), dtype=np.int16)
+    img_b = np.asarray(Image.open(b).convert('L'), dtype=np.int16)
+    return float((np.abs(img_a - img_b) > 32).mean())
+
+
+def main():
+    dpi = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    data = make_chunk()
+    out_dir = Path(tempfile.mkdtemp(prefix="bench_plot_"))
+
+    print(f"points: {len(data):,}   dpi: {dpi}")
+    print(f"{'plot':<10} {'method':<8} {'time [s]':>9} {'png [KB]':>9} {'pixel diff':>11}")
+    for kind in ('daily', 'operating'):
+        base = None
+        for method in ('none', 'minmax', 'lttb'):
+            spec = {
+                'kind': kind,
+                'source': None,
+                'out_path': out_dir / f"{kind}_{method}.png",
+                'dpi': dpi,
+                'title': f"bench | {kind}",
+                'target_column': 'Load_Total_Power_Consumption',
+                'text_lines': ["Total diff (24h): bench"],
+                'downsample': method,
+            }
+            elapsed, size = render(spec, data)
+            if base is None:
+                base = spec['out_path']
+            diff = pixel_diff(base, spec['out_path'])
+            print(f"{kind:<10} {method:<8} {elapsed:>9.3f} {size / 1e3:>9.1f} {diff:>10.4%}")
+
+
+if __name__ == "__main__":
+    main()
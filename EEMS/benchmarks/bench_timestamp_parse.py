@@ -0,0 +1,62 @@
+import sys
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+from timestamp_utils import parse_timestamps, clear_format_cache
+
+'''
+Micro-benchmark: format='mixed' vs the cached fixed-format parser on a 1M-row TORAY-like collect_time column.
+
+The column mimics the exports: ~3.67 s sampling, millisecond fractions ('2024-06-04 20:36:43.223'),
+and a small share of rows without a fraction ('2025-05-29 10:46:15') that take the slow path.
+
+Usage:
+    python bench_timestamp_parse.py [n_rows]
+'''
+
+
+def make_collect_time(n_rows: int, seed: int = 0) -> pd.Series:
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2024-06-04 20:36:43.223")
+    steps = rng.normal(3670, 50, n_rows).clip(1000).astype('int64')
+    times = start + pd.to_timedelta(np.cumsum(steps), unit='ms')
+    values = pd.Series(times.strftime('%Y-%m-%d %H:%M:%S.%f').str[:-3])
+    no_fraction = rng.random(n_rows) < 0.001
+    values[no_fraction] = values[no_fraction].str[:-4]
+    return values
+
+
+def time_call(func, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    values = make_collect_time(n_rows)
+
+    def fast():
+        clear_format_cache()
+        return parse_timestamps(values)
+
+    expected = pd.to_datetime(values, format='mixed')
+    assert parse_timestamps(values).equals(expected)
+
+    t_mixed = time_call(lambda: pd.to_datetime(values, format='mixed'))
+    t_fast = time_call(fast)
+
+    print(f"rows:                  {n_rows:,}")
+    print(f"format='mixed':        {t_mixed:.3f} s")
+    print(f"parse_timestamps:      {t_fast:.3f} s")
+    print(f"speedup:               {t_mixed / t_fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import sys
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+from pathlib import Path
+
+'''
+Synthetic TORAY csv exports for benchmarks (the plant exports are not shipped with the repo).
+
+Each file looks like 'Toray_{line}_{yymmdd}_{i}_with_header.csv' with the export columns the
+pipeline reads ('collect_time', 'machine_code', 'Load_Total_Power_Consumption', 'Load_Active_Power')
+plus a few extra measurement columns that step1 skips. Rows of all machines of a line are interleaved
+in time, like the real exports:
+- inner: FEMS11_01, FEMS11_02 (P1730A/B); outer: FEMS11_01, FEMS11_02, FEMS12_01, FEMS12_02 (P7412A/B MCC/EXT)
+- ~3.67 s sampling per machine with jitter, millisecond timestamps
+- operating hours (day shift, load steps) and idle nights; some fully idle days
+- Load_Active_Power (W) and the cumulative counter Load_Total_Power_Consumption (Wh) integrated from it
+- occasional data gaps of 1-6 hours (the day is then rejected by step3)
+Consecutive files of a line continue in time, so step2 merges several files per motor.
+
+Usage:
+    python make_synthetic_toray.py OUTPUT_DIR [rows_per_file] [files_per_line]
+'''
+
+MACHINE_CODES = {
+    'inner': ['FEMS11_01', 'FEMS11_02'],
+    'outer': ['FEMS11_01', 'FEMS11_02', 'FEMS12_01', 'FEMS12_02'],
+}
+EXTRA_COLUMNS = ['Voltage_R', 'Voltage_S', 'Voltage_T', 'Current_R', 'Current_S', 'Current_T', 'Power_Factor']
+
+SAMPLE_MS = 3670
+START = pd.Timestamp("2024-06-01 00:00:00")
+
+
+def machine_series(n_rows: int, start: pd.Timestamp, rng: np.random.Generator,
+                   rated_kw: float, idle_day_share: float = 0.1, gap_every_days: float = 20) -> pd.DataFrame:
+    """One machine's rows: timestamps, active power (W) and its cumulative energy (Wh)."""
+    steps = rng.normal(SAMPLE_MS, 60, n_rows).clip(1000).astype(np.int64)
+    # Data gaps of 1-6 hours, about one every `gap_every_days` days
+    gaps = rng.random(n_rows) < SAMPLE_MS / (gap_every_days * 86_400_000)
+    steps[gaps] += rng.integers(3_600_000, 6 * 3_600_000, gaps.sum())
+    t = start + pd.to_timedelta(np.cumsum(steps), unit='ms')
+
+    hours = t.hour.to_numpy() + t.minute.to_numpy() / 60
+    days = (t.normalize() - start.normalize()).days.to_numpy()
+    idle_days = rng.random(days.max() + 1) < idle_day_share
+    running = (hours >= 7) & (hours < 19) & ~idle_days[days]
+
+    # Load level changes a few times a day (steps), plus noise; idle consumption ~2% of rated power
+    level = rng.uniform(0.5, 1.0, days.max() * 4 + 4)[days * 4 + (hours // 6).astype(np.int64)]
+    power = np.where(running, rated_kw * 1000 * level, rated_kw * 20) * rng.normal(1, 0.03, n_rows)
+    power = power.clip(0)
+
+    # Cumulative counter = trapezoidal integral of the power (Wh)
+    dt_h = np.diff(t.to_numpy()).astype('timedelta64[ms]').astype(np.float64) / 3_600_000
+    energy = rng.uniform(1e5, 1e6) + np.r_[0.0, np.cumsum((power[1:] + power[:-1]) / 2 * dt_h)]
+    return pd.DataFrame({'collect_time': t, 'Load_Active_Power': power, 'Load_Total_Power_Consumption': energy})
+
+
+def make_line_files(output_dir: Path, line: str, rows_per_file: int, n_files: int, seed: int = 0) -> list[Path]:
+    """Write `n_files` consecutive csv exports of one line and return their paths."""
+    rng = np.random.default_rng(seed)
+    codes = MACHINE_CODES[line]
+    rows_per_machine = rows_per_file // len(codes)
+
+    # Whole history per machine, then cut into consecutive files by time
+    machines = {
+        code: machine_series(rows_per_machine * n_files, START, rng, rated_kw=rng.uniform(30, 90))
+        for code in codes
+    }
+    df = pd.concat([m.assign(machine_code=code) for code, m in machines.items()], ignore_index=True)
+    df = df.sort_values('collect_time', kind='stable').reset_index(drop=True)
+    for col in EXTRA_COLUMNS:
+        df[col] = rng.normal(1.0, 0.01, len(df)).round(4)
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i, part in enumerate(np.array_split(np.arange(len(df)), n_files)):
+        chunk = df.iloc[part]
+        stamps = np.char.replace(np.datetime_as_string(chunk['collect_time'].to_numpy(), unit='ms'), 'T', ' ')
+        chunk = chunk.assign(collect_time=stamps)
+        stamp = pd.Timestamp(df['collect_time'].iloc[part[0]]).strftime('%y%m%d')
+        path = output_dir / f"Toray_{line}_{stamp}_{i + 1}_with_header.csv"
+        columns = ['collect_time', 'machine_code', *EXTRA_COLUMNS, 'Load_Active_Power', 'Load_Total_Power_Consumption']
+        with open(path, 'wb') as f:
+            f.write((','.join(columns) + '\n').encode())
+            pv.write_csv(pa.Table.from_pandas(chunk[columns].round(3), preserve_index=False), f,
+                         pv.WriteOptions(include_header=False, quoting_style='none'))
+        paths.append(path)
+    return paths
+
+
+def make_dataset(output_dir: Path, rows_per_file: int = 1_000_000, files_per_line: int = 2, seed: int = 0) -> list[Path]:
+    """Write inner and outer exports (`files_per_line` files each) into `output_dir`."""
+    return (make_line_files(output_dir, 'inner', rows_per_file, files_per_line, seed)
+            + make_line_files(output_dir, 'outer', rows_per_file, files_per_line, seed + 1))
+
+
+def main():
+    output_dir = Path(sys.argv[1])
+    rows_per_file = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+    files_per_line = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    for path in make_dataset(output_dir, rows_per_file, files_per_line):
+        print(f"{path}  ({path.stat().st_size / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,135 @@
+import os
 import time
 from pathlib import Path
+from natsort import os_sorted
 
 # STEP 함수 임포트 (이미 작성한 각 단계 코드를 함수로 만든 상태라고 가정)
-from step1_data_filter import run_step1_main
-from step2_data_decomposed import run_step2
-from step3_1_data_split_chunk import run_step3
+from step1_data_filter import run_step1_main, make_output_filename
+from step2_data_decomposed import run_step2, append_decomposed
+from step3_1_data_split_chunk import run_step3, get_motor_name
 from step4_select_max_diffrate_date import run_step4
+from run_manifest import new_manifest, load_manifest, save_manifest, is_fresh, appended_inputs, record
+from stage_metrics import configure_metrics, stage
 
-def main():
+def main(include_power: bool = False, incremental: bool = True, intermediate: str = 'parquet', append: bool = True,
+         windows: dict | None = None, top_k: int | None = None):
     start_time = time.time()
     base_dir = Path.cwd().parents[1] / "data"
 
+    # Incremental mode: skip every step/file whose inputs are unchanged since the last run
+    manifest_path = base_dir / "run_manifest.json"
+    manifest = load_manifest(manifest_path) if incremental else new_manifest()
+    params = {'include_power': include_power}
+    # Steps that write the step handoffs also depend on their format ('parquet' or 'ipc' sidecars)
+    handoff_params = {**params, 'intermediate': intermediate}
+    # Step3 also depends on the extra summary resolutions (window_engine.py), if any
+    step3_params = {**handoff_params, 'windows': windows} if windows else handoff_params
+    # Step4 writes every date pair per motor pair by default (the original csv, O(n^2) rows, rescored
+    # on each run); top_k=1 keeps only the best pair, the score store's running best: O(n) per new date
+    step4_params = {**params, 'top_k': top_k}
+
+    # Per-stage metrics (wall / cpu time, peak memory, rows, bytes, files) as JSON lines
+    run_id = configure_metrics(Path.cwd() / "preprocessing_logs" / "pipeline_metrics.jsonl")
+
     print("🚀 Step 1: Filtering & Convert CSV → Parquet")
-    step1_output = run_step1_main(
-        input_dir=base_dir / "original",
-        output_dir=base_dir / "filtered" / "TORAY"
-    )
+    csv_files = os_sorted(list((base_dir / "original").glob("*.csv")))
+    stale_csv_files = [f for f in csv_files if not is_fresh(manifest, f"step1/{f.name}", [f], params)]
+    step1_output = base_dir / "filtered" / "TORAY" / ("parquet_active_power" if include_power else "parquet")
+    if stale_csv_files:
+        with stage('step1', files=len(stale_csv_files)) as m:
+            step1_output = run_step1_main(
+                input_dir=base_dir / "original",
+                output_dir=base_dir / "filtered" / "TORAY",
+                include_power=include_power,
+                workers=os.cpu_count() or 1,
+                csv_files=stale_csv_files,
+            )
+            out_paths = [step1_output / make_output_filename(f) for f in stale_csv_files]
+            for f, out_path in zip(stale_csv_files, out_paths):
+                record(manifest, f"step1/{f.name}", [f], [out_path] if out_path.exists() else [], params)
+            save_manifest(manifest, manifest_path)
+            m['bytes_read'] = sum(f.stat().st_size for f in stale_csv_files)
+            m['bytes_written'] = sum(p.stat().st_size for p in out_paths if p.exists())
+    print(f"   {len(stale_csv_files)} / {len(csv_files)} files converted")
 
     print("🚀 Step 2: Decompose & Merge Motors")
-    step2_output = run_step2(
-        input_dir=step1_output,
-        output_dir=base_dir / "decomposed" / "TORAY"
-    )
+    filtered_files = os_sorted(list(step1_output.glob("*.parquet")))
+    step2_output = base_dir / "decomposed" / "TORAY"
+    # Append mode: only new exports since the last run (every earlier one unchanged) -> append their rows
+    new_filtered_files = appended_inputs(manifest, "step2", filtered_files, handoff_params) if append else None
+    # Motors whose step3 results were up to date before the append (only their new days are recomputed)
+    step3_up_to_date = {f.name for f in step2_output.glob("*.parquet")
+                        if is_fresh(manifest, f"step3/{f.name}", [f], step3_params)}
+    since = {}
+    if is_fresh(manifest, "step2", filtered_files, handoff_params):
+        print("   ⏭ inputs unchanged, skipped")
+    elif new_filtered_files:
+        with stage('step2', files=len(new_filtered_files), mode='append') as m:
+            appended = append_decomposed(new_filtered_files, step2_output, intermediate=intermediate)
+            since = {
+                f"TORAY_{motor}": info['since'] for motor, info in appended.items()
+                if info['path'].name in step3_up_to_date
+            }
+            record(manifest, "step2", filtered_files, sorted(step2_output.glob("*.parquet")), handoff_params)
+            save_manifest(manifest, manifest_path)
+            m['bytes_read'] = sum(f.stat().st_size for f in new_filtered_files)
+            m['rows_out'] = sum(info['rows_added'] for info in appended.values())
+        print(f"   ➕ {len(new_filtered_files)} new file(s) appended to {len(appended)} motors")
+    else:
+        with stage('step2', files=len(filtered_files)) as m:
+            step2_output = run_step2(
+                input_dir=step1_output,
+                output_dir=step2_output,
+                intermediate=intermediate
+            )
+            record(manifest, "step2", filtered_files, sorted(step2_output.glob("*.parquet")), handoff_params)
+            save_manifest(manifest, manifest_path)
+            m['bytes_read'] = sum(f.stat().st_size for f in filtered_files)
+            m['bytes_written'] = sum(p.stat().st_size for p in step2_output.glob("*.parquet"))
 
     print("🚀 Step 3: Split into 24h Chunks")
-    step3_output = run_step3(
-        input_dir=step2_output,
-        output_dir=base_dir / "chunked" / "TORAY"
-    )
+    motor_files = sorted(step2_output.glob("*.parquet"))
+    step3_output = base_dir / "chunked" / "TORAY"
+    stale_motor_files = [f for f in motor_files if not is_fresh(manifest, f"step3/{f.name}", [f], step3_params)]
+    if stale_motor_files:
+        with stage('step3', files=len(stale_motor_files)) as m:
+            step3_output = run_step3(
+                input_dir=step2_output,
+                output_dir=step3_output,
+                include_power=include_power,
+                parquet_files=stale_motor_files,
+                intermediate=intermediate,
+                since=since,
+                windows=windows,
+                workers=os.cpu_count() or 1,
+            )
+            for f in stale_motor_files:
+                record(manifest, f"step3/{f.name}", [f], [step3_output / get_motor_name(f.stem)], step3_params)
+            save_manifest(manifest, manifest_path)
+            m['bytes_read'] = sum(f.stat().st_size for f in stale_motor_files)
+    print(f"   {len(stale_motor_files)} / {len(motor_files)} motors processed"
+          + (f" ({len(since)} from their first new day only)" if since else ""))
 
     print("🚀 Step 4: Select Max Diff Rate Dates")
-    run_step4(
-        input_dir=step3_output,
-        output_dir=base_dir / "analysis_results"
-    )
+    saved_summary = step3_output / "saved_24h_summary.csv"
+    step4_output = base_dir / "analysis_results"
+    if is_fresh(manifest, "step4", [saved_summary], step4_params):
+        print("   ⏭ inputs unchanged, skipped")
+    else:
+        with stage('step4', files=1) as m:
+            run_step4(
+                input_dir=step3_output,
+                output_dir=step4_output,
+                top_k=top_k,
+                incremental=incremental
+            )
+            record(manifest, "step4", [saved_summary], sorted(step4_output.glob("*.csv")), step4_params)
+            save_manifest(manifest, manifest_path)
+            m['bytes_read'] = saved_summary.stat().st_size
 
     elapsed = time.time() - start_time
     print(f"✅ All steps completed in {elapsed:.2f} seconds")
+    print(f"   Stage metrics (run {run_id}): {Path.cwd() / 'preprocessing_logs' / 'pipeline_metrics.jsonl'}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,140 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from pathlib import Path
+
+'''
+Memory-mapped Arrow IPC sidecars for step handoffs.
+
+Parquet stays the archival format. With `intermediate='ipc'`, a step also writes an uncompressed
+Arrow IPC file (Feather v2) next to each parquet output:
+
+    TORAY_P1730A_filtered_decomposed.parquet  ->  TORAY_P1730A_filtered_decomposed.arrow
+    24h/chunks.parquet                        ->  24h/chunks.arrow  (one record batch per row group)
+
+The next step memory-maps the sidecar instead of decompressing and decoding the parquet file, so
+on the same host a handoff skips decompression and parquet decoding. A sidecar is only used while it
+is at least as new as its parquet file; otherwise readers fall back to the parquet file. Writers in
+'parquet' mode remove the sidecar an earlier 'ipc' run left next to a file they rewrite (`write_sidecar`).
+
+The read itself is zero-copy (`read_ipc` returns a Table over the memory map), but the steps work
+on DataFrames: `read_intermediate` and `chunk_store.read_chunk_days` still convert with
+`to_pandas()`, which copies every column once and decodes the dictionary columns ('machine_code')
+to objects. So the handoff saves the parquet decode, not that copy; callers that can work on Arrow
+data should use `read_ipc` directly.
+'''
+
+INTERMEDIATE_FORMATS = ('parquet', 'ipc')
+IPC_SUFFIX = ".arrow"
+
+
+def check_intermediate(intermediate: str):
+    if intermediate not in INTERMEDIATE_FORMATS:
+        raise ValueError(f"Unknown intermediate format: {intermediate} (expected one of {INTERMEDIATE_FORMATS})")
+
+
+def ipc_path(parquet_path: Path) -> Path:
+    """Sidecar path of a parquet file (same name, '.arrow')."""
+    return Path(parquet_path).with_suffix(IPC_SUFFIX)
+
+
+def has_fresh_ipc(parquet_path: Path) -> bool:
+    """True if the parquet file has a sidecar that is not older than the parquet file itself."""
+    parquet_path, sidecar = Path(parquet_path), ipc_path(parquet_path)
+    if not sidecar.exists():
+        return False
+    return not parquet_path.exists() or sidecar.stat().st_mtime_ns >= parquet_path.stat().st_mtime_ns
+
+
+def open_ipc_writer(path: Path, schema: pa.Schema) -> ipc.RecordBatchFileWriter:
+    """
+    Uncompressed IPC file writer (batches can be memory-mapped without decoding).
+
+    An IPC file holds one dictionary per dictionary-encoded field, which may only grow (deltas);
+    batches built from different inputs go through `unify_dictionaries` first.
+    """
+    return ipc.new_file(path, schema, options=ipc.IpcWriteOptions(compression=None, emit_dictionary_deltas=True))
+
+
+def unify_dictionaries(table: pa.Table, dictionaries: dict[str, pa.Array]) -> pa.Table:
+    """
+    Re-encode the dictionary columns of `table` against the running dictionaries of one writer
+    (`dictionaries`, {column: values so far}, updated in place). New values are appended, so every
+    batch's dictionary extends the previous one and the IPC writer can emit it as a delta.
+    """
+    for i, field in enumerate(table.schema):
+        if not pa.types.is_dictionary(field.type):
+            continue
+        values = table.column(i).cast(field.type.value_type)
+        known = dictionaries.get(field.name, pa.array([], field.type.value_type))
+        # Whole dictionaries (not only the values present), like the parquet file keeps them
+        column = table.column(i)
+        unique = pc.unique(pa.concat_arrays([chunk.dictionary for chunk in column.chunks])
+                           if column.num_chunks else pa.array([], field.type.value_type))
+        known = pa.concat_arrays([known, unique.filter(pc.invert(pc.is_in(unique, known)))])
+        dictionaries[field.name] = known
+        indices = pc.index_in(values, known).cast(field.type.index_type).combine_chunks()
+        table = table.set_column(i, field, pa.DictionaryArray.from_arrays(indices, known))
+    return table
+
+
+def write_ipc(data: pd.DataFrame | pa.Table, path: Path) -> Path:
+    """Write a DataFrame / Table as an uncompressed IPC file (one record batch)."""
+    table = data if isinstance(data, pa.Table) else pa.Table.from_pandas(data, preserve_index=False)
+    table = table.combine_chunks()
+    with open_ipc_writer(path, table.schema) as writer:
+        writer.write_table(table)
+    return path
+
+
+def write_sidecar(data: pd.DataFrame | pa.Table, parquet_path: Path, intermediate: str) -> Path | None:
+    """
+    Write the IPC sidecar of a freshly written parquet file in 'ipc' mode; in 'parquet' mode remove
+    a sidecar left over from an earlier 'ipc' run instead. Returns the sidecar path, if written.
+    """
+    sidecar = ipc_path(parquet_path)
+    if intermediate == 'ipc':
+        return write_ipc(data, sidecar)
+    sidecar.unlink(missing_ok=True)
+    return None
+
+
+def open_ipc(path: Path) -> ipc.RecordBatchFileReader:
+    """Open an IPC file through a memory map (batches are read without copying)."""
+    return ipc.open_file(pa.memory_map(str(path), 'r'))
+
+
+def read_ipc(source: Path | ipc.RecordBatchFileReader, columns: list[str] | None = None,
+             batch: int | None = None) -> pa.Table:
+    """
+    Return the rows of an IPC file (path, or reader from `open_ipc`) as a zero-copy Table.
+
+    `batch` selects a single record batch (e.g. one day of a chunk store sidecar).
+    """
+    reader = source if isinstance(source, ipc.RecordBatchFileReader) else open_ipc(source)
+    if batch is not None:
+        table = pa.Table.from_batches([reader.get_batch(batch)])
+    else:
+        table = reader.read_all()
+    return table.select(columns) if columns is not None else table
+
+
+def read_intermediate(parquet_path: Path, columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    Read a step output through its fresh IPC sidecar if there is one, else from parquet.
+
+    The sidecar is memory-mapped, but `to_pandas()` still copies it into the DataFrame (and decodes
+    dictionary columns); use `read_ipc` for a zero-copy Table.
+    """
+    if has_fresh_ipc(parquet_path):
+        return read_ipc(ipc_path(parquet_path), columns).to_pandas()
+    return pd.read_parquet(parquet_path, columns=columns)
+
+
+def read_intermediate_row_group(parquet_path: Path, row_group: int, columns: list[str] | None = None) -> pd.DataFrame:
+    """Read one row group of a parquet file (the same-numbered batch of its fresh IPC sidecar if there is one)."""
+    if has_fresh_ipc(parquet_path):
+        return read_ipc(ipc_path(parquet_path), columns, batch=row_group).to_pandas()
+    return pq.ParquetFile(parquet_path).read_row_group(row_group, columns=columns).to_pandas()
@@ -0,0 +1,139 @@
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+
+from arrow_ipc import check_intermediate, ipc_path, has_fresh_ipc, open_ipc, open_ipc_writer, read_ipc
+
+'''
+Consolidated per-motor chunk store.
+
+Instead of one small parquet file per motor-day, step3_1 can write every valid day of a motor
+into a single parquet file, one row group per day, next to a JSON day -> row-group index:
+
+    {output_dir}/{motor}/24h/chunks.parquet
+    {output_dir}/{motor}/24h/chunks_index.json
+
+Readers (step3_2, step4) open the file once and read only the row groups of the days they need.
+With `intermediate='ipc'` a 24h/chunks.arrow sidecar holds the same days as record batches (batch i =
+row group i); readers memory-map it instead of decoding the parquet row groups (arrow_ipc.py).
+'''
+
+CHUNK_LAYOUTS = ('files', 'store')
+STORE_NAME = "chunks.parquet"
+INDEX_NAME = "chunks_index.json"
+
+
+def store_paths(motor_dir: Path) -> tuple[Path, Path]:
+    """Return (parquet path, index path) of a motor's chunk store ({motor_dir}/24h/...)."""
+    chunk_dir = Path(motor_dir) / "24h"
+    return chunk_dir / STORE_NAME, chunk_dir / INDEX_NAME
+
+
+def has_chunk_store(motor_dir: Path) -> bool:
+    """True if `motor_dir` holds a chunk store (parquet file and index)."""
+    store_path, index_path = store_paths(motor_dir)
+    return store_path.exists() and index_path.exists()
+
+
+def write_chunk_store(motor_dir: Path, chunks: list[tuple[str, str, pd.DataFrame]],
+                      intermediate: str = 'parquet') -> Path:
+    """
+    Write the valid days of one motor as a single parquet file, one row group per day.
+
+    Parameters
+    ----------
+    motor_dir : Path
+        Motor output directory (e.g. chunked/.../TORAY_P1730A).
+    chunks : list[tuple[str, str, pd.DataFrame]]
+        (date 'YYYY-MM-DD', chunk name '{start}_to_{end}', rows of that day) in time order.
+    intermediate : str, optional
+        'ipc' also writes the days as record batches of an uncompressed Arrow IPC sidecar.
+
+    Returns
+    -------
+    Path
+        Path of the parquet file. The index ({date: {'row_group', 'num_rows', 'name'}}) is written
+        next to it; an existing store is replaced.
+    """
+    check_intermediate(intermediate)
+    store_path, index_path = store_paths(motor_dir)
+    store_path.parent.mkdir(parents=True, exist_ok=True)
+
+    index = {}
+    writer = ipc_writer = None
+    try:
+        for row_group, (date, name, df) in enumerate(chunks):
+            table = pa.Table.from_pandas(df, preserve_index=False).combine_chunks()
+            if writer is None:
+                writer = pq.ParquetWriter(store_path, table.schema)
+                if intermediate == 'ipc':
+                    ipc_writer = open_ipc_writer(ipc_path(store_path), table.schema)
+                else:
+                    ipc_path(store_path).unlink(missing_ok=True)  # sidecar of an earlier 'ipc' run
+            writer.write_table(table, row_group_size=max(table.num_rows, 1))
+            if ipc_writer is not None:
+                # One record batch per day, numbered like the row groups
+                ipc_writer.write_batch(table.to_batches()[0])
+            index[date] = {'row_group': row_group, 'num_rows': table.num_rows, 'name': name}
+    finally:
+        # The sidecar is closed last, so it is never older than the parquet file
+        for w in (writer, ipc_writer):
+            if w is not None:
+                w.close()
+
+    if writer is None:
+        store_path.unlink(missing_ok=True)
+        ipc_path(store_path).unlink(missing_ok=True)
+    index_path.write_text(json.dumps(index, indent=2), encoding='utf-8')
+    return store_path
+
+
+def read_chunk_index(motor_dir: Path) -> dict[str, dict]:
+    """Return the day -> {'row_group', 'num_rows', 'name'} index of a motor's chunk store."""
+    _, index_path = store_paths(motor_dir)
+    return json.loads(index_path.read_text(encoding='utf-8'))
+
+
+def read_chunk_days(motor_dir: Path, dates: list[str] | None = None,
+                    columns: list[str] | None = None) -> dict[str, pd.DataFrame]:
+    """
+    Read some (or all) days of a motor's chunk store with a single file open (memory-mapped
+    IPC sidecar if there is a fresh one).
+
+    Parameters
+    ----------
+    motor_dir : Path
+        Motor output directory.
+    dates : list[str] | None, optional
+        'YYYY-MM-DD' days to read (default: every stored day). Days that are not in the store are skipped.
+    columns : list[str] | None, optional
+        Columns to read (default: all).
+
+    Returns
+    -------
+    dict[str, pd.DataFrame]
+        {date: rows of that day}, in time order. Days read from the sidecar are still copied
+        by `to_pandas()` (see arrow_ipc.py).
+    """
+    store_path, _ = store_paths(motor_dir)
+    index = read_chunk_index(motor_dir)
+    if dates is None:
+        dates = list(index)
+    dates = sorted(str(d) for d in dates if str(d) in index)
+    if not dates:
+        return {}
+
+    if has_fresh_ipc(store_path):
+        reader = open_ipc(ipc_path(store_path))
+        return {
+            date: read_ipc(reader, columns, batch=index[date]['row_group']).to_pandas()
+            for date in dates
+        }
+
+    parquet_file = pq.ParquetFile(store_path)
+    return {
+        date: parquet_file.read_row_group(index[date]['row_group'], columns=columns).to_pandas()
+        for date in dates
+    }
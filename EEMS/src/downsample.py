@@ -0,0 +1,132 @@
+import numpy as np
+
+'''
+Shape-preserving downsampling for time-series plots.
+
+A 24h chunk has ~23,500 points but the plot area is only a few thousand pixels wide, so most
+markers land on the same pixel columns. Both methods return *indices* into the original series,
+so any aligned column (highlight masks, derivatives, timestamps) can be sliced the same way.
+
+- min-max: per pixel-wide time bin keep the first, last, min and max point. Peaks, steps
+  and isolated spikes survive exactly (the drawn envelope of each pixel column is unchanged).
+- LTTB (Largest-Triangle-Three-Buckets): keeps the point of each bucket that forms the largest
+  triangle with its neighbours; smoother look for line plots with a fixed point budget.
+
+NaN points are never selected, but the first index of every NaN run between two valid points is
+kept as a sentinel, so matplotlib still breaks the line at the gap instead of bridging it.
+'''
+
+
+def _as_float(x: np.ndarray) -> np.ndarray:
+    """datetime64 / numeric -> float64 (datetimes as int64 ns)."""
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def _gap_sentinels(isnan: np.ndarray) -> np.ndarray:
+    """First index of each NaN run that lies between two valid points (leading/trailing runs are no gap)."""
+    starts = np.flatnonzero(isnan & ~np.r_[False, isnan[:-1]])
+    valid = np.flatnonzero(~isnan)
+    if len(valid) == 0:
+        return starts[:0]
+    return starts[(starts > valid[0]) & (starts < valid[-1])]
+
+
+def minmax_indices(x: np.ndarray, y: np.ndarray, n_bins: int) -> np.ndarray:
+    """
+    Indices of the first/last/min/max point of each of `n_bins` equal-width x bins.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Sorted x values (numeric or datetime64).
+    y : np.ndarray
+        y values; NaN points are never selected (each gap keeps one NaN sentinel index).
+    n_bins : int
+        Number of bins (about the plot width in pixels).
+
+    Returns
+    -------
+    np.ndarray
+        Sorted unique indices (at most 4 * n_bins, plus one per NaN gap).
+    """
+    xf, yf = _as_float(x), np.asarray(y, dtype=np.float64)
+    isnan = np.isnan(yf)
+    valid, gaps = np.flatnonzero(~isnan), _gap_sentinels(isnan)
+    if len(valid) <= 4 * n_bins or n_bins < 1:
+        return np.union1d(valid, gaps)
+
+    xv, yv = xf[valid], yf[valid]
+    span = xv[-1] - xv[0]
+    if span <= 0:
+        bins = np.zeros(len(valid), dtype=np.int64)
+    else:
+        bins = np.minimum(((xv - xv[0]) / span * n_bins).astype(np.int64), n_bins - 1)
+
+    # x is sorted, so bins are non-decreasing: bin starts/ends give first/last of each bin
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    ends = np.r_[starts[1:], len(bins)] - 1
+
+    order = np.lexsort((yv, bins))  # within each bin: ascending y
+    first_in_order = np.searchsorted(bins[order], bins[starts], side='left')
+    last_in_order = np.searchsorted(bins[order], bins[starts], side='right') - 1
+    picked = np.concatenate([starts, ends, order[first_in_order], order[last_in_order]])
+    return np.union1d(valid[picked], gaps)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Indices selected by Largest-Triangle-Three-Buckets (first and last point always kept).
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Sorted x values (numeric or datetime64).
+    y : np.ndarray
+        y values; NaN points are never selected (each gap keeps one NaN sentinel index).
+    n_out : int
+        Number of points to keep (>= 3).
+
+    Returns
+    -------
+    np.ndarray
+        Sorted indices (n_out of them, or all valid points if there are fewer), plus one per NaN gap.
+    """
+    xf, yf = _as_float(x), np.asarray(y, dtype=np.float64)
+    isnan = np.isnan(yf)
+    valid, gaps = np.flatnonzero(~isnan), _gap_sentinels(isnan)
+    n = len(valid)
+    if n <= n_out or n_out < 3:
+        return np.union1d(valid, gaps)
+
+    xv, yv = xf[valid], yf[valid]
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)  # n_out - 2 inner buckets
+
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for k in range(n_out - 2):
+        lo, hi = edges[k], max(edges[k + 1], edges[k] + 1)
+        # Average point of the next bucket (the last point for the final bucket)
+        nlo, nhi = hi, (edges[k + 2] if k + 2 < len(edges) else n)
+        nhi = max(nhi, nlo + 1)
+        cx, cy = xv[nlo:nhi].mean(), yv[nlo:nhi].mean()
+
+        area = np.abs((xv[a] - cx) * (yv[lo:hi] - yv[a]) - (xv[a] - xv[lo:hi]) * (cy - yv[a]))
+        a = lo + int(np.argmax(area))
+        out[k + 1] = a
+
+    return np.union1d(valid[out], gaps)
+
+
+def plot_indices(x: np.ndarray, y: np.ndarray, n_points: int, method: str = 'minmax') -> np.ndarray:
+    """Downsample with `method` ('minmax' or 'lttb') to about `n_points`; n_points <= 0 keeps everything."""
+    if n_points <= 0:
+        return np.arange(len(x))
+    if method == 'minmax':
+        return minmax_indices(x, y, max(1, n_points // 4))
+    if method == 'lttb':
+        return lttb_indices(x, y, n_points)
+    raise ValueError(f"Unknown downsampling method: {method}")
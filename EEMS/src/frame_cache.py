@@ -0,0 +1,128 @@
+import os
+import json
+import hashlib
+import pandas as pd
+import pyarrow as pa
+from pathlib import Path
+from typing import Callable
+
+from arrow_ipc import IPC_SUFFIX, write_ipc, read_ipc
+
+'''
+On-disk cache of ready-to-use (parsed, rounded, sorted) frames.
+
+Entries are uncompressed Arrow IPC files, memory-mapped on a hit:
+
+    {cache_dir}/{slot}-{fingerprint}.arrow
+
+The slot is a hash of the resolved source path and the transform parameters (e.g. {'round': 's',
+'sort': 'collect_time', 'columns': None}); the fingerprint adds the source's size and mtime. A
+changed source or a different transform never hits an old entry, and storing a new entry removes
+the superseded ones of the same slot (same file and transform, older contents), so rebuilt
+sources do not leave orphans behind.
+
+The cache is bounded by size with LRU eviction: a hit refreshes the entry's mtime, and `evict`
+removes the least recently used entries until the directory fits in `max_bytes`. Entries are
+written to a temp file and renamed, so concurrent workers never see half-written entries.
+
+Frames are stored without their index (a RangeIndex comes back).
+'''
+
+CACHE_VERSION = 2
+DEFAULT_MAX_BYTES = 4 << 30  # 4 GiB
+
+
+def _digest(payload: dict) -> str:
+    return hashlib.blake2b(json.dumps(payload, sort_keys=True, default=str).encode(), digest_size=20).hexdigest()
+
+
+def frame_key(source: Path, params: dict) -> str:
+    """Cache key ('{slot}-{fingerprint}') of the frame built from `source` with the transform `params`."""
+    source = Path(source)
+    st = source.stat()
+    slot = _digest({'version': CACHE_VERSION, 'source': str(source.resolve()), 'params': params})
+    fingerprint = _digest({'slot': slot, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns})
+    return f"{slot}-{fingerprint}"
+
+
+def entry_path(cache_dir: Path, key: str) -> Path:
+    return Path(cache_dir) / f"{key}{IPC_SUFFIX}"
+
+
+def load_cached_frame(cache_dir: Path, key: str) -> pd.DataFrame | None:
+    """Return the cached frame of `key` (and mark it as recently used), or None on a miss."""
+    path = entry_path(cache_dir, key)
+    try:
+        df = read_ipc(path).to_pandas()
+        os.utime(path)  # LRU: mtime = last use
+    except (OSError, pa.ArrowInvalid):  # missing, evicted meanwhile or unreadable
+        return None
+    return df
+
+
+def store_cached_frame(cache_dir: Path, key: str, df: pd.DataFrame, max_bytes: int | None = None) -> Path:
+    """
+    Write `df` as the entry of `key` and remove the superseded entries of the same source and
+    transform; with `max_bytes`, evict old entries afterwards.
+    """
+    path = entry_path(cache_dir, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    write_ipc(df, tmp_path)
+    tmp_path.replace(path)
+    slot = key.split('-')[0]
+    for old in path.parent.glob(f"{slot}-*{IPC_SUFFIX}"):
+        if old != path:
+            old.unlink(missing_ok=True)
+    if max_bytes is not None:
+        evict(cache_dir, max_bytes)
+    return path
+
+
+def evict(cache_dir: Path, max_bytes: int = DEFAULT_MAX_BYTES) -> list[Path]:
+    """Remove the least recently used entries until the cache holds at most `max_bytes`; returns them."""
+    entries = []
+    for path in Path(cache_dir).glob(f"*{IPC_SUFFIX}"):
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime_ns, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = []
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        removed.append(path)
+    return removed
+
+
+def cached_frame(source: Path, build: Callable[[], pd.DataFrame], params: dict, cache_dir: Path | None,
+                 max_bytes: int = DEFAULT_MAX_BYTES) -> pd.DataFrame:
+    """
+    Return the frame `build()` makes from `source`, from the cache when possible.
+
+    Parameters
+    ----------
+    source : Path
+        File the frame is built from (its fingerprint is part of the key).
+    build : Callable[[], pd.DataFrame]
+        Reads `source` and applies the transform described by `params`.
+    params : dict
+        Transform parameters (JSON-serializable), part of the key.
+    cache_dir : Path | None
+        Cache directory; None builds the frame without caching.
+    max_bytes : int, optional
+        Size bound of the cache directory (default 4 GiB).
+    """
+    if cache_dir is None:
+        return build()
+    key = frame_key(source, params)
+    df = load_cached_frame(cache_dir, key)
+    if df is None:
+        df = build()
+        store_cached_frame(cache_dir, key, df, max_bytes)
+    return df
@@ -0,0 +1,371 @@
+import json
+import time
+import queue
+import numpy as np
+import pandas as pd
+import pyarrow.csv as pv
+from pathlib import Path
+from natsort import os_sorted
+
+from step2_data_decomposed import MOTOR_MAPS, get_line
+from step3_1_data_split_chunk import (add_energy_columns, compute_daily_table, merge_summary_csv, missing_row,
+                                      saved_row)
+from energy_integration import DEFAULT_MAX_GAP_SECONDS
+
+'''
+Live ingest: step3_1 daily chunks built online from MQTT telemetry.
+
+The collectors publish one JSON record per sample on 'eems/toray/{line}/{machine_code}':
+
+    {"collect_time": "2025-06-04 20:36:43.223", "Load_Total_Power_Consumption": 123456.7,
+     "Load_Active_Power": 41250.0}
+
+Records are routed to motors by (line, machine_code) with step2's MOTOR_MAPS (machine codes repeat
+across lines). Each motor keeps a rolling state: the rows of the open day (plus up to
+`grace_seconds` of the next one) and the last row of the previous day, whose cumulative energy and
+power carry over like in the batch run. Memory per motor is therefore bounded by about one day of
+samples. As soon as a record at or after midnight (+ grace) arrives, the open day is closed and
+judged by the same code as step3_1 (`add_energy_columns`, `compute_daily_table`); the closed day
+is emitted as
+
+    {'motor', 'date', 'valid', 'reasons', 'summary' (saved / missing summary row), 'chunk', 'target_column'}
+
+and, by default, written like step3_1's 'files' layout (chunk parquet + summary csv rows).
+Records of an already closed day arrive too late and are counted, not applied; so are malformed
+messages (bad JSON, no / bad 'collect_time', non-numeric values), which are skipped.
+
+Sources are plain iterables of (topic, payload) messages:
+- `mqtt_messages`: subscribe to a broker (paho-mqtt, imported lazily)
+- `replay_csv_messages`: stand-in broker replaying TORAY csv exports in time order (tests, backfill)
+
+Usage:
+    python live_ingest.py [--replay CSV_DIR] [--host localhost] [--port 1883]
+'''
+
+TOPIC = "eems/toray/+/+"
+SITE = "TORAY"
+VALUE_COLUMNS = ['Load_Total_Power_Consumption', 'Load_Active_Power']
+NS_PER_SECOND = 1_000_000_000
+NS_PER_DAY = 86_400 * NS_PER_SECOND
+
+
+def motor_routes(motor_maps: dict[str, dict[str, str]] = MOTOR_MAPS) -> dict[tuple[str, str], str]:
+    """(line, machine_code) -> motor name as written by step3_1 (e.g. 'TORAY_P1730A')."""
+    return {(line, code): f"{SITE}_{motor}" for line, mapping in motor_maps.items() for motor, code in mapping.items()}
+
+
+def parse_message(topic: str, payload: bytes | str) -> dict:
+    """
+    Decode one telemetry message into a record with 'line', 'machine_code', 'collect_time' (ns)
+    and the value columns. 'line' / 'machine_code' in the payload win over the topic levels.
+
+    Raises ValueError (also for invalid JSON), KeyError or TypeError for a malformed message.
+    """
+    record = json.loads(payload)
+    if not isinstance(record, dict):
+        raise ValueError(f"payload is not a JSON object: {payload!r}")
+    levels = topic.split('/')
+    if len(levels) >= 2:
+        record.setdefault('line', levels[-2])
+        record.setdefault('machine_code', levels[-1])
+    if not {'line', 'machine_code'} <= record.keys():
+        raise ValueError(f"no line / machine_code in topic {topic!r} or payload")
+
+    collect_time = record['collect_time']
+    if isinstance(collect_time, (int, float)):
+        record['collect_time'] = int(collect_time * 1_000_000)  # epoch milliseconds
+    elif isinstance(collect_time, str):
+        ts = np.datetime64(collect_time.replace('/', '-'), 'ns')
+        if np.isnat(ts):
+            raise ValueError(f"no collect_time: {collect_time!r}")
+        record['collect_time'] = int(ts.astype(np.int64))
+    else:
+        raise TypeError(f"collect_time must be a string or epoch milliseconds: {collect_time!r}")
+    for col in VALUE_COLUMNS:
+        if record.get(col) is not None:
+            record[col] = float(record[col])  # missing / null values stay NaN
+    return record
+
+
+def round_to_second(ns: int) -> int:
+    """Round ns to whole seconds, half to even (like step3_1's `dt.round('s')`)."""
+    q, r = divmod(ns, NS_PER_SECOND)
+    if r > NS_PER_SECOND // 2 or (r == NS_PER_SECOND // 2 and q % 2 == 1):
+        q += 1
+    return q * NS_PER_SECOND
+
+
+def new_motor_state(motor_name: str, machine_code: str) -> dict:
+    """Rolling state of one motor."""
+    return {
+        'motor': motor_name,
+        'machine_code': machine_code,
+        'open_day': None,       # first day (ns since epoch // NS_PER_DAY) not closed yet
+        'rows': {'collect_time': [], **{col: [] for col in VALUE_COLUMNS}},
+        'context': None,        # last row of the previous closed day (one-row DataFrame)
+        'late': 0,              # records of already closed days
+        'days': 0,              # closed days
+    }
+
+
+def close_day(state: dict, day: int, full_hours: set, include_power: bool,
+              max_gap_seconds: float = DEFAULT_MAX_GAP_SECONDS) -> dict:
+    """
+    Close `day` of a motor: judge its buffered rows exactly like step3_1 and return the day event.
+
+    The previous day's last row is put in front of the rows, so the interval crossing midnight,
+    the carried-over cumulative energy and 'avg_power' match a batch run over the whole history.
+    """
+    rows = pd.DataFrame(state['rows'])
+    in_day = (rows['collect_time'].to_numpy() // NS_PER_DAY) == day
+    state['rows'] = {col: rows.loc[~in_day, col].tolist() for col in state['rows']}  # rows of later days stay
+
+    day_rows = rows[in_day].assign(machine_code=state['machine_code'])
+    day_rows['collect_time'] = pd.to_datetime(day_rows['collect_time'].to_numpy(dtype='datetime64[ns]'))
+    for col in VALUE_COLUMNS:
+        day_rows[col] = day_rows[col].astype(np.float32)  # same dtype as the step1 parquet files
+    day_rows = day_rows.sort_values('collect_time', kind='stable').drop_duplicates()
+    context = state['context']
+    frame = pd.concat([context, day_rows], ignore_index=True) if context is not None else day_rows
+    frame = frame.reset_index(drop=True)
+    frame['date'] = frame['collect_time'].dt.date
+
+    target_column = add_energy_columns(frame, include_power, max_gap_seconds)
+    if include_power and context is not None:
+        # Integration restarted at the context row: continue its cumulative energy
+        frame[target_column] += context[target_column].iloc[0]
+
+    interval = frame['interval_consumption'] if include_power else None
+    daily = compute_daily_table(frame['collect_time'], frame[target_column], full_hours, carry_over=include_power,
+                                interval=interval)
+    entry = next(daily.iloc[[-1]].itertuples(index=False))
+    chunk = frame.iloc[entry.start_pos:entry.end_pos].reset_index(drop=True)
+
+    state['context'] = chunk.iloc[[-1]]
+    state['days'] += 1
+    valid = not entry.reasons
+    return {
+        'motor': state['motor'],
+        'date': str(entry.date),
+        'valid': valid,
+        'reasons': entry.reasons,
+        'summary': saved_row(state['motor'], entry) if valid else missing_row(state['motor'], entry),
+        'chunk': chunk,
+        'target_column': target_column,
+    }
+
+
+def add_record(state: dict, record: dict, full_hours: set, include_power: bool, grace_seconds: float = 0,
+               max_gap_seconds: float = DEFAULT_MAX_GAP_SECONDS) -> list[dict]:
+    """Buffer one record of the motor and return the events of the days it closes (usually none)."""
+    t = round_to_second(record['collect_time'])
+    day = t // NS_PER_DAY
+    if state['open_day'] is None:
+        state['open_day'] = day
+    if day < state['open_day']:
+        state['late'] += 1
+        return []
+
+    state['rows']['collect_time'].append(t)
+    for col in VALUE_COLUMNS:
+        state['rows'][col].append(record.get(col, np.nan))
+
+    events = []
+    while t >= (state['open_day'] + 1) * NS_PER_DAY + grace_seconds * NS_PER_SECOND:
+        events.append(close_day(state, state['open_day'], full_hours, include_power, max_gap_seconds))
+        state['open_day'] = min(ts // NS_PER_DAY for ts in state['rows']['collect_time'])
+    return events
+
+
+def flush_states(states: dict[str, dict], full_hours: set, include_power: bool,
+                 max_gap_seconds: float = DEFAULT_MAX_GAP_SECONDS) -> list[dict]:
+    """Close every buffered day (end of a finite stream); the last day is usually incomplete."""
+    events = []
+    for state in states.values():
+        while state['rows']['collect_time']:
+            events.append(close_day(state, state['open_day'], full_hours, include_power, max_gap_seconds))
+            if state['rows']['collect_time']:
+                state['open_day'] = min(ts // NS_PER_DAY for ts in state['rows']['collect_time'])
+    return events
+
+
+def write_day(event: dict, output_dir: Path):
+    """Default sink: write a closed day like step3_1 ('files' chunk layout) and update the summaries in place."""
+    motor, date = event['motor'], event['date']
+    if event['valid']:
+        start_dt, end_dt = event['summary']['start'], event['summary']['end']
+        fname = f"{start_dt.strftime('%Y-%m-%d_%H%M%S')}_to_{end_dt.strftime('%Y-%m-%d_%H%M%S')}"
+        parquet_dir = output_dir / motor / "24h" / "parquets"
+        parquet_dir.mkdir(parents=True, exist_ok=True)
+        event['chunk'].to_parquet(parquet_dir / f"{fname}.parquet", index=False)
+        print(f" Saved: {parquet_dir / f'{fname}.parquet'}")
+    else:
+        print(f" {motor} {date} -> Skip saving, reasons: {event['reasons']}")
+
+    # A day is in exactly one of the summaries (replacing an earlier result of the same day)
+    for name, is_target in (("saved_24h_summary.csv", event['valid']), ("missing_24h_summary.csv", not event['valid'])):
+        rows = [event['summary']] if is_target else []
+        if rows or (output_dir / name).exists():
+            merge_summary_csv(output_dir / name, rows, [motor], [date])
+
+
+def run_live_ingest(messages, output_dir: Path | None = None, include_power: bool = False,
+                    grace_seconds: float = 0, max_gap_seconds: float = DEFAULT_MAX_GAP_SECONDS,
+                    on_day=None, flush: bool = False) -> dict[str, dict]:
+    """
+    Consume telemetry messages and emit every motor-day as soon as it closes.
+
+    Parameters
+    ----------
+    messages : iterable of (topic, payload)
+        `mqtt_messages(...)`, `replay_csv_messages(...)` or any stand-in.
+    output_dir : Path | None, optional
+        Where the default sink (`write_day`) writes chunks and summaries.
+    include_power : bool, optional
+        Integrate 'Load_Active_Power' (as step3_1) instead of using 'Load_Total_Power_Consumption'.
+    grace_seconds : float, optional
+        How long after midnight a day stays open for late records (default 0).
+    max_gap_seconds : float, optional
+        Power integration gap threshold (see energy_integration.py).
+    on_day : callable | None, optional
+        Called with every closed-day event (default: `write_day(event, output_dir)`).
+    flush : bool, optional
+        Close the remaining buffered days when `messages` ends (finite replays).
+
+    Returns
+    -------
+    dict[str, dict]
+        {motor: {'days', 'late'}} plus {'_unrouted': {'records'}} for unknown (line, machine_code)
+        and {'_malformed': {'records'}} for messages `parse_message` rejected.
+    """
+    if on_day is None:
+        if output_dir is None:
+            raise ValueError("output_dir is required for the default sink")
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        on_day = lambda event: write_day(event, output_dir)
+
+    full_hours = set(range(24))
+    routes = motor_routes()
+    states: dict[str, dict] = {}
+    unrouted = 0
+    malformed = 0
+
+    for topic, payload in messages:
+        try:
+            record = parse_message(topic, payload)
+        except (ValueError, KeyError, TypeError) as e:
+            # One bad payload must not stop the subscriber
+            malformed += 1
+            print(f" Skip malformed message on {topic}: {e!r}")
+            continue
+        motor_name = routes.get((record['line'], record['machine_code']))
+        if motor_name is None:
+            unrouted += 1
+            continue
+        if motor_name not in states:
+            states[motor_name] = new_motor_state(motor_name, record['machine_code'])
+        for event in add_record(states[motor_name], record, full_hours, include_power, grace_seconds,
+                                max_gap_seconds):
+            on_day(event)
+
+    if flush:
+        for event in flush_states(states, full_hours, include_power, max_gap_seconds):
+            on_day(event)
+
+    stats = {motor: {'days': state['days'], 'late': state['late']} for motor, state in states.items()}
+    stats['_unrouted'] = {'records': unrouted}
+    stats['_malformed'] = {'records': malformed}
+    return stats
+
+
+def mqtt_messages(host: str = "localhost", port: int = 1883, topic: str = TOPIC, qos: int = 1):
+    """Yield (topic, payload) from an MQTT broker (requires paho-mqtt)."""
+    import paho.mqtt.client as mqtt
+
+    inbox = queue.Queue()
+    if hasattr(mqtt, 'CallbackAPIVersion'):  # paho-mqtt >= 2.0
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    else:
+        client = mqtt.Client()
+    client.on_connect = lambda client, userdata, *args: client.subscribe(topic, qos=qos)
+    client.on_message = lambda client, userdata, msg: inbox.put((msg.topic, msg.payload))
+    client.connect(host, port)
+    client.loop_start()
+    try:
+        while True:
+            yield inbox.get()
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
+def replay_csv_messages(csv_files: list[Path], block_size: int = 16 << 20):
+    """
+    Stand-in broker: yield the records of TORAY csv exports as telemetry messages, in file order.
+
+    Only the published columns are parsed, batch by batch, so memory stays flat.
+    """
+    for csv_file in csv_files:
+        line = get_line(Path(csv_file))
+        reader = pv.open_csv(
+            csv_file,
+            read_options=pv.ReadOptions(block_size=block_size),
+            convert_options=pv.ConvertOptions(include_columns=['collect_time', 'machine_code', *VALUE_COLUMNS],
+                                              include_missing_columns=True,
+                                              column_types={'collect_time': 'string', 'machine_code': 'string'}),
+        )
+        for batch in reader:
+            for record in batch.to_pylist():
+                yield f"eems/toray/{line}/{record['machine_code']}", json.dumps(record)
+
+
+def publish_messages(messages, host: str = "localhost", port: int = 1883, qos: int = 1, rate: float | None = None):
+    """Publish (topic, payload) messages to a broker, e.g. a csv replay for an end-to-end test (requires paho-mqtt)."""
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2) if hasattr(mqtt, 'CallbackAPIVersion') else mqtt.Client()
+    client.connect(host, port)
+    client.loop_start()
+    try:
+        for topic, payload in messages:
+            client.publish(topic, payload, qos=qos).wait_for_publish()
+            if rate:
+                time.sleep(1 / rate)
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--replay', type=Path, help="replay the csv exports of this directory instead of subscribing")
+    parser.add_argument('--host', default="localhost")
+    parser.add_argument('--port', type=int, default=1883)
+    args = parser.parse_args()
+
+    output_dir = Path.cwd().parents[0] / "data" / "chunked" / "TORAY_live"
+    # Integrate instantaneous power (as the 'parquet_active_power' batch run)
+    include_power = True
+    # Keep a day open this long after midnight for late records
+    grace_seconds = 60
+
+    if args.replay is not None:
+        messages = replay_csv_messages(os_sorted(args.replay.glob("*.csv")))
+    else:
+        messages = mqtt_messages(args.host, args.port)
+
+    start_time = time.time()
+    try:
+        stats = run_live_ingest(messages, output_dir, include_power=include_power, grace_seconds=grace_seconds,
+                                flush=args.replay is not None)
+        print(stats)
+    except KeyboardInterrupt:
+        print("Stopped (open days were not written)")
+    print(f"Total runtime: {time.time() - start_time:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()
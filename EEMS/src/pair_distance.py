@@ -0,0 +1,111 @@
+import numpy as np
+
+'''
+Blocked L1 distance engine for step4 date-pair scoring.
+
+The score of a date pair is the L1 distance of the two MinMax-scaled metric rows. Distances of the
+upper triangle (i < j) are computed in row blocks of about `BLOCK_ELEMENTS` pairs, so memory stays
+bounded however many dates there are; with `top_k` only the best pairs of each block are kept.
+'''
+
+# Budget of one distance block (number of float64 pair scores held at once, 32 MB)
+BLOCK_ELEMENTS = 1 << 22
+
+
+def _l1_block(X: np.ndarray, start: int, stop: int) -> np.ndarray:
+    """
+    L1 distances of rows start:stop of X to the rows after `start` (shape (stop - start, n - start - 1));
+    entry [r, c] is pair (start + r, start + 1 + c), and pairs with j <= i are set to -inf.
+    A NaN feature adds 0 to the distance (like the NaN-skipping pandas sum it replaces).
+    """
+    rows, cols = stop - start, len(X) - start - 1
+    block = np.zeros((rows, cols))
+    diff = np.empty((rows, cols))
+    for c in range(X.shape[1]):
+        np.subtract(X[None, start + 1:, c], X[start:stop, c, None], out=diff)
+        block += np.nan_to_num(np.abs(diff, out=diff), copy=False, nan=0.0)
+    block[:, :rows][np.tri(rows, min(rows, cols), k=-1, dtype=bool)] = -np.inf
+    return block
+
+
+def _top_k_flat(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Flat indices of the k largest finite scores; ties at the cut are taken in index order,
+    so the result is deterministic (same order as the original combinations loop).
+    """
+    if len(scores) > k:
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:k - len(above)]
+        picked = np.sort(np.concatenate([above, ties]))
+    else:
+        picked = np.arange(len(scores))
+    return picked[np.isfinite(scores[picked])]
+
+
+def pairwise_l1_scores(X: np.ndarray, top_k: int | None = None,
+                       block_elements: int = BLOCK_ELEMENTS) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    L1 distance of every row pair (i < j) of X, computed in row blocks to bound memory.
+
+    Parameters
+    ----------
+    X : np.ndarray
+        (n_dates, n_features) scaled matrix.
+    top_k : int | None, optional
+        Keep only the k largest distances (default: every pair).
+    block_elements : int, optional
+        Number of pair distances computed at once.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        (i, j, score). Every pair in combinations order (i, j ascending), or with `top_k`
+        the k best pairs sorted by score descending (ties: combinations order).
+    """
+    X = np.asarray(X, dtype=np.float64)
+    n = len(X)
+
+    parts_i, parts_j, parts_s = [], [], []
+    start = 0
+    while start < n - 1:
+        # Rows get shorter towards the end of the triangle, so later blocks hold more of them
+        stop = min(start + max(1, block_elements // (n - start - 1)), n - 1)
+        block = _l1_block(X, start, stop)
+        cols = block.shape[1]
+
+        flat = np.flatnonzero(np.isfinite(block)) if top_k is None else _top_k_flat(block.ravel(), top_k)
+        parts_i.append(start + flat // cols)
+        parts_j.append(start + 1 + flat % cols)
+        parts_s.append(block.ravel()[flat])
+
+        if top_k is not None and len(parts_s) > 1:
+            # Merge the running best with this block's best (kept in combinations order)
+            i, j, score = (np.concatenate(p) for p in (parts_i, parts_j, parts_s))
+            keep = _top_k_flat(score, top_k)
+            parts_i, parts_j, parts_s = [i[keep]], [j[keep]], [score[keep]]
+        start = stop
+
+    if not parts_s:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, np.array([])
+
+    i, j, score = (np.concatenate(p) for p in (parts_i, parts_j, parts_s))
+    if top_k is not None:
+        order = np.lexsort((j, i, -score))
+        i, j, score = i[order], j[order], score[order]
+    return i, j, score
+
+
+def minmax_scale(X: np.ndarray, lo: np.ndarray | None = None, hi: np.ndarray | None = None) -> np.ndarray:
+    """
+    MinMax-scale the columns of X to [0, 1] exactly like sklearn's MinMaxScaler (a (near) zero range
+    scales by 1; NaN is ignored for the bounds and kept). `lo` / `hi` default to the column min / max of X.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if lo is None or hi is None:
+        with np.errstate(all='ignore'):
+            lo, hi = np.nanmin(X, axis=0), np.nanmax(X, axis=0)
+    span = hi - lo
+    scale = 1.0 / np.where(span < 10 * np.finfo(np.float64).eps, 1.0, span)
+    return X * scale + (0 - lo * scale)
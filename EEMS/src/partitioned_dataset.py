@@ -0,0 +1,135 @@
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pathlib import Path
+
+'''
+Hive-partitioned parquet dataset of decomposed motor data.
+
+Layout:
+    {dataset_dir}/site=TORAY/line=inner/motor=P1730A/date=2024-06-05/part-0.parquet
+
+Reading one motor, or a few days of one motor, only opens the matching directories
+(partition pruning) instead of scanning every decomposed row.
+'''
+
+PARTITION_SCHEMA = pa.schema([
+    ('site', pa.string()),
+    ('line', pa.string()),
+    ('motor', pa.string()),
+    ('date', pa.string()),
+])
+
+
+def write_motor_partitions(df: pd.DataFrame, dataset_dir: Path, motor_name: str, line: str, site: str = "TORAY",
+                           part_name: str = "part", replace: bool = True):
+    """
+    Write one motor's (time-sorted) DataFrame into the dataset, one partition per calendar day.
+
+    With `replace`, existing partitions of the same motor/day are replaced; other partitions are left
+    untouched. Without it the rows are added as '{part_name}-{i}.parquet' next to the existing files,
+    which lets a streaming writer add several pieces of the same day (e.g. a day split across two
+    source files).
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Motor data with a datetime 'collect_time' column.
+    dataset_dir : Path
+        Root directory of the dataset.
+    motor_name : str
+        Motor name (e.g. "P1730A").
+    line : str
+        'inner' or 'outer'.
+    site : str, optional
+        Site name (default "TORAY").
+    part_name : str, optional
+        File name prefix inside each partition (default "part").
+    replace : bool, optional
+        Replace existing partitions of the same motor/day (default True).
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    n = table.num_rows
+    dates = df['collect_time'].dt.strftime('%Y-%m-%d').to_numpy()
+    table = (
+        table
+        .append_column('site', pa.array([site] * n, pa.string()).dictionary_encode())
+        .append_column('line', pa.array([line] * n, pa.string()).dictionary_encode())
+        .append_column('motor', pa.array([motor_name] * n, pa.string()).dictionary_encode())
+        .append_column('date', pa.array(dates, pa.string()).dictionary_encode())
+    )
+
+    ds.write_dataset(
+        table,
+        Path(dataset_dir),
+        format='parquet',
+        partitioning=ds.partitioning(PARTITION_SCHEMA, flavor='hive'),
+        basename_template=f'{part_name}-{{i}}.parquet',
+        existing_data_behavior='delete_matching' if replace else 'overwrite_or_ignore',
+        max_partitions=1 << 16,
+    )
+
+
+def clear_motor_partitions(dataset_dir: Path, motor_name: str, line: str, site: str = "TORAY"):
+    """Delete every partition of one motor (before re-writing it piece by piece)."""
+    motor_dir = Path(dataset_dir) / f"site={site}" / f"line={line}" / f"motor={motor_name}"
+    if motor_dir.exists():
+        shutil.rmtree(motor_dir)
+
+
+def open_dataset(dataset_dir: Path) -> ds.Dataset:
+    """Open the partitioned dataset (no data is read until a scan)."""
+    return ds.dataset(Path(dataset_dir), format='parquet',
+                      partitioning=ds.partitioning(PARTITION_SCHEMA, flavor='hive'))
+
+
+def list_partitions(dataset_dir: Path, motor_name: str | None = None) -> pd.DataFrame:
+    """
+    List partitions from the directory names only (no parquet file is opened).
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns ['site', 'line', 'motor', 'date'], one row per partition, sorted.
+    """
+    pattern = f"site=*/line=*/motor={motor_name or '*'}/date=*"
+    rows = []
+    for path in Path(dataset_dir).glob(pattern):
+        if path.is_dir():
+            rows.append(dict(part.split('=', 1) for part in path.relative_to(dataset_dir).parts))
+    df = pd.DataFrame(rows, columns=['site', 'line', 'motor', 'date'])
+    return df.sort_values(['site', 'line', 'motor', 'date']).reset_index(drop=True)
+
+
+def read_motor_data(dataset_dir: Path, motor_name: str, dates: list[str] | None = None,
+                    columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    Read one motor's rows from the dataset, optionally only for some days.
+
+    Parameters
+    ----------
+    dataset_dir : Path
+        Root directory of the dataset.
+    motor_name : str
+        Motor name (e.g. "P1730A").
+    dates : list[str] | None, optional
+        'YYYY-MM-DD' days to read (default: every day of the motor).
+    columns : list[str] | None, optional
+        Data columns to read (default: all non-partition columns).
+
+    Returns
+    -------
+    pd.DataFrame
+        Time-sorted rows of the selected partitions, without the partition columns.
+    """
+    dataset = open_dataset(dataset_dir)
+    expr = ds.field('motor') == motor_name
+    if dates is not None:
+        expr = expr & ds.field('date').isin([str(d) for d in dates])
+
+    if columns is None:
+        columns = [name for name in dataset.schema.names if name not in PARTITION_SCHEMA.names]
+
+    df = dataset.to_table(columns=columns, filter=expr).to_pandas()
+    return df.sort_values('collect_time', kind='stable').reset_index(drop=True)
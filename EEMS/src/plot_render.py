@@ -0,0 +1,185 @@
+import matplotlib
+matplotlib.use('Agg')  # headless: plots are only written to files
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from downsample import plot_indices
+from arrow_ipc import read_intermediate, read_intermediate_row_group
+
+plt.rcParams['font.family'] = 'Times New Roman'
+
+'''
+Deferred plot rendering for step3_1 / step3_2.
+
+The numeric steps only build lightweight plot specs (dicts pointing at the chunk parquet
+file that was just written, plus titles/labels/text) and a separate render stage draws them,
+optionally in a pool of headless (Agg) worker processes. Plot modes:
+- 'inline'   : render each plot right away (original behavior)
+- 'deferred' : collect specs, write the numeric outputs first, then render in parallel
+- 'none'     : skip plotting entirely
+
+Spec keys
+---------
+kind : 'daily' (step3_1 shifted power + derivative) or 'operating' (step3_2 operating segment)
+source : Path of the chunk parquet file to plot
+row_group : int, optional
+    Row group of `source` holding the chunk (per-motor chunk store); default: the whole file
+out_path : Path of the png file
+dpi : int
+title : str
+target_column : str ('daily' only) column to plot
+text_lines : list[str] ('operating' only) summary text box lines
+downsample : str, optional
+    'minmax' (default), 'lttb' or 'none'. Each drawn series is reduced to a resolution of
+    half a marker (or line) width before plotting; highlighted points are reduced separately,
+    so peaks, steps and the orange segment look the same as with every point.
+'''
+
+PLOT_MODES = ('inline', 'deferred', 'none')
+DEFAULT_DPI = 600
+DEFAULT_DOWNSAMPLE = 'minmax'
+
+
+def reduce_points(x: pd.Series, y: pd.Series, width_in: float, mark_pt: float, method: str) -> np.ndarray:
+    """
+    Indices of the points worth drawing for an axis `width_in` inches wide.
+
+    The resolution is half a marker (or line) width, `mark_pt` points: anything finer
+    is hidden under the neighbouring markers at every dpi.
+    """
+    if method == 'none':
+        return np.arange(len(x))
+    n_bins = int(width_in * 72 / (mark_pt / 2))
+    return plot_indices(x.to_numpy(), y.to_numpy(), 4 * n_bins, method)
+
+
+def read_source(spec: dict, columns: list[str]) -> pd.DataFrame:
+    """
+    Read the plotted columns of a spec's chunk (a whole file, or one row group of a chunk store),
+    through the memory-mapped IPC sidecar when there is a fresh one.
+    """
+    if 'row_group' in spec:
+        return read_intermediate_row_group(spec['source'], spec['row_group'], columns)
+    return read_intermediate(spec['source'], columns)
+
+
+def render_daily_plot(spec: dict, data: pd.DataFrame | None = None) -> Path:
+    """Draw the step3_1 24h plot (shifted target scatter + derivative) and save it."""
+    if data is None:
+        data = read_source(spec, ['collect_time', spec['target_column']])
+    target = data[spec['target_column']]
+    derivative = target.diff()
+    method = spec.get('downsample', DEFAULT_DOWNSAMPLE)
+
+    fig, ax = plt.subplots(figsize=(14, 5))
+    idx = reduce_points(data['collect_time'], target, 14, np.sqrt(3), method)
+    ax.scatter(data['collect_time'].iloc[idx], target.iloc[idx] - target.min(), s=3)
+    ax.set_title(spec['title'], fontsize=12)
+    ax.set_xlabel("Time")
+    ax.set_ylabel(f"adjusetd {spec['target_column']}")
+    ax.grid(True)
+
+    ax2 = ax.twinx()
+    idx = reduce_points(data['collect_time'], derivative, 14, plt.rcParams['lines.linewidth'], method)
+    ax2.plot(data['collect_time'].iloc[idx], derivative.iloc[idx], color='red', label='Derivative', alpha=0.3, zorder=0)
+    ax2.set_ylabel("Derivative", color='red')
+    ax2.tick_params(axis='y', labelcolor='red')
+
+    fig.savefig(spec['out_path'], dpi=spec['dpi'])
+    plt.close(fig)
+    return spec['out_path']
+
+
+def render_operating_plot(spec: dict, data: pd.DataFrame | None = None) -> Path:
+    """Draw the step3_2 plot (shifted power with the operating segment in orange) and save it."""
+    if data is None:
+        data = read_source(spec, ['collect_time', 'Load_Total_Power_Consumption'])
+    power = data["Load_Total_Power_Consumption"]
+    method = spec.get('downsample', DEFAULT_DOWNSAMPLE)
+
+    fig, ax = plt.subplots(figsize=(15, 8))
+
+    # Normalize power values (shift minimum to zero for better visualization)
+    shifted_power = power - power.min()
+    idx = reduce_points(data["collect_time"], shifted_power, 15, 1.0, method)
+    ax.scatter(data["collect_time"].iloc[idx], shifted_power.iloc[idx], s=1, label='Shifted Power')
+    ax.set_title(spec['title'], fontsize=14)
+
+    # Operating segment (where delta > 1)
+    highlight = (power.diff() > 1).to_numpy().nonzero()[0]
+    if len(highlight):
+        # Reduced on its own, so no highlighted point is hidden by the base series reduction
+        highlight = highlight[reduce_points(data["collect_time"].iloc[highlight],
+                                            shifted_power.iloc[highlight], 15, 2.0, method)]
+        ax.scatter(
+            data["collect_time"].iloc[highlight],
+            shifted_power.iloc[highlight],
+            color='orange',
+            s=4,
+            label='Significant Rise'
+        )
+
+    if spec.get('text_lines'):
+        text_x = data["collect_time"].iloc[int(len(data) * 0.01)]
+        text_y = shifted_power.min() + 0.05 * shifted_power.max()
+        ax.text(
+            text_x,
+            text_y,
+            "\n".join(spec['text_lines']),
+            fontsize=11,
+            va='bottom',
+            ha='left',
+            bbox=dict(facecolor='white', edgecolor='gray', alpha=0.85)
+        )
+
+    ax.set_xlabel("Time", fontsize=12)
+    ax.set_ylabel("Load_Total_Power_Consumption (shifted)", fontsize=12)
+    ax.tick_params(axis='both', labelsize=10)
+    ax.grid(True)
+    ax.legend(fontsize=10)
+
+    plt.subplots_adjust(bottom=0.15)
+    plt.tight_layout()
+
+    fig.savefig(spec['out_path'], dpi=spec['dpi'])
+    plt.close(fig)
+    return spec['out_path']
+
+
+RENDERERS = {
+    'daily': render_daily_plot,
+    'operating': render_operating_plot,
+}
+
+
+def render_spec(spec: dict, data: pd.DataFrame | None = None) -> Path:
+    """Render one plot spec with the renderer of its kind."""
+    Path(spec['out_path']).parent.mkdir(parents=True, exist_ok=True)
+    return RENDERERS[spec['kind']](spec, data)
+
+
+def init_plot_worker():
+    """Pool initializer: each worker process uses its own headless backend."""
+    matplotlib.use('Agg', force=True)
+
+
+def render_plots(specs: list[dict], workers: int = 1) -> list[Path]:
+    """
+    Render queued plot specs, in a process pool when workers > 1.
+
+    Returns
+    -------
+    list[Path]
+        Saved plot paths, in spec order.
+    """
+    if not specs:
+        return []
+    if workers <= 1:
+        return [render_spec(spec) for spec in specs]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(specs)), initializer=init_plot_worker) as executor:
+        return list(executor.map(render_spec, specs, chunksize=max(1, len(specs) // (workers * 4))))
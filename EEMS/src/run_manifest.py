@@ -0,0 +1,126 @@
+import json
+import hashlib
+from pathlib import Path
+from datetime import datetime
+
+'''
+Run manifest for incremental pipeline execution.
+
+Each step (or per-file unit of a step, e.g. "step1/Toray_inner_250529_1_with_header.csv")
+records the fingerprints of its inputs (size, mtime, content hash), the parameters it ran
+with and the outputs it produced. A re-run skips a unit when all of its inputs are unchanged,
+the parameters are the same and its outputs still exist.
+
+size/mtime is the fast check; the content hash is only computed when they differ, so a
+touched-but-identical file (e.g. a re-copied export) is still recognised as unchanged.
+'''
+
+MANIFEST_VERSION = 1
+
+
+def hash_file(path: Path, chunk_size: int = 8 << 20) -> str:
+    """Return the blake2b content hash of a file, read in `chunk_size` blocks."""
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_fingerprint(path: Path) -> dict:
+    """Return {'size', 'mtime_ns', 'hash'} for a file."""
+    st = Path(path).stat()
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': hash_file(path)}
+
+
+def new_manifest() -> dict:
+    """Return an empty manifest (every unit is considered stale)."""
+    return {'version': MANIFEST_VERSION, 'steps': {}}
+
+
+def load_manifest(path: Path) -> dict:
+    """Load a run manifest, or return an empty one if it does not exist (or has another version)."""
+    path = Path(path)
+    if path.exists():
+        manifest = json.loads(path.read_text(encoding='utf-8'))
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+    return new_manifest()
+
+
+def save_manifest(manifest: dict, path: Path):
+    """Write the manifest atomically (temp file + replace) so an interrupted run never leaves it half-written."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    tmp_path.write_text(json.dumps(manifest, indent=2, ensure_ascii=False), encoding='utf-8')
+    tmp_path.replace(path)
+
+
+def is_unchanged(fingerprint: dict | None, path: Path) -> bool:
+    """
+    Check a file against its recorded fingerprint.
+
+    Same size and mtime -> unchanged without reading the file.
+    Same size but a different mtime -> compare content hashes (and refresh the stored mtime on a match).
+    """
+    path = Path(path)
+    if fingerprint is None or not path.exists():
+        return False
+    st = path.stat()
+    if st.st_size != fingerprint['size']:
+        return False
+    if st.st_mtime_ns == fingerprint['mtime_ns']:
+        return True
+    if hash_file(path) == fingerprint['hash']:
+        fingerprint['mtime_ns'] = st.st_mtime_ns
+        return True
+    return False
+
+
+def is_fresh(manifest: dict, key: str, inputs: list[Path], params: dict | None = None) -> bool:
+    """
+    Return True if the unit `key` already ran on exactly these inputs with these params
+    and all of its recorded outputs still exist.
+    """
+    entry = manifest['steps'].get(key)
+    if entry is None or entry.get('params') != (params or {}):
+        return False
+
+    recorded = entry['inputs']
+    if set(recorded) != {str(p) for p in inputs}:
+        return False
+    if not all(is_unchanged(recorded[str(p)], p) for p in inputs):
+        return False
+    return all(Path(p).exists() for p in entry['outputs'])
+
+
+def appended_inputs(manifest: dict, key: str, inputs: list[Path], params: dict | None = None) -> list[Path] | None:
+    """
+    Append check: if the unit `key` already ran with these params, every input it recorded is still
+    among `inputs` and unchanged, and its outputs exist, return the inputs it has not seen yet
+    (possibly none). Otherwise (changed / removed input, other params) return None.
+    """
+    entry = manifest['steps'].get(key)
+    if entry is None or entry.get('params') != (params or {}):
+        return None
+
+    recorded = entry['inputs']
+    current = {str(p): p for p in inputs}
+    if not set(recorded) <= set(current):
+        return None
+    if not all(is_unchanged(recorded[name], current[name]) for name in recorded):
+        return None
+    if not all(Path(p).exists() for p in entry['outputs']):
+        return None
+    return [p for p in inputs if str(p) not in recorded]
+
+
+def record(manifest: dict, key: str, inputs: list[Path], outputs: list[Path], params: dict | None = None):
+    """Record a finished unit: input fingerprints, params and output locations."""
+    manifest['steps'][key] = {
+        'inputs': {str(p): file_fingerprint(p) for p in inputs},
+        'outputs': [str(p) for p in outputs],
+        'params': params or {},
+        'finished_at': datetime.now().isoformat(timespec='seconds'),
+    }
@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from pair_distance import minmax_scale, pairwise_l1_scores
+
+'''
+Incremental step4 score store of one motor pair.
+
+A date pair's score is the L1 distance of the two MinMax-scaled metric rows, so the only state a
+new day needs is the per-date metric rows, the scaling bounds (column min / max) and the running
+best pair. The store keeps exactly that (O(n) on disk), and on update:
+- new dates are scored against every stored date only (n new pair scores each), and the running
+  best pair is replaced if one of them beats it;
+- if the new dates move a scaling bound, every score changes, so the best pair is searched again
+  with the blocked engine (`pairwise_l1_scores`), the only O(n^2) case;
+- a changed or removed date (e.g. step3 re-run) rebuilds the store.
+
+Scores are bit-identical to the full recomputation (`step4_select_max_diffrate_date.score_motor_pair`).
+'''
+
+
+def new_score_store(n_features: int) -> dict:
+    """Return an empty score store."""
+    return {
+        'dates': np.array([], dtype=object),
+        'values': np.empty((0, n_features)),
+        'lo': np.full(n_features, np.nan),
+        'hi': np.full(n_features, np.nan),
+        'best': None,  # (earlier date, later date, score) of the running best pair
+    }
+
+
+def load_score_store(path: Path, n_features: int) -> dict:
+    """Load a score store (.npz), or return an empty one if it does not exist (or has other features)."""
+    path = Path(path)
+    if not path.exists():
+        return new_score_store(n_features)
+    with np.load(path, allow_pickle=False) as data:
+        if data['values'].shape[1] != n_features:
+            return new_score_store(n_features)
+        best_dates = data['best_dates'].tolist()
+        return {
+            'dates': data['dates'].astype(object),
+            'values': data['values'],
+            'lo': data['lo'],
+            'hi': data['hi'],
+            'best': (best_dates[0], best_dates[1], float(data['best_score'])) if best_dates else None,
+        }
+
+
+def save_score_store(store: dict, path: Path):
+    """Write the store atomically (temp file + replace)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.stem + '.tmp.npz')
+    best = store['best']
+    np.savez(tmp_path, dates=store['dates'].astype(str), values=store['values'], lo=store['lo'], hi=store['hi'],
+             best_dates=np.array(best[:2] if best else [], dtype=str),
+             best_score=np.float64(best[2] if best else np.nan))
+    tmp_path.replace(path)
+
+
+def _better(a: tuple, b: tuple | None) -> bool:
+    """Is pair a = (date1, date2, score) better than b? Ties go to the earlier pair (combinations order)."""
+    if b is None:
+        return True
+    if a[2] != b[2]:
+        return a[2] > b[2]
+    return a[:2] < b[:2]
+
+
+def _sorted_scaled(store: dict) -> tuple[np.ndarray, np.ndarray]:
+    """(dates, scaled rows) in date order."""
+    order = np.argsort(store['dates'].astype(str), kind='stable')
+    return store['dates'][order].astype(str), minmax_scale(store['values'][order], store['lo'], store['hi'])
+
+
+def _search_best(store: dict) -> tuple | None:
+    """Best pair over every date pair (blocked engine, top 1)."""
+    dates, scaled = _sorted_scaled(store)
+    i, j, score = pairwise_l1_scores(scaled, top_k=1)
+    if not len(score):
+        return None
+    return dates[i[0]], dates[j[0]], float(score[0])
+
+
+def update_score_store(store: dict, dates, values: np.ndarray) -> dict:
+    """
+    Bring the store up to date with the current per-date metric rows of the motor pair.
+
+    Parameters
+    ----------
+    store : dict
+        Store from `load_score_store` (updated in place).
+    dates : array-like of str
+        Dates where both motors exist.
+    values : np.ndarray
+        (n_dates, n_features) unscaled metrics, aligned with `dates`.
+
+    Returns
+    -------
+    dict
+        {'added', 'rebuilt', 'rescaled'}: number of new dates, whether the store was rebuilt
+        (changed / removed date) and whether the scaling bounds moved (full best-pair search).
+    """
+    dates = np.asarray(dates, dtype=str).astype(object)
+    values = np.asarray(values, dtype=np.float64)
+    current = dict(zip(dates, range(len(dates))))
+
+    # Stored dates must still exist with the same values, otherwise every score may be stale
+    rebuilt = False
+    if len(store['dates']):
+        rows = np.array([current.get(d, -1) for d in store['dates']])
+        if (rows < 0).any() or not np.array_equal(values[rows], store['values'], equal_nan=True):
+            store.update(new_score_store(values.shape[1]))
+            rebuilt = True
+
+    known = set(store['dates'])
+    new_rows = [r for d, r in current.items() if d not in known]
+    if not new_rows:
+        return {'added': 0, 'rebuilt': rebuilt, 'rescaled': False}
+
+    n_old = len(store['dates'])
+    store['dates'] = np.concatenate([store['dates'], dates[new_rows]])
+    store['values'] = np.vstack([store['values'], values[new_rows]])
+
+    with np.errstate(all='ignore'):
+        lo, hi = np.nanmin(store['values'], axis=0), np.nanmax(store['values'], axis=0)
+    rescaled = not (np.array_equal(lo, store['lo'], equal_nan=True) and np.array_equal(hi, store['hi'], equal_nan=True))
+    store['lo'], store['hi'] = lo, hi
+
+    if rescaled or store['best'] is None:
+        store['best'] = _search_best(store)
+        return {'added': len(new_rows), 'rebuilt': rebuilt, 'rescaled': rescaled}
+
+    # Same bounds: only pairs with a new date can beat the running best
+    scaled = minmax_scale(store['values'], lo, hi)
+    all_dates = store['dates'].astype(str)
+    for k in range(n_old, len(scaled)):
+        # New date k against every date stored before it (same arithmetic as the blocked engine)
+        distance = np.zeros(k)
+        for c in range(scaled.shape[1]):
+            distance += np.nan_to_num(np.abs(scaled[:k, c] - scaled[k, c]), nan=0.0)
+        for m in np.flatnonzero(distance == distance.max()):
+            d1, d2 = sorted((all_dates[m], all_dates[k]))
+            candidate = (d1, d2, float(distance[m]))
+            if _better(candidate, store['best']):
+                store['best'] = candidate
+
+    return {'added': len(new_rows), 'rebuilt': rebuilt, 'rescaled': rescaled}
+
+
+def empty_scores() -> pd.DataFrame:
+    """['date_compare', 'score'] result of a motor pair without any date pair."""
+    return pd.DataFrame({'date_compare': pd.Series(dtype=object), 'score': pd.Series(dtype=np.float64)})
+
+
+def store_results(store: dict, top_k: int | None = None) -> pd.DataFrame:
+    """
+    Scores of the stored dates as ['date_compare', 'score'] (every pair in combinations order,
+    or the `top_k` best sorted by score). top_k=1 is the running best and costs nothing; any other
+    top_k rescales the stored rows and rescores every date pair (O(n^2)).
+    """
+    if top_k == 1 and store['best'] is not None:
+        d1, d2, score = store['best']
+        return pd.DataFrame({'date_compare': [f'{d1} - {d2}'], 'score': [score]})
+    if not len(store['dates']):
+        return empty_scores()
+
+    dates, scaled = _sorted_scaled(store)
+    i, j, score = pairwise_l1_scores(scaled, top_k=top_k)
+    return pd.DataFrame({
+        'date_compare': pd.Series(dates[i], dtype=object) + ' - ' + pd.Series(dates[j], dtype=object),
+        'score': score,
+    })
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import uuid
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+
+'''
+Per-stage pipeline metrics as JSON lines.
+
+    with stage('step1') as m:
+        ...
+        m['rows_out'] = n_rows
+
+Every stage (and nested sub-stage, e.g. 'step3_1/parse') produces one record:
+
+    {"run_id", "stage", "started_at", "wall_s", "cpu_s", "peak_rss_mb",
+     "rows_in", "rows_out", "bytes_read", "bytes_written", "files", ...extra fields}
+
+- cpu_s includes finished child processes (process pools are shut down inside the stage)
+- peak_rss_mb is the stage's own high-water mark on Linux (the kernel peak counter is reset at
+  every stage boundary via /proc/self/clear_refs); elsewhere it is the process peak so far
+- counters the stage does not set stay null
+
+Records are appended to the file given to `configure_metrics` (the pipeline uses
+preprocessing_logs/pipeline_metrics.jsonl). Without it, stages are measured but not written,
+so the steps can be run on their own unchanged.
+
+A pool worker calls `capture_records` at the start of each task and returns the buffered records
+with its result; the parent passes them to `emit_records`, which names them below its own
+current stage (e.g. 'step3/compute' of a motor processed in a worker).
+'''
+
+FIELDS = ['rows_in', 'rows_out', 'bytes_read', 'bytes_written', 'files']
+
+_SINK: dict = {'path': None, 'run_id': None, 'buffer': None}
+_STACK: list[dict] = []
+
+
+def configure_metrics(path: Path | None, run_id: str | None = None) -> str | None:
+    """Write records of this process to `path` (None turns writing off); returns the run id."""
+    _SINK['path'] = Path(path) if path is not None else None
+    _SINK['run_id'] = run_id or (datetime.now().strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6])
+    if _SINK['path'] is not None:
+        _SINK['path'].parent.mkdir(parents=True, exist_ok=True)
+    return _SINK['run_id']
+
+
+def _read_hwm_mb() -> float | None:
+    """Peak RSS (MB) since the last reset (Linux VmHWM), or None if unavailable."""
+    try:
+        for line in Path('/proc/self/status').read_text().splitlines():
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def _reset_hwm() -> bool:
+    """Reset the kernel peak RSS counter of this process (Linux >= 4.0)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _cpu_seconds() -> float:
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def capture_records() -> list[dict]:
+    """
+    Buffer the records of this (worker) process instead of writing them; returns the new buffer.
+    Stage names restart at the top level, so the parent can place them with `emit_records`.
+    """
+    _STACK.clear()
+    _SINK['buffer'] = []
+    return _SINK['buffer']
+
+
+def emit_records(records: list[dict]):
+    """Emit records captured in a worker process, named below the current stage."""
+    prefix = ''.join(frame['stage'] + '/' for frame in _STACK)
+    for record in records:
+        emit({**record, 'stage': prefix + record['stage']})
+
+
+def emit(record: dict):
+    """Append one record to the metrics file (no-op if metrics are not configured)."""
+    if _SINK['buffer'] is not None:
+        _SINK['buffer'].append(record)
+        return
+    if _SINK['path'] is None:
+        return
+    record = {'run_id': _SINK['run_id'], **record}
+    with open(_SINK['path'], 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, default=str) + '\n')
+
+
+def record_stage(name: str, wall_s: float, **fields):
+    """
+    Emit a record measured elsewhere (e.g. timings returned by a worker process), named below
+    the current stage like a nested `stage`.
+    """
+    full_name = '/'.join([frame['stage'] for frame in _STACK] + [name])
+    emit({'stage': full_name, 'wall_s': wall_s, **{k: fields.pop(k, None) for k in FIELDS}, **fields})
+
+
+@contextmanager
+def stage(name: str, **fields):
+    """
+    Measure a (sub-)stage; yields the record dict so the body can fill in counters
+    ('rows_in', 'rows_out', 'bytes_read', 'bytes_written', 'files') or extra fields.
+    """
+    parent = _STACK[-1] if _STACK else None
+    if parent is not None:
+        parent['_peak'] = max(parent['_peak'], _read_hwm_mb() or 0.0)
+    resettable = _reset_hwm()
+
+    record = {'stage': '/'.join([frame['stage'] for frame in _STACK] + [name]),
+              'started_at': datetime.now().isoformat(timespec='milliseconds'),
+              **{k: None for k in FIELDS}, **fields}
+    frame = {'stage': name, '_peak': 0.0}
+    _STACK.append(frame)
+    wall_start, cpu_start = time.perf_counter(), _cpu_seconds()
+    try:
+        yield record
+    finally:
+        _STACK.pop()
+        peak = max(frame['_peak'], _read_hwm_mb() or 0.0)
+        record['wall_s'] = time.perf_counter() - wall_start
+        record['cpu_s'] = _cpu_seconds() - cpu_start
+        record['peak_rss_mb'] = peak if peak > 0 else None
+        record['peak_rss_scope'] = 'stage' if resettable else 'process'
+        emit(record)
+        if parent is not None:
+            parent['_peak'] = max(parent['_peak'], peak)
+            _reset_hwm()
@@ -1,10 +1,20 @@
 #%%
+import os
+import time
 import logging
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
 from pathlib import Path
 from natsort import os_sorted
 from datetime import datetime
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from timestamp_utils import parse_timestamps
+from stage_metrics import record_stage
 
 
 # === Setup logging ===
@@ -31,14 +41,25 @@ def read_csv_file(file: Path) -> pd.DataFrame:
     return pd.read_csv(file)
 
 
+def read_csv_columns(file: Path) -> list[str]:
+    """Read only the header line of a csv file and return its column names."""
+    return list(pd.read_csv(file, nrows=0).columns)
+
+
 def filter_and_convert(df: pd.DataFrame, cols: list[str]) -> pd.DataFrame:
     """
     Select specified columns (e.g. 'collect_time', 'machine_code', 'Load_Total_Power_Consumption').
     Convert numeric columns from 64-bit (float64/int64) to 32-bit (float32).
+    Parse 'collect_time' into a native timestamp and dictionary-encode 'machine_code',
+    so downstream steps read them without re-parsing.
     """
     df_filtered = df[cols].copy()
     for col in df_filtered.select_dtypes(include=['float64', 'int64']).columns:
         df_filtered[col] = df_filtered[col].astype(np.float32)
+    if 'collect_time' in df_filtered.columns:
+        df_filtered['collect_time'] = parse_timestamps(df_filtered['collect_time'])
+    if 'machine_code' in df_filtered.columns:
+        df_filtered['machine_code'] = df_filtered['machine_code'].astype('category')
     return df_filtered
 
 
@@ -66,6 +87,109 @@ def save_parquet(df_filtered: pd.DataFrame, path: Path):
     df_filtered.to_parquet(path)
 
 
+def stream_csv_to_parquet(csv_path: Path, parquet_path: Path, cols: list[str],
+                          block_size: int = 64 << 20, timings: dict | None = None) -> tuple[object, object, int]:
+    """
+    Stream a csv file into a parquet file batch by batch, reading only the selected columns.
+
+    Only `cols` are parsed (the other columns of the TORAY export are skipped by the reader),
+    numeric columns are parsed directly as float32, 'collect_time' as a native timestamp and
+    'machine_code' as a dictionary-encoded string. Every batch is appended to the parquet file
+    through an incremental writer, so peak memory is bounded by `block_size` instead of the csv size.
+
+    If the reader cannot parse a 'collect_time' natively (e.g. '2025/06/04 ...' or a malformed row),
+    the file is converted again with 'collect_time' read as strings and every batch parsed by
+    `parse_timestamps` (mixed formats, unparseable rows become NaT), as the whole-file path does.
+
+    Parameters
+    ----------
+    csv_path : Path
+        Source csv file.
+    parquet_path : Path
+        Destination parquet file (parent directory is created if needed).
+    cols : list[str]
+        Columns to keep (e.g. 'collect_time', 'machine_code', 'Load_Total_Power_Consumption').
+    block_size : int, optional
+        Number of csv bytes parsed per batch (default 64 MB).
+    timings : dict | None, optional
+        If given, filled with the seconds spent parsing ('parse_s') and writing ('write_s').
+
+    Returns
+    -------
+    tuple[object, object, int]
+        (first collect_time, last collect_time, number of rows written)
+    """
+    try:
+        return _stream_csv(csv_path, parquet_path, cols, block_size, timings, parse_time_strings=False)
+    except pa.ArrowInvalid as e:
+        logging.info(f"  collect_time is not ISO in every row ({e}); converting again with parse_timestamps")
+        return _stream_csv(csv_path, parquet_path, cols, block_size, timings, parse_time_strings=True)
+
+
+def _stream_csv(csv_path: Path, parquet_path: Path, cols: list[str], block_size: int, timings: dict | None,
+                parse_time_strings: bool) -> tuple[object, object, int]:
+    """`stream_csv_to_parquet` with 'collect_time' parsed by the csv reader, or read as strings and parsed per batch."""
+    typed_columns = {
+        'collect_time': pa.string() if parse_time_strings else pa.timestamp('ns'),
+        'machine_code': pa.dictionary(pa.int32(), pa.string()),
+    }
+    column_types = {col: typed_columns[col] for col in typed_columns if col in cols}
+    column_types.update({col: pa.float32() for col in cols if col not in column_types})
+
+    t0 = time.perf_counter()
+    reader = pv.open_csv(
+        csv_path,
+        read_options=pv.ReadOptions(block_size=block_size),
+        convert_options=pv.ConvertOptions(include_columns=cols, column_types=column_types),
+    )
+    # open_csv already parses the first block
+    parse_s, write_s = time.perf_counter() - t0, 0.0
+
+    parquet_path.parent.mkdir(parents=True, exist_ok=True)
+    start_time, end_time, n_rows = None, None, 0
+    writer = None
+    batches = iter(reader)
+    try:
+        while True:
+            t0 = time.perf_counter()
+            batch = next(batches, None)
+            parse_s += time.perf_counter() - t0
+            if batch is None:
+                break
+            if batch.num_rows == 0:
+                continue
+            if parse_time_strings and 'collect_time' in cols:
+                t0 = time.perf_counter()
+                i = batch.schema.get_field_index('collect_time')
+                parsed = parse_timestamps(batch.column(i).to_pandas(), errors='coerce')
+                batch = batch.set_column(i, pa.field('collect_time', pa.timestamp('ns')),
+                                         pa.array(parsed.astype('datetime64[ns]'), type=pa.timestamp('ns')))
+                parse_s += time.perf_counter() - t0
+            t0 = time.perf_counter()
+            if writer is None:
+                writer = pq.ParquetWriter(parquet_path, batch.schema)
+            writer.write_batch(batch)
+            write_s += time.perf_counter() - t0
+
+            times = batch.column('collect_time')
+            if start_time is None:
+                start_time = times[0].as_py()
+            end_time = times[-1].as_py()
+            n_rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        # Empty csv: still leave a (zero-row) parquet file behind
+        column_types['collect_time'] = pa.timestamp('ns')
+        pq.write_table(pa.schema([(col, column_types[col]) for col in cols]).empty_table(), parquet_path)
+
+    if timings is not None:
+        timings.update(parse_s=parse_s, write_s=write_s)
+    return start_time, end_time, n_rows
+
+
 def print_summary(df_filtered: pd.DataFrame, csv_path: Path, parquet_path: Path):
     """
     Print summary of the conversion process.
@@ -73,58 +197,163 @@ def print_summary(df_filtered: pd.DataFrame, csv_path: Path, parquet_path: Path)
     - Compare CSV and Parquet file sizes
     - Report disk space reduction
     """
+    start_time = df_filtered['collect_time'].iloc[0]
+    end_time = df_filtered['collect_time'].iloc[-1]
+    print_size_summary(start_time, end_time, csv_path, parquet_path)
+
+
+def print_size_summary(start_time, end_time, csv_path: Path, parquet_path: Path):
+    """Log start/end time and the CSV vs Parquet size comparison for one converted file."""
     raw_file_size = csv_path.stat().st_size / 1e6
     parquet_file_size = parquet_path.stat().st_size / 1e6
     reduction_ratio = 100 * (1 - parquet_file_size / raw_file_size)
 
-    start_time = df_filtered['collect_time'].iloc[0]
-    end_time = df_filtered['collect_time'].iloc[-1]
-
     logging.info(f"{'Start time:':<25} {start_time}")
     logging.info(f"{'End time:':<25} {end_time}")
     logging.info(f"{'Disk file size (CSV):':<25} {raw_file_size:.3f} MB")
     logging.info(f"{'Disk file size (Parquet):':<25} {parquet_file_size:.3f} MB")
     logging.info(f"{'Disk space reduction:':<25} {reduction_ratio:.1f}%\n")
 
-def main():
-    csv_dir = Path.cwd().parents[0] / "data" / "original"
-    base_output_dir = Path.cwd().parents[0] / "data" / "filtered" / "TORAY"
-    csv_files = os_sorted(list(csv_dir.glob("*.csv")))
+def convert_csv_file(csv_file: Path, output_dir: Path, include_power: bool, streaming: bool = True) -> dict | None:
+    """
+    Convert one csv file into its filtered parquet file.
 
-    include_power = input("Do you want to include instantaneous power ('Load_Active_Power')? [y/n]: ")
-    include_power = include_power.lower() == 'y'
+    Runs in a worker process when step1 is parallel, so nothing is logged here;
+    the caller logs the returned record in file order.
 
+    Returns
+    -------
+    dict | None
+        {'csv_path', 'parquet_path', 'start_time', 'end_time', 'rows', 'timings'} ('timings': seconds
+        per sub-stage, e.g. {'parse_s', 'write_s'}), or None if the file was skipped
+        (no 'Load_Active_Power' column while include_power is set).
+    """
+    csv_columns = read_csv_columns(csv_file)
+    cols_to_inspect = [
+        'collect_time',
+        'machine_code',
+        'Load_Total_Power_Consumption',
+    ]
     if include_power:
-        output_dir = base_output_dir / "parquet_active_power"
-        output_dir.mkdir(parents=True, exist_ok=True)
-    else:
-        output_dir = base_output_dir / "parquet"
-        output_dir.mkdir(parents=True, exist_ok=True)
+        if 'Load_Active_Power' in csv_columns:
+            cols_to_inspect.append('Load_Active_Power')
+        else:
+            return None
 
-    for idx, csv_file in enumerate(csv_files):
-        logging.info(f"[{idx + 1}] Processing file: {csv_file.name}")
+    out_path = output_dir / make_output_filename(csv_file)
 
+    timings = {}
+    if streaming:
+        start_time, end_time, n_rows = stream_csv_to_parquet(csv_file, out_path, cols_to_inspect, timings=timings)
+    else:
+        t0 = time.perf_counter()
         df = read_csv_file(csv_file)
-        cols_to_inspect = [
-            'collect_time',
-            'machine_code',
-            'Load_Total_Power_Consumption',
-        ]
-        if include_power:
-            if 'Load_Active_Power' in df.columns:
-                cols_to_inspect.append('Load_Active_Power')
-            else:
+        t1 = time.perf_counter()
+        df_filtered = filter_and_convert(df, cols_to_inspect)
+        t2 = time.perf_counter()
+        save_parquet(df_filtered, out_path)
+        timings.update(parse_s=t1 - t0, filter_s=t2 - t1, write_s=time.perf_counter() - t2)
+        start_time = df_filtered['collect_time'].iloc[0]
+        end_time = df_filtered['collect_time'].iloc[-1]
+        n_rows = len(df_filtered)
+
+    return {
+        'csv_path': csv_file,
+        'parquet_path': out_path,
+        'start_time': start_time,
+        'end_time': end_time,
+        'rows': n_rows,
+        'timings': timings,
+    }
+
+
+def run_step1_main(input_dir: Path, output_dir: Path, include_power: bool = False,
+                   streaming: bool = True, workers: int = 1, csv_files: list[Path] | None = None) -> Path:
+    """
+    Convert every csv file in `input_dir` into filtered parquet files.
+
+    Parameters
+    ----------
+    input_dir : Path
+        Directory of the original TORAY csv exports.
+    output_dir : Path
+        Base output directory; files go to 'parquet' or 'parquet_active_power' below it.
+    include_power : bool, optional
+        Also keep 'Load_Active_Power' (files without it are skipped).
+    streaming : bool, optional
+        Use the column-projected streaming reader (default) instead of whole-file read_csv.
+    workers : int, optional
+        Number of worker processes. Files are independent, so they are converted in parallel
+        when workers > 1; log records are still written in file order.
+    csv_files : list[Path] | None, optional
+        Only convert these files (default: every csv file in `input_dir`).
+
+    Returns
+    -------
+    Path
+        Directory containing the filtered parquet files.
+    """
+    if csv_files is None:
+        csv_files = os_sorted(list(Path(input_dir).glob("*.csv")))
+    output_dir = Path(output_dir) / ("parquet_active_power" if include_power else "parquet")
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    if workers > 1 and len(csv_files) > 1:
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(csv_files)))
+        results = executor.map(convert_csv_file, csv_files, repeat(output_dir),
+                               repeat(include_power), repeat(streaming))
+    else:
+        executor = None
+        results = (convert_csv_file(f, output_dir, include_power, streaming) for f in csv_files)
+
+    total_csv_mb = 0.0
+    try:
+        # map() yields in submission order, so the log stays deterministic
+        for idx, (csv_file, result) in enumerate(zip(csv_files, results)):
+            logging.info(f"[{idx + 1}] Processing file: {csv_file.name}")
+            if result is None:
                 print(f"{csv_file.name} does not contain 'Load_Active_Power'. Skipping.")
                 continue
+            print_size_summary(result['start_time'], result['end_time'], csv_file, result['parquet_path'])
+            total_csv_mb += csv_file.stat().st_size / 1e6
 
-        df_filtered = filter_and_convert(df, cols_to_inspect)
+            # Sub-stage metrics measured in the (worker) process that converted the file
+            timings, rows = result['timings'], result['rows']
+            record_stage('parse', timings['parse_s'], rows_out=rows, bytes_read=csv_file.stat().st_size,
+                         files=1, file=csv_file.name)
+            if 'filter_s' in timings:
+                record_stage('filter', timings['filter_s'], rows_in=rows, rows_out=rows, files=1, file=csv_file.name)
+            record_stage('write', timings['write_s'], rows_in=rows, bytes_written=result['parquet_path'].stat().st_size,
+                         files=1, file=csv_file.name)
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
-        out_filename = make_output_filename(csv_file)
-        out_path = output_dir / out_filename
+    elapsed = time.perf_counter() - start
+    throughput = total_csv_mb / elapsed if elapsed > 0 else float('nan')
+    logging.info(f"{'Total CSV processed:':<25} {total_csv_mb:.3f} MB in {elapsed:.2f} s "
+                 f"({throughput:.1f} MB/s, workers={workers})\n")
 
-        save_parquet(df_filtered, out_path)
-        print_summary(df_filtered, csv_file, out_path)
+    return output_dir
+
+
+def main():
+    csv_dir = Path.cwd().parents[0] / "data" / "original"
+    base_output_dir = Path.cwd().parents[0] / "data" / "filtered" / "TORAY"
+
+    include_power = input("Do you want to include instantaneous power ('Load_Active_Power')? [y/n]: ")
+    include_power = include_power.lower() == 'y'
+
+    # Stream only the needed columns into parquet batch by batch (flat memory).
+    # Set False to fall back to the whole-file read_csv path.
+    streaming = True
+
+    # Number of csv files converted in parallel (1 = sequential)
+    workers = os.cpu_count() or 1
+
+    run_step1_main(csv_dir, base_output_dir, include_power=include_power, streaming=streaming, workers=workers)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
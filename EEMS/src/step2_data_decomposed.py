@@ -1,9 +1,17 @@
 import logging
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path
 from natsort import os_sorted
 from datetime import datetime
 
+from partitioned_dataset import write_motor_partitions, clear_motor_partitions
+from timestamp_utils import parse_timestamps
+from stage_metrics import stage
+from arrow_ipc import check_intermediate, ipc_path, open_ipc_writer, unify_dictionaries, write_sidecar
+
 
 # === Setup logging ===
 log_dir = Path.cwd() / "preprocessing_logs"
@@ -21,6 +29,17 @@ logging.basicConfig(
     ]
 )
 
+# Motor name -> machine_code of each line (machine codes repeat across lines)
+MOTOR_MAPS = {
+    'inner': {"P1730A": "FEMS11_01", "P1730B": "FEMS11_02"},
+    'outer': {
+        "P7412A_MCC": "FEMS11_01",
+        "P7412B_MCC": "FEMS11_02",
+        "P7412A_EXT": "FEMS12_01",
+        "P7412B_EXT": "FEMS12_02",
+    },
+}
+
 
 def read_parquet_file(file: Path) -> pd.DataFrame:
     return pd.read_parquet(file)
@@ -93,10 +112,78 @@ def split_motor_by_machine_code(df: pd.DataFrame, mapping: dict[str,str]) -> dic
     return {map_name : df[df['machine_code'] == map_machine_code] for map_name, map_machine_code in mapping.items()}
 
 
-def save_motor_data(df: pd.DataFrame, motor_name: str, output_dir: Path):
+def merge_sorted_runs(df: pd.DataFrame, key: str = 'collect_time') -> pd.DataFrame:
+    """
+    Return `df` ordered by `key`, exploiting already-sorted runs instead of a global sort.
+
+    The TORAY exports are contiguous, time-ordered windows, so a motor's rows are a
+    concatenation of sorted runs (usually one run per source file):
+    - one run (already sorted): returned as is, O(n) check only
+    - non-overlapping runs in the wrong order: runs are concatenated by start time, O(n)
+    - overlapping runs (or many small local inversions): merged with numpy's stable argsort, which
+      for int64/datetime keys is a timsort that detects the existing runs and merges them
+      (O(n log k) for k runs)
+    Runs are handled as (start, stop) arrays, so many small runs cost no Python-level work.
+    """
+    t = df[key].to_numpy()
+    if len(t) < 2:
+        return df.reset_index(drop=True)
+
+    bounds = np.concatenate(([0], np.flatnonzero(t[1:] < t[:-1]) + 1, [len(t)]))
+    if len(bounds) == 2:
+        return df.reset_index(drop=True)
+
+    # Runs ordered by their first key (stable: equal starts keep file order)
+    order = np.argsort(t[bounds[:-1]], kind='stable')
+    starts, stops = bounds[:-1][order], bounds[1:][order]
+    if np.all(t[stops[:-1] - 1] <= t[starts[1:]]):
+        lengths = stops - starts
+        # Row positions of the runs, concatenated: start of each run + position inside it
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        return df.iloc[offsets + np.arange(len(t))].reset_index(drop=True)
+
+    return df.iloc[np.argsort(t, kind='stable')].reset_index(drop=True)
+
+
+def drop_boundary_duplicates(df: pd.DataFrame, key: str = 'collect_time') -> pd.DataFrame:
+    """
+    Drop rows identical to the previous row of a time-sorted DataFrame.
+
+    Consecutive TORAY files share their boundary record (file N ends where file N+1 starts);
+    only rows with a repeated `key` are compared column by column, so this is a single O(n) pass.
+    Missing values compare equal (a boundary row with a NaN measurement is still a duplicate).
+    """
+    t = df[key].to_numpy()
+    idx = np.flatnonzero(t[1:] == t[:-1]) + 1
+    if len(idx) == 0:
+        return df
+
+    same = np.ones(len(idx), dtype=bool)
+    for col in df.columns:
+        values = df[col].to_numpy()
+        same &= (values[idx] == values[idx - 1]) | (pd.isna(values[idx]) & pd.isna(values[idx - 1]))
+    if not same.any():
+        return df
+    return df.drop(index=df.index[idx[same]]).reset_index(drop=True)
+
+
+def same_record(a: pd.Series, b: pd.Series) -> bool:
+    """
+    True if two rows hold the same values, field by field; missing values compare equal, like in
+    `drop_boundary_duplicates` (a shared boundary record with a NaN measurement is still the same record).
+    """
+    if len(a) != len(b):
+        return False
+    return all(x == y or (pd.isna(x) and pd.isna(y)) for x, y in zip(a, b))
+
+
+def save_motor_data(df: pd.DataFrame, motor_name: str, output_dir: Path, intermediate: str = 'parquet'):
     """
     Save motor-specific DataFrame as a Parquet file with time-sorted rows.
 
+    Rows are ordered by merging the already-sorted per-file runs (`merge_sorted_runs`)
+    and the record shared by consecutive files is dropped (`drop_boundary_duplicates`).
+
     Parameters
     ----------
     df : pd.DataFrame
@@ -105,16 +192,20 @@ def save_motor_data(df: pd.DataFrame, motor_name: str, output_dir: Path):
         Motor name used for file naming (e.g., "P1730A").
     output_dir : Path
         Directory where the Parquet file will be saved.
+    intermediate : str, optional
+        'ipc' also writes an uncompressed Arrow IPC sidecar for step3 (arrow_ipc.py).
 
     Returns
     -------
-    None
+    pd.DataFrame
+        The time-sorted DataFrame that was saved.
         Saves a Parquet file and logs summary information (rows, time range, path).
 
     """
     df = df.copy()
-    df['collect_time'] = pd.to_datetime(df['collect_time'], format='mixed')
-    df_sorted = df.sort_values("collect_time").reset_index(drop=True)
+    # Older step1 outputs store collect_time as strings
+    df['collect_time'] = parse_timestamps(df['collect_time'])
+    df_sorted = drop_boundary_duplicates(merge_sorted_runs(df, "collect_time"))
 
     file_name_parquet = f"TORAY_{motor_name}_filtered_decomposed.parquet"
     # file_name_csv = f"TORAY_{motor_name}_filtered_decomposed.csv"
@@ -125,6 +216,7 @@ def save_motor_data(df: pd.DataFrame, motor_name: str, output_dir: Path):
 
     df_sorted.to_parquet(parquet_output_dir)
     # df_sorted.to_csv(csv_output_dir)
+    write_sidecar(df_sorted, parquet_output_dir, intermediate)
 
     start = df_sorted['collect_time'].iloc[0]
     end = df_sorted['collect_time'].iloc[-1]
@@ -135,36 +227,315 @@ def save_motor_data(df: pd.DataFrame, motor_name: str, output_dir: Path):
     logging.info(f"   Parquet saved: {parquet_output_dir}")
     logging.info("   Success\n")
 
+    return df_sorted
 
-def main():
-    base_filtered_dir = Path.cwd().parents[0] / "data" / "filtered" / "TORAY"
-    base_output_dir = Path.cwd().parents[0] / "data" / "decomposed" / "TORAY"
 
-    include_power = input("Do you want to include instantaneous power ('Load_Active_Power')? [y/n]: ")
-    include_power = include_power.lower() == 'y'
+def get_line(pq_file: Path) -> str:
+    """Return 'inner' or 'outer' from the filename convention."""
+    if "inner" in pq_file.name:
+        return "inner"
+    if "outer" in pq_file.name:
+        return "outer"
+    raise ValueError(f"Unknown file type: {pq_file.name}")
 
-    if include_power:
-        input_dir = base_filtered_dir / "parquet_active_power"
-        output_dir = base_output_dir / "parquet_active_power"
+
+def decompose_streaming(parquet_files: list[Path], motor_maps: dict[str, dict[str, str]], output_dir: Path,
+                        dataset_dir: Path | None = None, intermediate: str = 'parquet') -> dict[str, dict]:
+    """
+    Decompose filtered parquet files into per-motor parquet files in a single pass.
+
+    Each input file is read once and split with one groupby on 'machine_code'; every motor's
+    rows are appended to that motor's incremental ParquetWriter. The inner/outer files are never
+    concatenated, so peak memory is bounded by one input file instead of the whole plant history.
+
+    Files are expected in chronological order (os_sorted TORAY exports); the boundary record shared
+    by consecutive files is written once. A motor whose rows arrive out of order is re-ordered from
+    its own output file at the end with `merge_sorted_runs`.
+
+    Parameters
+    ----------
+    parquet_files : list[Path]
+        Filtered parquet files (filenames contain 'inner' or 'outer').
+    motor_maps : dict[str, dict[str, str]]
+        {'inner': {motor name: machine_code}, 'outer': {...}}.
+    output_dir : Path
+        Directory for TORAY_{motor}_filtered_decomposed.parquet files.
+    dataset_dir : Path | None, optional
+        If given, rows are also written to the hive-partitioned dataset.
+    intermediate : str, optional
+        'ipc' also streams every motor into an uncompressed Arrow IPC sidecar (arrow_ipc.py).
+
+    Returns
+    -------
+    dict[str, dict]
+        {motor name: {'path', 'rows', 'start', 'end'}}
+    """
+    check_intermediate(intermediate)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    writers: dict[str, pq.ParquetWriter] = {}
+    ipc_writers = {}
+    ipc_dictionaries: dict[str, dict] = {}
+    stats: dict[str, dict] = {}
+    needs_sort: set[str] = set()
+    last_rows: dict[str, pd.Series] = {}
+
+    if dataset_dir is not None:
+        for line, mapping in motor_maps.items():
+            for motor_name in mapping:
+                clear_motor_partitions(dataset_dir, motor_name, line)
+
+    try:
+        for pq_file in parquet_files:
+            line = get_line(pq_file)
+            with stage('read', file=pq_file.name) as m:
+                df = read_parquet_file(pq_file)
+                logging.info(f"  Loaded: {pq_file.name}  -> rows: {len(df):,}")
+
+                # Older step1 outputs store collect_time as strings
+                df['collect_time'] = parse_timestamps(df['collect_time'], cache_key=pq_file)
+                df['machine_code'] = df['machine_code'].astype('category')
+                m.update(rows_out=len(df), bytes_read=pq_file.stat().st_size, files=1)
+
+            with stage('write', file=pq_file.name, rows_in=len(df)) as m:
+                rows_written = 0
+                code_to_motor = {code: name for name, code in motor_maps[line].items()}
+                for code, group in df.groupby('machine_code', observed=True, sort=False):
+                    motor_name = code_to_motor.get(code)
+                    if motor_name is None:
+                        continue
+                    group = drop_boundary_duplicates(merge_sorted_runs(group))
+                    if motor_name in last_rows and same_record(last_rows[motor_name], group.iloc[0]):
+                        # Boundary record shared with the previous file
+                        group = group.iloc[1:]
+                    if group.empty:
+                        continue
+                    last_rows[motor_name] = group.iloc[-1]
+
+                    start, end = group['collect_time'].iloc[0], group['collect_time'].iloc[-1]
+                    table = pa.Table.from_pandas(group, preserve_index=False)
+
+                    if motor_name not in writers:
+                        path = output_dir / f"TORAY_{motor_name}_filtered_decomposed.parquet"
+                        writers[motor_name] = pq.ParquetWriter(path, table.schema)
+                        if intermediate == 'ipc':
+                            ipc_writers[motor_name] = open_ipc_writer(ipc_path(path), table.schema)
+                            ipc_dictionaries[motor_name] = {}
+                        else:
+                            ipc_path(path).unlink(missing_ok=True)  # sidecar of an earlier 'ipc' run
+                        stats[motor_name] = {'path': path, 'rows': 0, 'start': start, 'end': end}
+                    elif start < stats[motor_name]['end']:
+                        needs_sort.add(motor_name)
+
+                    writers[motor_name].write_table(table.cast(writers[motor_name].schema))
+                    if motor_name in ipc_writers:
+                        # machine_code dictionaries differ between input files
+                        ipc_writers[motor_name].write_table(unify_dictionaries(
+                            table.cast(writers[motor_name].schema), ipc_dictionaries[motor_name]))
+                    info = stats[motor_name]
+                    info['rows'] += len(group)
+                    rows_written += len(group)
+                    info['start'] = min(info['start'], start)
+                    info['end'] = max(info['end'], end)
+
+                    if dataset_dir is not None:
+                        write_motor_partitions(group, dataset_dir, motor_name, line,
+                                               part_name=pq_file.stem, replace=False)
+                m['rows_out'] = rows_written
+
+            del df
+    finally:
+        # Sidecars are closed last, so they are never older than their parquet file
+        for writer in [*writers.values(), *ipc_writers.values()]:
+            writer.close()
+
+    for motor_name in sorted(needs_sort):
+        # Out-of-order source files: merge this one motor's sorted runs
+        logging.info(f"  [{motor_name}] rows arrived out of order -> merging sorted runs")
+        path = stats[motor_name]['path']
+        df_sorted = drop_boundary_duplicates(merge_sorted_runs(pd.read_parquet(path)))
+        df_sorted.to_parquet(path, index=False)
+        write_sidecar(df_sorted, path, intermediate)
+        stats[motor_name]['rows'] = len(df_sorted)
+
+    logging.info("")
+    for motor_name, info in stats.items():
+        logging.info(f"[{motor_name}]")
+        logging.info(f"   Rows:        {info['rows']:,}")
+        logging.info(f"   Time range:  {info['start']} ~ {info['end']}")
+        logging.info(f"   Parquet saved: {info['path']}")
+        logging.info("   Success\n")
+
+    return stats
+
+
+def _rewrite_with_rows(path: Path, table: pa.Table, intermediate: str = 'parquet'):
+    """
+    Replace the motor file by its existing row groups followed by `table`, one row group in memory
+    at a time (parquet cannot be appended in place). The IPC sidecar is streamed alongside.
+
+    Memory is bounded by one row group, but the cost is O(full history): every stored row group is
+    decoded and re-encoded on each append. Appending part files instead (a per-motor directory of
+    parts) would make it O(new rows), but every reader of the single motor file (step3, the frame
+    cache, the run manifest, the IPC sidecars) would have to change, and step3 reads and integrates
+    the whole motor series on every run anyway, so the append is not the asymptotic bottleneck.
+    That change is out of scope here; the partitioned dataset (`dataset_dir`) already gets the new
+    rows as new part files only.
+    """
+    old = pq.ParquetFile(path)
+    schema = old.schema_arrow
+    tmp_path = path.with_name(path.stem + ".tmp.parquet")
+    ipc_writer, dictionaries = None, {}
+    if intermediate == 'ipc':
+        ipc_writer = open_ipc_writer(ipc_path(tmp_path), schema)
+    try:
+        with pq.ParquetWriter(tmp_path, schema) as writer:
+            for part in [*(old.read_row_group(i) for i in range(old.num_row_groups)), table.cast(schema)]:
+                writer.write_table(part)
+                if ipc_writer is not None:
+                    ipc_writer.write_table(unify_dictionaries(part, dictionaries))
+    finally:
+        if ipc_writer is not None:
+            ipc_writer.close()
+    tmp_path.replace(path)
+    if ipc_writer is not None:
+        ipc_path(tmp_path).replace(ipc_path(path))
     else:
-        input_dir = base_filtered_dir / "parquet"
-        output_dir = base_output_dir / "parquet"
+        ipc_path(path).unlink(missing_ok=True)  # sidecar of an earlier 'ipc' run
+
+
+def append_decomposed(parquet_files: list[Path], output_dir: Path, motor_maps: dict[str, dict[str, str]] = MOTOR_MAPS,
+                      dataset_dir: Path | None = None, intermediate: str = 'parquet') -> dict[str, dict]:
+    """
+    Append the rows of new filtered parquet files (e.g. one new TORAY export) to the existing
+    per-motor decomposed files, without re-reading the other source files.
+
+    Rows that continue a motor after its last stored record are appended (the boundary record shared
+    with the previous export is written once). If new rows fall before the stored end (out-of-order
+    export), that motor's file is merged and rewritten instead.
+
+    Only the source files are not re-read: the motor file itself is still rewritten row group by
+    row group (`_rewrite_with_rows`), which is O(full history); dataset partitions are O(new rows).
+
+    Parameters
+    ----------
+    parquet_files : list[Path]
+        New filtered parquet files (filenames contain 'inner' or 'outer').
+    output_dir : Path
+        Directory of the TORAY_{motor}_filtered_decomposed.parquet files.
+    motor_maps : dict[str, dict[str, str]], optional
+        {'inner': {motor name: machine_code}, 'outer': {...}}.
+    dataset_dir : Path | None, optional
+        If given, the new rows are also added to the hive-partitioned dataset.
+    intermediate : str, optional
+        'ipc' also rewrites the Arrow IPC sidecars (arrow_ipc.py).
+
+    Returns
+    -------
+    dict[str, dict]
+        {motor name: {'path', 'rows_added', 'since'}}; 'since' is the earliest new timestamp, i.e. every
+        day from since.date() on must be recomputed by step3 (the first one usually is the partial day
+        at the boundary with the previous export).
+    """
+    check_intermediate(intermediate)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # New rows of every motor (only the new files are read)
+    new_rows: dict[str, list[pd.DataFrame]] = {}
+    lines: dict[str, str] = {}
+    for pq_file in parquet_files:
+        line = get_line(pq_file)
+        with stage('read', file=pq_file.name) as m:
+            df = read_parquet_file(pq_file)
+            df['collect_time'] = parse_timestamps(df['collect_time'], cache_key=pq_file)
+            df['machine_code'] = df['machine_code'].astype('category')
+            m.update(rows_out=len(df), bytes_read=pq_file.stat().st_size, files=1)
+        logging.info(f"  Loaded (append): {pq_file.name}  -> rows: {len(df):,}")
+
+        code_to_motor = {code: name for name, code in motor_maps[line].items()}
+        for code, group in df.groupby('machine_code', observed=True, sort=False):
+            motor_name = code_to_motor.get(code)
+            if motor_name is not None:
+                new_rows.setdefault(motor_name, []).append(group)
+                lines[motor_name] = line
+
+    appended = {}
+    for motor_name, groups in new_rows.items():
+        with stage('append', motor=motor_name) as m:
+            path = output_dir / f"TORAY_{motor_name}_filtered_decomposed.parquet"
+            group = drop_boundary_duplicates(merge_sorted_runs(pd.concat(groups, ignore_index=True)))
+
+            if not path.exists():
+                group.to_parquet(path, index=False)
+                write_sidecar(group, path, intermediate)
+            else:
+                old = pq.ParquetFile(path)
+                last_group = old.read_row_group(old.num_row_groups - 1)
+                last = last_group.slice(last_group.num_rows - 1).to_pandas()
+                last['collect_time'] = parse_timestamps(last['collect_time'])
+                last_row = last.iloc[0]
+                if same_record(last_row, group.iloc[0]):
+                    # Boundary record shared with the previous export
+                    group = group.iloc[1:]
+                if group.empty:
+                    continue
+
+                if group['collect_time'].iloc[0] >= last_row['collect_time']:
+                    _rewrite_with_rows(path, pa.Table.from_pandas(group, preserve_index=False), intermediate)
+                else:
+                    logging.info(f"  [{motor_name}] new rows overlap the stored range -> merging sorted runs")
+                    df_all = pd.concat([pd.read_parquet(path), group], ignore_index=True)
+                    df_all['collect_time'] = parse_timestamps(df_all['collect_time'])
+                    df_sorted = drop_boundary_duplicates(merge_sorted_runs(df_all))
+                    df_sorted.to_parquet(path, index=False)
+                    write_sidecar(df_sorted, path, intermediate)
+
+            if dataset_dir is not None:
+                write_motor_partitions(group, dataset_dir, motor_name, lines[motor_name],
+                                       part_name=f"append-{parquet_files[-1].stem}", replace=False)
+
+            since = group['collect_time'].iloc[0]
+            appended[motor_name] = {'path': path, 'rows_added': len(group), 'since': since}
+            m.update(rows_out=len(group), bytes_written=path.stat().st_size, files=1)
+            logging.info(f"[{motor_name}] appended {len(group):,} rows from {since} -> {path}")
+
+    return appended
+
+
+def run_step2(input_dir: Path, output_dir: Path, dataset_dir: Path | None = None, streaming: bool = True,
+              intermediate: str = 'parquet') -> Path:
+    """
+    Decompose the filtered inner/outer parquet files in `input_dir` into one parquet file per motor.
+
+    With `streaming` (default) the files are decomposed one at a time by `decompose_streaming`;
+    otherwise all files are loaded and concatenated first (original in-memory path).
 
+    If `dataset_dir` is given, every motor is also written to a hive-partitioned dataset
+    (site / line / motor / date) there, so later steps can read single motors or days by partition pruning.
+
+    `intermediate` 'ipc' also writes an uncompressed Arrow IPC sidecar next to every motor's parquet
+    file, which step3 memory-maps instead of decoding the parquet file (arrow_ipc.py).
+
+    Returns
+    -------
+    Path
+        Directory containing the per-motor decomposed parquet files.
+    """
+    input_dir, output_dir = Path(input_dir), Path(output_dir)
     parquet_files = os_sorted(input_dir.glob("*.parquet"))
 
     logging.info(f"[STEP2] TORAY Decomposition Log")
     logging.info(f"Started at: {datetime.now()}\n")
     logging.info(f"Total parquet files: {len(parquet_files)}\n")
 
-    inner_df_list, outer_df_list = load_and_group_by_motor(parquet_files)
+    inner_map, outer_map = MOTOR_MAPS['inner'], MOTOR_MAPS['outer']
 
-    inner_map = {"P1730A":"FEMS11_01", "P1730B":"FEMS11_02"}
-    outer_map = {
-        "P7412A_MCC": "FEMS11_01",
-        "P7412B_MCC": "FEMS11_02",
-        "P7412A_EXT": "FEMS12_01",
-        "P7412B_EXT": "FEMS12_02",
-    }
+    if streaming:
+        decompose_streaming(parquet_files, MOTOR_MAPS, output_dir, dataset_dir, intermediate)
+        logging.info(f"Finished at: {datetime.now()}\n")
+        return output_dir
+
+    check_intermediate(intermediate)
+    inner_df_list, outer_df_list = load_and_group_by_motor(parquet_files)
 
     inner_df = pd.concat(inner_df_list, ignore_index=True)
     outer_df = pd.concat(outer_df_list, ignore_index=True)
@@ -175,10 +546,39 @@ def main():
     motor_dict = {**inner_dict, **outer_dict}
 
     for name, df in motor_dict.items():
-        save_motor_data(df, name, output_dir)
+        df_sorted = save_motor_data(df, name, output_dir, intermediate)
+        if dataset_dir is not None:
+            line = "inner" if name in inner_map else "outer"
+            write_motor_partitions(df_sorted, dataset_dir, name, line)
+            logging.info(f"   Partitions written: {dataset_dir}/site=TORAY/line={line}/motor={name}\n")
 
     logging.info(f"Finished at: {datetime.now()}\n")
 
+    return output_dir
+
+
+def main():
+    base_filtered_dir = Path.cwd().parents[0] / "data" / "filtered" / "TORAY"
+    base_output_dir = Path.cwd().parents[0] / "data" / "decomposed" / "TORAY"
+
+    include_power = input("Do you want to include instantaneous power ('Load_Active_Power')? [y/n]: ")
+    include_power = include_power.lower() == 'y'
+
+    if include_power:
+        input_dir = base_filtered_dir / "parquet_active_power"
+        output_dir = base_output_dir / "parquet_active_power"
+    else:
+        input_dir = base_filtered_dir / "parquet"
+        output_dir = base_output_dir / "parquet"
+
+    # Also write the hive-partitioned dataset (site / line / motor / date); None to skip
+    dataset_dir = output_dir.parent / f"{output_dir.name}_partitioned"
+
+    # 'ipc': also write memory-mappable Arrow IPC sidecars for step3 ('parquet' only: archival files)
+    intermediate = 'ipc'
+
+    run_step2(input_dir, output_dir, dataset_dir=dataset_dir, intermediate=intermediate)
+
 
 if __name__ == "__main__":
     main()
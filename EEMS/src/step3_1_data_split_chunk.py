@@ -1,19 +1,39 @@
+import os
 from pathlib import Path
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from partitioned_dataset import list_partitions, read_motor_data
+from timestamp_utils import parse_timestamps
+from plot_render import PLOT_MODES, DEFAULT_DPI, render_spec, render_plots, init_plot_worker
+from energy_integration import integrate_energy, DEFAULT_MAX_GAP_SECONDS
+from stage_metrics import stage, capture_records, emit_records
+from arrow_ipc import check_intermediate, read_intermediate, write_sidecar
+from chunk_store import CHUNK_LAYOUTS, write_chunk_store, store_paths
+from frame_cache import DEFAULT_MAX_BYTES, frame_key, load_cached_frame, store_cached_frame, cached_frame, evict
+from window_engine import (DEFAULT_WINDOWS, prepare_series, window_table, compute_window_tables, window_rows,
+                           window_floor, window_key)
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 import time
 
-plt.rcParams['font.family'] = 'Times New Roman'
-
 '''
 (P_current + P_next) / 2 * Δt_hours is the trapezoidal integration formula
 to convert instantaneous power data into interval energy consumption (Wh).
+It is applied once over the whole motor series (energy_integration.py), so the interval
+crossing midnight is kept and every day slices the same persistent cumulative column.
 
 For more details, please refer to https://en.wikipedia.org/wiki/Trapezoidal_rule
 '''
 
+# Transform of `prepare_motor_frame` (part of the frame cache key)
+MOTOR_FRAME_PARAMS = {'parse': 'collect_time', 'round': 's', 'sort': 'collect_time', 'date': True, 'columns': None}
+
+DAILY_COLUMNS = ['date', 'start_pos', 'end_pos', 'row_count', 'hours_mask', 'missing_hours', 'max_gap_hours',
+                 'mean', 'first_value', 'last_value', 'total_diff', 'start', 'end', 'delta_t', 'diff_rate', 'reasons']
+
+
 def get_motor_name(stem: str) -> str:
     """Extract motor name from file stem."""
     exception_filenames = ['P1730A', 'P1730B']
@@ -23,131 +43,367 @@ def get_motor_name(stem: str) -> str:
     return '_'.join(parts[:3])
 
 
-def process_file(pq_file: Path, output_dir: Path, full_hours: set, include_power: bool) -> tuple[list, list]:
-    """Process a single parquet file and return missing_info, saved_info."""
-    missing_info = []
-    saved_info = []
+def process_file(pq_file: Path, output_dir: Path, full_hours: set, include_power: bool,
+                 plot_specs: list | None = None, dpi: int = DEFAULT_DPI,
+                 chunk_layout: str = 'files', intermediate: str = 'parquet',
+                 since: pd.Timestamp | None = None, windows: dict | None = None,
+                 window_info: dict | None = None, cache_dir: Path | None = None) -> tuple[list, list]:
+    """
+    Process a single parquet file (read through its fresh step2 IPC sidecar if there is one)
+    and return missing_info, saved_info (of the days from `since` on, if given).
 
+    With `cache_dir`, the parsed, rounded and sorted frame comes from the frame cache
+    (frame_cache.py) when the file is unchanged, and is stored there otherwise.
+    """
     print(f"Processing file: {pq_file.name}")
-    df = pd.read_parquet(pq_file)
-    df['collect_time'] = pd.to_datetime(df['collect_time'], format='mixed', errors='coerce').dt.round('S')
-    df = df.sort_values('collect_time').reset_index(drop=True)
-    df['date'] = df['collect_time'].dt.date
-
     motor_name = get_motor_name(pq_file.stem)
+    key = frame_key(pq_file, MOTOR_FRAME_PARAMS) if cache_dir is not None else None
+    with stage('read', motor=motor_name) as m:
+        df = load_cached_frame(cache_dir, key) if key is not None else None
+        cached = df is not None
+        if not cached:
+            df = read_intermediate(pq_file)
+        m.update(rows_out=len(df), bytes_read=pq_file.stat().st_size, files=1,
+                 cache=None if key is None else ('hit' if cached else 'miss'))
+    if not cached:
+        df = prepare_motor_frame(df, motor_name)
+        if key is not None:
+            store_cached_frame(cache_dir, key, df)
+    return process_motor_frame(df, motor_name, output_dir, full_hours, include_power, plot_specs, dpi,
+                               chunk_layout=chunk_layout, intermediate=intermediate, since=since,
+                               windows=windows, window_info=window_info, prepared=True)
+
+
+def prepare_motor_frame(df: pd.DataFrame, motor_name: str) -> pd.DataFrame:
+    """Parse 'collect_time', round it to seconds, sort by it and add the 'date' column (`MOTOR_FRAME_PARAMS`)."""
+    with stage('parse', motor=motor_name, rows_in=len(df)) as m:
+        df['collect_time'] = parse_timestamps(df['collect_time'], errors='coerce')
+        df['collect_time'] = df['collect_time'].dt.round('s')
+        df = df.sort_values('collect_time').reset_index(drop=True)
+        df['date'] = df['collect_time'].dt.date
+        m['rows_out'] = len(df)
+    return df
+
+
+def load_motor_frame(pq_file: Path, cache_dir: Path | None = None, max_bytes: int = DEFAULT_MAX_BYTES) -> pd.DataFrame:
+    """
+    Ready-to-use frame of a decomposed motor file (`prepare_motor_frame`), through the same frame
+    cache entries as step3_1, e.g. for ad-hoc analysis of a motor's history.
+    """
+    pq_file = Path(pq_file)
+    return cached_frame(pq_file, lambda: prepare_motor_frame(read_intermediate(pq_file), get_motor_name(pq_file.stem)),
+                        MOTOR_FRAME_PARAMS, cache_dir, max_bytes)
 
-    parquet_dir = output_dir / motor_name / "24h" / "parquets"
-    plot_dir = output_dir / motor_name / "24h" / "plots"
-    parquet_dir.mkdir(parents=True, exist_ok=True)
-    plot_dir.mkdir(parents=True, exist_ok=True)
 
+def process_file_task(pq_file: Path, output_dir: Path, full_hours: set, include_power: bool, plot_mode: str,
+                      dpi: int, chunk_layout: str, intermediate: str, since: pd.Timestamp | None,
+                      windows: dict | None, cache_dir: Path | None) -> dict:
+    """
+    `process_file` in a pool worker: returns its summary rows, plot specs (deferred mode),
+    window rows and the worker's stage metrics records for the parent to merge.
+    """
+    records = capture_records()
+    plot_specs = None if plot_mode == 'inline' else []
+    window_info = {}
+    missing_info, saved_info = process_file(pq_file, output_dir, full_hours, include_power, plot_specs, dpi,
+                                            chunk_layout, intermediate, since, windows, window_info, cache_dir)
+    return {
+        'missing_info': missing_info,
+        'saved_info': saved_info,
+        'plot_specs': plot_specs or [],
+        'window_info': window_info,
+        'records': list(records),
+    }
+
+
+def compute_daily_table(collect_time: pd.Series, target: pd.Series, full_hours: set,
+                        min_energy_wh: float = 1000, carry_over: bool = False,
+                        interval: pd.Series | None = None) -> pd.DataFrame:
+    """
+    Compute the per-day validity/quality table of one motor in a single vectorized pass.
+
+    Parameters
+    ----------
+    collect_time : pd.Series
+        Time-sorted timestamps of the motor series.
+    target : pd.Series
+        Energy series (Wh) aligned with `collect_time` (cumulative counter or integrated power).
+    full_hours : set
+        Hours that must be present for a day to be complete (normally range(24)).
+    min_energy_wh : float, optional
+        Days whose total diff is below this value are skipped (default 1000 Wh).
+    carry_over : bool, optional
+        `target` is a persistent cumulative column (whole-series integration): 'total_diff' is
+        last value of the day - last value of the previous row, so the interval crossing midnight
+        counts in the day it ends in, and so does its gap for 'over_1h_gap' (default False).
+    interval : pd.Series | None, optional
+        Per-interval consumption aligned with `target` ('interval_consumption'); when given,
+        'almost_zero_mean' is judged on it, as the per-day cumsum of the original loop was.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per calendar day with:
+        - 'date', 'start_pos', 'end_pos' : day and its row slice [start_pos, end_pos) in the series
+        - 'row_count', 'hours_mask' (bit h set = hour h present), 'missing_hours'
+        - 'max_gap_hours' : largest gap between consecutive rows inside the day (with `carry_over`
+          also the gap into its first row)
+        - 'mean', 'first_value', 'last_value', 'total_diff', 'start', 'end', 'delta_t', 'diff_rate'
+        - 'reasons' : list of skip reasons ('over_1h_gap', 'missing_hour', 'almost_zero_mean',
+          'total_consumption_under_{min_energy_wh}Wh'); empty for valid days
+
+    Note: without `carry_over`, 'total_diff' is last - second value of the day, as in the
+    original per-day loop. This is the '24h' resolution of the window engine (window_engine.py).
+    """
+    table = window_table(prepare_series(collect_time, target, interval), {**DEFAULT_WINDOWS['24h'], 'min_energy_wh': min_energy_wh},
+                         required_slots=full_hours, carry_over=carry_over)
+    if table.empty:
+        return pd.DataFrame(columns=DAILY_COLUMNS)
+    table = table.rename(columns={'slots_mask': 'hours_mask', 'missing_slots': 'missing_hours'})
+    table.insert(0, 'date', table['window_start'].dt.date)
+    return table[DAILY_COLUMNS]
+
+
+def add_energy_columns(df: pd.DataFrame, include_power: bool,
+                       max_gap_seconds: float = DEFAULT_MAX_GAP_SECONDS) -> str:
+    """
+    Add the per-row columns of a time-sorted motor frame (in place) and return the energy column
+    the days are judged on ('calc_load_total_power_consumption' with `include_power`, otherwise
+    the original 'Load_Total_Power_Consumption' counter).
+    """
     SECONDS_PER_HOUR = 3600
 
-    for date, group in df.groupby('date'):
-        group = group.copy() # protect against SettingWithCopy
-        group_hours = set(group['collect_time'].dt.hour.unique())
-        missing = sorted(full_hours - group_hours)
+    # Per-row time difference for the whole series; the first row of every day starts fresh (NaN),
+    # exactly like computing it inside each daily group
+    day_start = df['date'].ne(df['date'].shift())
+
+    # Calculate time difference (unit: hours)
+    df['time_diff_hours'] = df['collect_time'].diff().dt.total_seconds() / SECONDS_PER_HOUR
+    df.loc[day_start, 'time_diff_hours'] = np.nan
+
+    if not include_power:
+        return 'Load_Total_Power_Consumption'  # Wh (original data)
+
+    # Calculate total power energy consumption (Wh) for each time interval from instantaneous active power data
+
+    # Average power (trapezoidal rule, unit: W)
+    df['avg_power'] = (df['Load_Active_Power'] + df['Load_Active_Power'].shift(1)) / 2
+
+    target_column = 'calc_load_total_power_consumption'
+
+    # Interval consumption (W * hours = Wh) and persistent cumulative energy over the whole series (unit: Wh);
+    # intervals longer than max_gap_seconds are not integrated
+    df['interval_consumption'], df[target_column] = integrate_energy(
+        df['collect_time'], df['Load_Active_Power'], max_gap_seconds)
+    return target_column
+
+
+def missing_row(motor_name: str, day) -> dict:
+    """missing_24h_summary.csv row of a skipped day (row of `compute_daily_table`)."""
+    return {
+        'motor': motor_name,
+        'date': day.date,
+        'row_count': int(day.row_count),
+        'missing_reason': ';'.join(day.reasons),
+        'missing_hours': day.missing_hours if day.missing_hours else None,
+    }
+
+
+def saved_row(motor_name: str, day) -> dict:
+    """saved_24h_summary.csv row of a valid day (row of `compute_daily_table`)."""
+    # Note: 'first_value'/'last_value' base on chosen target series
+    return {
+        'motor': motor_name,
+        'date': str(day.date),
+        'row_count': int(day.row_count),
+        'total_diff_Wh': day.total_diff,
+        'diff_rate_Wh_per_h': float(day.diff_rate) if np.isfinite(day.diff_rate) else None,
+        'delta_t_hours': float(day.delta_t),
+        'first_value_Wh': float(day.first_value),
+        'last_value_Wh': float(day.last_value),
+        'start': day.start,
+        'end': day.end
+    }
+
+
+def process_motor_frame(df: pd.DataFrame, motor_name: str, output_dir: Path, full_hours: set,
+                        include_power: bool, plot_specs: list | None = None,
+                        dpi: int = DEFAULT_DPI, max_gap_seconds: float = DEFAULT_MAX_GAP_SECONDS,
+                        chunk_layout: str = 'files', intermediate: str = 'parquet',
+                        since: pd.Timestamp | None = None, windows: dict | None = None,
+                        window_info: dict | None = None, prepared: bool = False) -> tuple[list, list]:
+    """
+    Split one motor's DataFrame into 24h chunks and return missing_info, saved_info.
 
-        # Calculate time difference (unit: hours)
-        group['time_diff_hours'] = group['collect_time'].diff().dt.total_seconds() / SECONDS_PER_HOUR
+    With `since` (append mode), the whole series is still integrated and judged, but only the days
+    from since.date() on are re-written, re-plotted and returned; their old per-day files are removed
+    first. A chunk store is always rewritten whole (its other days come from the same frame).
 
-        if include_power:
-            # Calculate total power energy consumption (Wh) for each time interval from instantaneous active power data
+    `chunk_layout` 'files' writes one parquet file per valid day (24h/parquets/); 'store' writes
+    one parquet file per motor with a row group per valid day plus a day index (chunk_store.py).
+    `intermediate` 'ipc' also writes uncompressed Arrow IPC sidecars of the chunks for step3_2 (arrow_ipc.py).
 
-            # Average power (trapezoidal rule, unit: W)
-            group['avg_power'] = (group['Load_Active_Power'] + group['Load_Active_Power'].shift(1)) / 2
+    With `include_power`, 'Load_Active_Power' is integrated once over the whole series
+    (intervals longer than `max_gap_seconds` are not integrated).
 
-            # Interval consumption (W * hours = Wh)
-            group['interval_consumption'] = group['avg_power'] * group['time_diff_hours']
+    Plots of valid days are rendered right after the writes (own 'plot' stage), unless `plot_specs`
+    is a list: then their specs are appended to it for a later `render_plots` call.
 
-            target_column = 'calc_load_total_power_consumption'
+    `windows` ({name: spec}, see window_engine.py) adds summary-only resolutions (e.g. '1h', '8h', '7d')
+    computed from the same integrated series; their rows are appended to
+    window_info[name]['missing' / 'saved'] (windows ending after `since` only, in append mode).
 
-            # Cumulative energy consumption (unit: Wh)
-            group[target_column] = group['interval_consumption'].cumsum()
-            target = group[target_column]  # Wh
+    `prepared`: `df` already went through `prepare_motor_frame` (e.g. it came from the frame cache).
+    """
+    missing_info = []
+    saved_info = []
 
-        else:
-            target_column = 'Load_Total_Power_Consumption'
-            target = group['Load_Total_Power_Consumption']  # Wh (original data)
-
-        # Total consumption difference (unit: Wh)
-        total_diff = target.iloc[-1] - target.iloc[1]
-
-        reasons = []
-        if (group['time_diff_hours'][1:] >= 1).any(): # gap >= 1 hour
-            reasons.append('over_1h_gap')
-        if missing:
-            reasons.append('missing_hour')
-        if target.mean() < 1e-6:    # Check if mean value is nearly zero (unit: Wh) 0.000001 Wh
-            reasons.append('almost_zero_mean')
-
-        MINIMUM_ENERGY_THRESHOLD = 1000  # Wh threshold
-        if abs(total_diff) < MINIMUM_ENERGY_THRESHOLD:
-            reasons.append(f'total_consumption_under_{MINIMUM_ENERGY_THRESHOLD}Wh')
-
-        if reasons:
-            missing_info.append({
-                'motor': motor_name,
-                'date': date,
-                'missing_reason': ';'.join(reasons),
-                'missing_hours': missing if missing else None,
-            })
-            print(f" {date} -> Skip saving, reasons: {reasons}")
-            continue
-
-        # Compute delta_t (hours) and average diff rate (Wh/h)
-
-        start_dt = group['collect_time'].min()
-        end_dt = group['collect_time'].max()
-
-        delta_t = (end_dt - start_dt).total_seconds() / 3600.0
-        diff_rate = total_diff / delta_t if delta_t > 0 else np.nan
-
-        fname = f"{start_dt.strftime('%Y-%m-%d_%H%M%S')}_to_{end_dt.strftime('%Y-%m-%d_%H%M%S')}"
-
-        fig, ax = plt.subplots(figsize=(14, 5))
-        ax.scatter(group['collect_time'], target - target.min(), s=3)
-        ax.set_title(
-            f"{motor_name} | {start_dt.strftime('%Y-%m-%d %H:%M:%S')} ~ {end_dt.strftime('%Y-%m-%d %H:%M:%S')}",
-            fontsize=12
-        )
-        ax.set_xlabel("Time")
-        ax.set_ylabel(f"adjusetd {target_column}")
-        ax.grid(True)
-
-        ax2 = ax.twinx()
-        ax2.plot(group['collect_time'], target.diff(), color='red', label='Derivative', alpha=0.3, zorder=0)
-        ax2.set_ylabel("Derivative", color='red')
-        ax2.tick_params(axis='y', labelcolor='red')
-
-        group.to_parquet(parquet_dir / f"{fname}.parquet", index=False)
-        print(f" Saved: {parquet_dir / f'{fname}.parquet'}")
-
-        # Summarize saved info
-        # Note: 'first_value'/'last_value' base on chosen target series
-        saved_info.append({
-            'motor': motor_name,
-            'date': str(date),
-            'total_diff_Wh': total_diff,
-            'diff_rate_Wh_per_h': float(diff_rate) if np.isfinite(diff_rate) else None,
-            'delta_t_hours': float(delta_t),
-            'first_value_Wh': float(target.iloc[0]),
-            'last_value_Wh': float(target.iloc[-1]),
-            'start': start_dt,
-            'end': end_dt
-        })
-
-        plot_fname = f"{fname}.png"
-        fig.savefig(plot_dir / plot_fname, dpi=600)
-        plt.close(fig)
-        print(f"Plot: {plot_dir / plot_fname}")
+    if not prepared:
+        df = prepare_motor_frame(df, motor_name)
+
+    if chunk_layout not in CHUNK_LAYOUTS:
+        raise ValueError(f"Unknown chunk_layout: {chunk_layout} (expected one of {CHUNK_LAYOUTS})")
+    check_intermediate(intermediate)
+
+    parquet_dir = output_dir / motor_name / "24h" / "parquets"
+    plot_dir = output_dir / motor_name / "24h" / "plots"
+    if chunk_layout == 'files':
+        parquet_dir.mkdir(parents=True, exist_ok=True)
+    plot_dir.mkdir(parents=True, exist_ok=True)
+    store_path, _ = store_paths(output_dir / motor_name)
+    store_chunks = []
+
+    with stage('compute', motor=motor_name, rows_in=len(df)) as m:
+        target_column = add_energy_columns(df, include_power, max_gap_seconds)
+        interval = df['interval_consumption'] if include_power else None
+        daily = compute_daily_table(df['collect_time'], df[target_column], full_hours, carry_over=include_power,
+                                    interval=interval)
+        m['rows_out'] = len(daily)
+
+    if windows:
+        with stage('windows', motor=motor_name, rows_in=len(df)) as m:
+            tables = compute_window_tables(df['collect_time'], df[target_column], windows, carry_over=include_power,
+                                           interval=interval)
+            for name, table in tables.items():
+                missing_rows, saved_rows = window_rows(motor_name, table, since)
+                info = window_info.setdefault(name, {'missing': [], 'saved': []})
+                info['missing'].extend(missing_rows)
+                info['saved'].extend(saved_rows)
+            m['rows_out'] = sum(len(table) for table in tables.values())
+
+    first_day = None
+    if since is not None:
+        first_day = pd.Timestamp(since).date()
+        # Chunk / plot names start with the day ('YYYY-MM-DD_HHMMSS_to_...'); stale days are replaced
+        stale_dirs = [parquet_dir, plot_dir] if chunk_layout == 'files' else [plot_dir]
+        for stale in [f for d in stale_dirs for f in d.glob("*_to_*")]:
+            if stale.name[:10] >= str(first_day):
+                stale.unlink()
+
+    inline_plots = []  # (spec, day rows) rendered in their own 'plot' stage after the writes
+    with stage('write', motor=motor_name) as m:
+        written = []
+        for day in daily.itertuples(index=False):
+            date = day.date
+            reasons = day.reasons
+            selected = first_day is None or date >= first_day
+
+            if reasons:
+                if not selected:
+                    continue
+                missing_info.append(missing_row(motor_name, day))
+                print(f" {date} -> Skip saving, reasons: {reasons}")
+                continue
+
+            group = df.iloc[day.start_pos:day.end_pos]
+            start_dt, end_dt = day.start, day.end
+
+            fname = f"{start_dt.strftime('%Y-%m-%d_%H%M%S')}_to_{end_dt.strftime('%Y-%m-%d_%H%M%S')}"
+
+            if chunk_layout == 'store':
+                # Row group = position of the day in the store
+                source = {'source': store_path, 'row_group': len(store_chunks)}
+                store_chunks.append((str(date), fname, group))
+            if not selected:
+                continue
+            if chunk_layout == 'files':
+                source = {'source': parquet_dir / f"{fname}.parquet"}
+                group.to_parquet(parquet_dir / f"{fname}.parquet", index=False)
+                written.append(parquet_dir / f"{fname}.parquet")
+                write_sidecar(group, parquet_dir / f"{fname}.parquet", intermediate)
+                print(f" Saved: {parquet_dir / f'{fname}.parquet'}")
+
+            # Summarize saved info
+            saved_info.append(saved_row(motor_name, day))
+
+            spec = {
+                'kind': 'daily',
+                **source,
+                'out_path': plot_dir / f"{fname}.png",
+                'dpi': dpi,
+                'title': f"{motor_name} | {start_dt.strftime('%Y-%m-%d %H:%M:%S')} ~ {end_dt.strftime('%Y-%m-%d %H:%M:%S')}",
+                'target_column': target_column,
+            }
+            if plot_specs is None:
+                inline_plots.append((spec, group))
+            else:
+                plot_specs.append(spec)
+
+        if chunk_layout == 'store':
+            write_chunk_store(output_dir / motor_name, store_chunks, intermediate)
+            print(f" Saved: {store_path} ({len(store_chunks)} days)")
+            written = [store_path] if store_chunks else []
+        m.update(rows_out=sum(info['row_count'] for info in saved_info), files=len(written),
+                 bytes_written=sum(path.stat().st_size for path in written))
+
+    if inline_plots:
+        with stage('plot', motor=motor_name, files=len(inline_plots), mode='inline'):
+            for spec, group in inline_plots:
+                render_spec(spec, data=group)
+                print(f"Plot: {spec['out_path']}")
 
     return missing_info, saved_info
 
+def _first_exceeding(values: np.ndarray, start: int, level, min_step_size) -> int:
+    """
+    Index of the first value at or after `start` that differs from `level` by more than
+    `min_step_size` (len(values) if none). Scans forward in growing windows, so the total
+    work is linear in the distance travelled and every comparison runs in numpy.
+    """
+    n = len(values)
+    window = 256
+    pos = start
+    while pos < n:
+        chunk = values[pos:pos + window]
+        hits = np.flatnonzero(np.abs(chunk - level) > min_step_size)
+        if hits.size:
+            return pos + int(hits[0])
+        pos += window
+        window = min(window * 2, 1 << 20)
+    return n
+
+
+def _make_segment(data, start_idx: int, end_idx: int, level, segment_type: str = 'stable') -> dict:
+    return {
+        'start_idx': start_idx,
+        'end_idx': end_idx,
+        'start_time': data.index[start_idx],
+        'end_time': data.index[end_idx],
+        'level': level,
+        'duration': end_idx - start_idx + 1,
+        'type': segment_type
+    }
+
+
 def find_step_changes(data, min_step_size=1000, min_duration=30):
     """
     Detect step-like changes in power consumption data.
 
+    A segment keeps the value of its first point as level; it ends right before the first
+    point that differs from that level by more than `min_step_size`. The search for that point
+    is vectorized (`_first_exceeding`), so the cost is O(n) numpy work plus one Python step per
+    segment instead of one per point.
+
     Parameters
     ----------
     data : pandas.Series
@@ -174,50 +430,360 @@ def find_step_changes(data, min_step_size=1000, min_duration=30):
     if len(data) == 0:
         return segments
 
-    current_level = data.iloc[0]
+    values = data.to_numpy()
+    n = len(values)
     segment_start_idx = 0
-    segment_start_time = data.index[0]
-
-    for i in range(1, len(data)):
-        current_value = data.iloc[i]
-
-        # 현재 레벨과 큰 차이가 나면 새 구간으로 판단
-        # If there is a significant difference from the current level,
-        # consider it as the start of a new segment
-        if abs(current_value - current_level) > min_step_size:
-            # If the previous segment is long enough, save it
-            # 이전 구간이 충분히 길면 저장
-            duration = i - segment_start_idx
-            if duration > min_duration:
-                segments.append({
-                    'start_idx': segment_start_idx,
-                    'end_idx': i - 1,
-                    'start_time': segment_start_time,
-                    'end_time': data.index[i - 1],
-                    'level': current_level,
-                    'duration': duration,
-                    'type': 'stable'
-                })
-
-            segment_start_idx = i
-            segment_start_time = data.index[i]
-            current_level = current_value
-
-    final_duration = len(data) - segment_start_idx
-    if final_duration > min_duration:
-        segments.append({
-            'start_idx': segment_start_idx,
-            'end_idx': len(data) - 1,
-            'start_time': segment_start_time,
-            'end_time': data.index[-1],
-            'level': current_level,
-            'duration': final_duration,
-            'type': 'stable'
-        })
+
+    while True:
+        current_level = values[segment_start_idx]
+        # 현재 레벨과 큰 차이가 나는 첫 지점에서 새 구간 시작
+        # The first point with a significant difference from the current level starts a new segment
+        i = _first_exceeding(values, segment_start_idx + 1, current_level, min_step_size)
+
+        # If the segment is long enough, save it
+        # 구간이 충분히 길면 저장
+        if i - segment_start_idx > min_duration:
+            segments.append(_make_segment(data, segment_start_idx, i - 1, current_level))
+
+        if i >= n:
+            break
+        segment_start_idx = i
 
     return segments # list of segment dictionaries with start/end info
 
 
+def find_change_points(data, penalty: float | None = None, n_bkps: int | None = None, algorithm: str = 'pelt',
+                       model: str = 'l2', min_duration: int = 30, jump: int | None = None):
+    """
+    Detect change points with the `ruptures` library and return segments in the same
+    format as `find_step_changes`.
+
+    Parameters
+    ----------
+    data : pandas.Series
+        Power consumption data (index = timestamps).
+    penalty : float | None, optional
+        Penalty per change point (PELT / binary segmentation); higher -> fewer segments.
+    n_bkps : int | None, optional
+        Fixed number of change points (binary segmentation only); used when `penalty` is None.
+    algorithm : str, optional
+        'pelt' (exact, linear expected cost) or 'binseg' (binary segmentation, O(n log n)).
+    model : str, optional
+        ruptures cost model (default 'l2': change in mean level).
+    min_duration : int, optional
+        Minimum segment length (number of points).
+    jump : int | None, optional
+        Only consider change points every `jump` points (default: `min_duration`),
+        which bounds the cost on multi-million-row histories.
+
+    Returns
+    -------
+    list of dict
+        Same keys as `find_step_changes`; 'level' is the median of the segment and
+        'type' is 'change_point'.
+    """
+    import ruptures as rpt  # listed in requirements.txt; only needed for this backend
+
+    segments = []
+    if len(data) == 0:
+        return segments
+    if penalty is None and n_bkps is None:
+        raise ValueError("Either penalty or n_bkps is required")
+
+    signal = data.to_numpy(dtype=np.float64).reshape(-1, 1)
+    params = {'model': model, 'min_size': min_duration, 'jump': jump or min_duration}
+    if algorithm == 'pelt':
+        if penalty is None:
+            raise ValueError("PELT needs a penalty")
+        breakpoints = rpt.Pelt(**params).fit(signal).predict(pen=penalty)
+    elif algorithm == 'binseg':
+        algo = rpt.Binseg(**params).fit(signal)
+        breakpoints = algo.predict(pen=penalty) if penalty is not None else algo.predict(n_bkps=n_bkps)
+    else:
+        raise ValueError(f"Unknown algorithm: {algorithm}")
+
+    start = 0
+    for end in breakpoints:  # ruptures returns exclusive ends, the last one == len(data)
+        segments.append(_make_segment(data, start, end - 1, float(np.median(signal[start:end])), 'change_point'))
+        start = end
+
+    return segments
+
+
+def segment_motor_history(df: pd.DataFrame, column: str = 'Load_Total_Power_Consumption',
+                          backend: str = 'scan', **kwargs) -> list[dict]:
+    """
+    Segment a motor's full decomposed history in one call.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Decomposed motor data with 'collect_time' and `column`.
+    column : str, optional
+        Series to segment.
+    backend : str, optional
+        'scan' -> `find_step_changes`, 'ruptures' -> `find_change_points`.
+    **kwargs
+        Passed to the backend.
+    """
+    data = df.sort_values('collect_time', kind='stable').set_index('collect_time')[column]
+    if backend == 'scan':
+        return find_step_changes(data, **kwargs)
+    if backend == 'ruptures':
+        return find_change_points(data, **kwargs)
+    raise ValueError(f"Unknown backend: {backend}")
+
+
+def merge_summary_csv(path: Path, rows: list[dict], motors: list[str],
+                      dates: list[str] | None = None, since: dict[str, pd.Timestamp] | None = None,
+                      key: str = 'date', first_keys: dict[str, str] | None = None) -> pd.DataFrame:
+    """
+    Write summary rows to `path`, replacing only the rows of the given motors (and dates, if given;
+    for a motor in `since`, only its days from since[motor].date() on).
+
+    `key` is the sort / date column ('window_start' for window summaries); `first_keys`
+    ({motor: first key}) limits the replaced rows like `since` does for days.
+
+    Rows of motors/dates that were not re-processed in this run are kept, so a partial
+    (incremental) step3 run does not drop the rest of the summary.
+    """
+    df_new = pd.DataFrame(rows)
+    if not df_new.empty:
+        df_new[key] = df_new[key].astype(str)
+    if path.exists():
+        # round_trip: kept rows are written back bit-identical (the default parser may be off by an ulp)
+        df_old = pd.read_csv(path, float_precision='round_trip')
+        replaced = df_old['motor'].isin(motors)
+        if dates is not None:
+            replaced &= df_old[key].astype(str).isin([str(d) for d in dates])
+        if since:
+            first_keys = {motor: str(pd.Timestamp(t).date()) for motor, t in since.items()}
+        if first_keys:
+            first_key = df_old['motor'].map(first_keys)
+            replaced &= first_key.isna() | (df_old[key].astype(str) >= first_key.fillna(''))
+        df_old = df_old[~replaced]
+        df_new = pd.concat([df_old, df_new], ignore_index=True)
+    if not df_new.empty:
+        df_new = df_new.sort_values(['motor', key], kind='stable').reset_index(drop=True)
+    df_new.to_csv(path, index=False)
+    return df_new
+
+
+def write_window_summaries(window_dir: Path, windows: dict, window_info: dict, motors: list[str],
+                           since: dict[str, pd.Timestamp] | None = None):
+    """Merge the rows of every extra resolution into missing_{name}_summary.csv / saved_{name}_summary.csv."""
+    window_dir.mkdir(parents=True, exist_ok=True)
+    for name, spec in windows.items():
+        info = window_info.get(name, {'missing': [], 'saved': []})
+        # Append mode: the windows from the one containing the first new row on are replaced
+        first_keys = {motor: window_key(window_floor(t, spec)) for motor, t in (since or {}).items()}
+        for kind in ('missing', 'saved'):
+            path = window_dir / f"{kind}_{name}_summary.csv"
+            if info[kind] or path.exists():
+                merge_summary_csv(path, info[kind], motors, key='window_start', first_keys=first_keys)
+        print(f"Window summaries saved: {window_dir} ({name}: {len(info['saved'])} saved, {len(info['missing'])} missing)")
+
+
+def run_step3(input_dir: Path, output_dir: Path, include_power: bool = False,
+              parquet_files: list[Path] | None = None, plot_mode: str = 'inline',
+              plot_workers: int = 1, dpi: int = DEFAULT_DPI, chunk_layout: str = 'files',
+              intermediate: str = 'parquet', since: dict[str, pd.Timestamp] | None = None,
+              windows: dict | None = None, workers: int = 1, cache_dir: Path | None = None,
+              cache_max_bytes: int = DEFAULT_MAX_BYTES) -> Path:
+    """
+    Split every decomposed motor parquet file into valid 24h chunks and write the summaries.
+
+    Parameters
+    ----------
+    input_dir : Path
+        Directory containing the per-motor decomposed parquet files.
+    output_dir : Path
+        Output directory for chunks, plots and the summary csv files.
+    include_power : bool, optional
+        Integrate 'Load_Active_Power' instead of using 'Load_Total_Power_Consumption'.
+    parquet_files : list[Path] | None, optional
+        Only process these motor files (default: every parquet file in `input_dir`).
+        Summary rows of the other motors already in `output_dir` are kept.
+    plot_mode : str, optional
+        'inline' (render while splitting), 'deferred' (write chunks and summaries first, then
+        render every plot in `plot_workers` processes) or 'none' (no plots).
+    plot_workers : int, optional
+        Worker processes for deferred rendering.
+    dpi : int, optional
+        Plot resolution (default 600).
+    chunk_layout : str, optional
+        'files' (one parquet file per motor-day) or 'store' (one parquet file per motor,
+        one row group per day, see chunk_store.py).
+    intermediate : str, optional
+        'parquet' (archival files only) or 'ipc' (also uncompressed Arrow IPC sidecars of the chunks,
+        memory-mapped by step3_2; see arrow_ipc.py). Step2 sidecars of the inputs are used either way.
+    since : dict[str, pd.Timestamp] | None, optional
+        Append mode: {motor name (e.g. 'TORAY_P1730A'): first new timestamp} from
+        `step2_data_decomposed.append_decomposed`. Only the days from that date on are re-written
+        and replaced in the summaries; motors not in `since` are processed whole.
+    windows : dict | None, optional
+        Extra resolutions {name: spec} (e.g. `window_engine.DEFAULT_WINDOWS`) summarized from the
+        same series into windows/missing_{name}_summary.csv and windows/saved_{name}_summary.csv.
+        Only the 24h days are chunked.
+    workers : int, optional
+        Worker processes for the motors (default 1). Motors are independent, so with workers > 1
+        each file is processed in its own worker (headless plot backend per worker); the rows,
+        plot specs and metrics come back to this process in file order, so the summaries are
+        the same as a serial run.
+    cache_dir : Path | None, optional
+        Frame cache directory (frame_cache.py): parsed, rounded and sorted motor frames are reused
+        across runs while their file is unchanged. Evicted (LRU) down to `cache_max_bytes` after the run.
+    cache_max_bytes : int, optional
+        Size bound of the frame cache (default 4 GiB).
+
+    Returns
+    -------
+    Path
+        `output_dir`, which holds missing_24h_summary.csv and saved_24h_summary.csv.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if parquet_files is None:
+        parquet_files = sorted(Path(input_dir).glob("*.parquet"))
+
+    full_hours = set(range(24))
+
+    all_missing_info = []
+    all_saved_info = []
+    if plot_mode not in PLOT_MODES:
+        raise ValueError(f"Unknown plot_mode: {plot_mode} (expected one of {PLOT_MODES})")
+    plot_specs = None if plot_mode == 'inline' else []
+
+    since = since or {}
+    window_info = {}
+    if workers > 1 and len(parquet_files) > 1:
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(parquet_files)), initializer=init_plot_worker)
+        results = executor.map(process_file_task, parquet_files, repeat(output_dir), repeat(full_hours),
+                               repeat(include_power), repeat(plot_mode), repeat(dpi), repeat(chunk_layout),
+                               repeat(intermediate), [since.get(get_motor_name(f.stem)) for f in parquet_files],
+                               repeat(windows), repeat(cache_dir))
+        try:
+            # map() yields in submission order, so the merged summaries do not depend on the worker timing
+            for result in results:
+                all_missing_info.extend(result['missing_info'])
+                all_saved_info.extend(result['saved_info'])
+                if plot_specs is not None:
+                    plot_specs.extend(result['plot_specs'])
+                for name, info in result['window_info'].items():
+                    merged = window_info.setdefault(name, {'missing': [], 'saved': []})
+                    merged['missing'].extend(info['missing'])
+                    merged['saved'].extend(info['saved'])
+                emit_records(result['records'])
+        finally:
+            executor.shutdown()
+    else:
+        for pq_file in parquet_files:
+            missing_info, saved_info = process_file(pq_file, output_dir, full_hours, include_power, plot_specs, dpi,
+                                                    chunk_layout, intermediate, since.get(get_motor_name(pq_file.stem)),
+                                                    windows, window_info, cache_dir)
+            all_missing_info.extend(missing_info)
+            all_saved_info.extend(saved_info)
+
+    if cache_dir is not None:
+        evict(cache_dir, cache_max_bytes)
+
+    motors = [get_motor_name(f.stem) for f in parquet_files]
+
+    if all_missing_info or (output_dir / "missing_24h_summary.csv").exists():
+        merge_summary_csv(output_dir / "missing_24h_summary.csv", all_missing_info, motors, since=since)
+        print(f"❗ Missing summary saved: {output_dir / 'missing_24h_summary.csv'}")
+
+    if all_saved_info or (output_dir / "saved_24h_summary.csv").exists():
+        merge_summary_csv(output_dir / "saved_24h_summary.csv", all_saved_info, motors, since=since)
+        print(f"Saved summary saved: {output_dir / 'saved_24h_summary.csv'}")
+
+    if windows:
+        write_window_summaries(output_dir / "windows", windows, window_info, motors, since)
+
+    if plot_mode == 'deferred':
+        with stage('plot', workers=plot_workers) as m:
+            rendered = render_plots(plot_specs, workers=plot_workers)
+            m['files'] = len(rendered)
+        print(f"Plots rendered: {len(rendered)}")
+
+    return output_dir
+
+
+def run_step3_from_dataset(dataset_dir: Path, output_dir: Path, include_power: bool = False,
+                           motors: list[str] | None = None, dates: list[str] | None = None,
+                           plot_mode: str = 'inline', plot_workers: int = 1, dpi: int = DEFAULT_DPI,
+                           chunk_layout: str = 'files', intermediate: str = 'parquet') -> Path:
+    """
+    Same as `run_step3`, but reads motors from the hive-partitioned dataset written by step2.
+
+    Only the partitions of the requested motors (and days) are opened.
+
+    Parameters
+    ----------
+    dataset_dir : Path
+        Root of the partitioned dataset (site=/line=/motor=/date=).
+    output_dir : Path
+        Output directory for chunks, plots and the summary csv files.
+    include_power : bool, optional
+        Integrate 'Load_Active_Power' instead of using 'Load_Total_Power_Consumption'.
+    motors : list[str] | None, optional
+        Motor names without site prefix (e.g. ["P1730A"]); default: every motor in the dataset.
+    dates : list[str] | None, optional
+        'YYYY-MM-DD' days to process; default: every day.
+    plot_mode, plot_workers, dpi, chunk_layout, intermediate
+        See `run_step3`.
+
+    Returns
+    -------
+    Path
+        `output_dir`, which holds missing_24h_summary.csv and saved_24h_summary.csv.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    partitions = list_partitions(dataset_dir)
+    if motors is not None:
+        partitions = partitions[partitions['motor'].isin(motors)]
+
+    full_hours = set(range(24))
+
+    if plot_mode not in PLOT_MODES:
+        raise ValueError(f"Unknown plot_mode: {plot_mode} (expected one of {PLOT_MODES})")
+    plot_specs = None if plot_mode == 'inline' else []
+
+    all_missing_info = []
+    all_saved_info = []
+    processed_motors = []
+    for (site, motor), _ in partitions.groupby(['site', 'motor'], sort=True):
+        motor_name = f"{site}_{motor}"
+        print(f"Processing motor: {motor_name}")
+        with stage('read', motor=motor_name) as m:
+            df = read_motor_data(dataset_dir, motor, dates=dates)
+            m['rows_out'] = len(df)
+        missing_info, saved_info = process_motor_frame(df, motor_name, output_dir, full_hours, include_power,
+                                                       plot_specs, dpi, chunk_layout=chunk_layout,
+                                                       intermediate=intermediate)
+        all_missing_info.extend(missing_info)
+        all_saved_info.extend(saved_info)
+        processed_motors.append(motor_name)
+
+    if all_missing_info or (output_dir / "missing_24h_summary.csv").exists():
+        merge_summary_csv(output_dir / "missing_24h_summary.csv", all_missing_info, processed_motors, dates)
+        print(f"❗ Missing summary saved: {output_dir / 'missing_24h_summary.csv'}")
+
+    if all_saved_info or (output_dir / "saved_24h_summary.csv").exists():
+        merge_summary_csv(output_dir / "saved_24h_summary.csv", all_saved_info, processed_motors, dates)
+        print(f"Saved summary saved: {output_dir / 'saved_24h_summary.csv'}")
+
+    if plot_mode == 'deferred':
+        with stage('plot', workers=plot_workers) as m:
+            rendered = render_plots(plot_specs, workers=plot_workers)
+            m['files'] = len(rendered)
+        print(f"Plots rendered: {len(rendered)}")
+
+    return output_dir
+
+
 def main():
     start_time = time.time()
     run_timestamp = time.ctime(start_time).replace(' ', '_').replace(':', '-')
@@ -252,24 +818,25 @@ def main():
         parquet_files = target_files
         print(parquet_files)
 
-    full_hours = set(range(24))
-
-    all_missing_info = []
-    all_saved_info = []
-    for pq_file in parquet_files:
-        missing_info, saved_info = process_file(pq_file, output_dir, full_hours, include_power)
-        all_missing_info.extend(missing_info)
-        all_saved_info.extend(saved_info)
-
-    if all_missing_info:
-        df_missing = pd.DataFrame(all_missing_info)
-        df_missing.to_csv(output_dir / "missing_24h_summary.csv", index=False)
-        print(f"❗ Missing summary saved: {output_dir / 'missing_24h_summary.csv'}")
-
-    if all_saved_info:
-        df_saved = pd.DataFrame(all_saved_info)
-        df_saved.to_csv(output_dir / "saved_24h_summary.csv", index=False)
-        print(f"Saved summary saved: {output_dir / 'saved_24h_summary.csv'}")
+    # Plots: 'inline', 'deferred' (numeric outputs first, then parallel rendering) or 'none'
+    plot_mode = 'deferred'
+    plot_workers = os.cpu_count() or 1
+    dpi = 600
+    # Chunks: 'files' (one parquet per motor-day) or 'store' (one parquet per motor, row group per day)
+    chunk_layout = 'store'
+    # 'ipc': also write memory-mappable Arrow IPC sidecars of the chunks for step3_2
+    intermediate = 'ipc'
+    # Extra summary resolutions (1h, 8h shifts, 7d) next to the 24h chunks; None to skip
+    windows = {name: spec for name, spec in DEFAULT_WINDOWS.items() if name != '24h'}
+
+    # Motors in parallel, one worker process per motor file
+    workers = os.cpu_count() or 1
+    # Parsed / sorted motor frames reused across runs (None to disable)
+    cache_dir = Path.cwd().parents[1] / "data" / "cache" / "frames"
+
+    run_step3(input_dir, output_dir, include_power=include_power, parquet_files=parquet_files,
+              plot_mode=plot_mode, plot_workers=plot_workers, dpi=dpi, chunk_layout=chunk_layout,
+              intermediate=intermediate, windows=windows, workers=workers, cache_dir=cache_dir)
 
     elapsed = time.time() - start_time
     print(f"Total runtime: {elapsed:.2f} seconds ({elapsed / 60:.2f} minutes)")
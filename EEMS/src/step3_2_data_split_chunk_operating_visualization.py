@@ -1,27 +1,54 @@
+import os
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from pathlib import Path
 import time
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 
-plt.rcParams['font.family'] = 'Times New Roman'
+from plot_render import PLOT_MODES, DEFAULT_DPI, render_spec, render_plots, init_plot_worker
+from chunk_store import STORE_NAME, has_chunk_store, read_chunk_index, read_chunk_days, store_paths
+from arrow_ipc import read_intermediate
 
 
-def process_chunk_file(file: Path, motor_name: str, save_figure_dir: Path) -> dict:
+def process_chunk_file(file: Path, motor_name: str, save_figure_dir: Path,
+                       plot_specs: list | None = None, dpi: int = DEFAULT_DPI, save_plots: bool = False) -> dict:
+    """Load one 24h parquet file (or its fresh IPC sidecar) and process it with `process_chunk_frame`."""
+    df = read_intermediate(file)
+    return process_chunk_frame(df, file, motor_name, save_figure_dir, plot_specs, dpi, save_plots=save_plots)
+
+
+def process_chunk_frame(df: pd.DataFrame, file: Path, motor_name: str, save_figure_dir: Path,
+                        plot_specs: list | None = None, dpi: int = DEFAULT_DPI,
+                        row_group: int | None = None, save_plots: bool = False) -> dict:
     """
-    Process the 24-hour parquet file:
+    Process the 24-hour chunk:
     - Detect operating segment
     - Visualize operating range
     - Compute power consumption differences (total segment vs. operating segment)
 
+    With `save_plots`, the plot is rendered right away, unless `plot_specs` is a list: then its
+    spec is appended for a later `render_plots` call. By default no plot is drawn, as in the
+    original script (its savefig was commented out): a 600-dpi png per chunk is opt-in.
+
     Parameters
     ----------
+    df : pd.DataFrame
+        Rows of the 24h chunk.
     file : Path
-        The Path to the 24h parquet file.
+        The Path to the 24h parquet file (or the motor's chunk store).
     motor_name : str
         Motor name (used for plot directory structure and title)
     save_figure_dir : Path
         Base directory where figures are saved.
+    plot_specs : list | None, optional
+        Collects the plot spec instead of rendering (deferred / no-plot modes).
+    dpi : int, optional
+        Plot resolution (default 600).
+    row_group : int | None, optional
+        Row group of `file` holding the chunk, when `file` is a chunk store.
+    save_plots : bool, optional
+        Draw and save the operating plot (default False).
 
     Returns
     -------
@@ -30,7 +57,7 @@ def process_chunk_file(file: Path, motor_name: str, save_figure_dir: Path) -> di
         - file : Path
             Input parquet file path.
         - plot_path : Path
-            Saved plot file path.
+            Plot file path (only written with `save_plots`).
         - total_diff : float
             Total power difference across the 24h period (Wh).
         - total_diff_rate : float
@@ -43,19 +70,13 @@ def process_chunk_file(file: Path, motor_name: str, save_figure_dir: Path) -> di
 
     # === Prepare plot directory ===
     plot_dir = save_figure_dir / motor_name / "24h" / "well plots"
-    plot_dir.mkdir(parents=True, exist_ok=True)
+    if save_plots:
+        plot_dir.mkdir(parents=True, exist_ok=True)
 
-    # === Load data and compute delta ===
-    df = pd.read_parquet(file)
+    # === Compute delta ===
     df['delta_power'] = df['Load_Total_Power_Consumption'].diff()
 
-    # === Visualization & Calculation ===
-    fig, ax = plt.subplots(figsize=(15, 8))
-
-    # Normalize power values (shift minimum to zero for better visualization)
-    shifted_power = df["Load_Total_Power_Consumption"] - df["Load_Total_Power_Consumption"].min()
-    ax.scatter(df["collect_time"], shifted_power, s=1, label='Shifted Power')
-
+    # === Calculation ===
     # Compute total difference and divide by 24 hours
     total_diff = df['Load_Total_Power_Consumption'].iloc[-2] - df['Load_Total_Power_Consumption'].iloc[0]
     total_diff_rate = total_diff / 24  # Wh/h
@@ -65,11 +86,10 @@ def process_chunk_file(file: Path, motor_name: str, save_figure_dir: Path) -> di
     end_dt = df['collect_time'].iloc[-2]
     fname = f"{start_dt.strftime('%Y-%m-%d_%H%M%S')}_to_{end_dt.strftime('%Y-%m-%d_%H%M%S')}"
 
-    ax.set_title(f"{motor_name} | {fname}", fontsize=14)
-
     # === Detect operating segment (where delta > 1) ===
     highlight = df[df['delta_power'] > 1].index
     operating_diff, operating_diff_rate = None, None
+    text_lines = []
     if not highlight.empty:
         # Identify fisrt and last index of operating segment
         start_idx, end_idx = highlight[0], highlight[-1]
@@ -81,16 +101,7 @@ def process_chunk_file(file: Path, motor_name: str, save_figure_dir: Path) -> di
         operating_diff = df.loc[end_idx, 'Load_Total_Power_Consumption'] - df.loc[start_idx, 'Load_Total_Power_Consumption']
         operating_diff_rate = operating_diff / operating_duration if operating_duration > 0 else np.nan
 
-        # Highlight operating segment data points in orange
-        ax.scatter(
-            df["collect_time"].iloc[highlight],
-            shifted_power.iloc[highlight],
-            color='orange',
-            s=4,
-            label='Significant Rise'
-        )
-
-        # Display summary text box on the plot
+        # Summary text box on the plot
         text_lines = [
             f"Total period: {start_dt.strftime('%Y-%m-%d %H:%M:%S')} -> {end_dt.strftime('%Y-%m-%d %H:%M:%S')}",
             f"Total diff (24h): {total_diff:.2f} Wh",
@@ -101,34 +112,22 @@ def process_chunk_file(file: Path, motor_name: str, save_figure_dir: Path) -> di
             f"Operating diff rate: {operating_diff_rate:.2f} Wh/h"
         ]
 
-        text_x = df["collect_time"].iloc[int(len(df) * 0.01)]
-        text_y = shifted_power.min() + 0.05 * shifted_power.max()
-
-        ax.text(
-            text_x,
-            text_y,
-            "\n".join(text_lines),
-            fontsize=11,
-            va='bottom',
-            ha='left',
-            bbox=dict(facecolor='white', edgecolor='gray', alpha=0.85)
-        )
-
-    # === Finalize and save figure ===
-    ax.set_xlabel("Time", fontsize=12)
-    ax.set_ylabel("Load_Total_Power_Consumption (shifted)", fontsize=12)
-    ax.tick_params(axis='both', labelsize=10)
-    ax.grid(True)
-    ax.legend(fontsize=10)
-
-    plt.subplots_adjust(bottom=0.15)
-    plt.tight_layout()
-
+    # === Visualization (operating segment data points in orange) ===
     plot_fname = f"{fname}.png"
-    #fig.savefig(plot_dir / plot_fname, dpi=600)
-    plt.close(fig)
-
-    print(f"Plot saved: {plot_dir / plot_fname}")
+    spec = {
+        'kind': 'operating',
+        'source': file,
+        **({'row_group': row_group} if row_group is not None else {}),
+        'out_path': plot_dir / plot_fname,
+        'dpi': dpi,
+        'title': f"{motor_name} | {fname}",
+        'text_lines': text_lines,
+    }
+    if save_plots and plot_specs is None:
+        render_spec(spec, data=df)
+        print(f"Plot saved: {plot_dir / plot_fname}")
+    elif save_plots:
+        plot_specs.append(spec)
 
     # Return dictionary with results
     return {
@@ -141,18 +140,62 @@ def process_chunk_file(file: Path, motor_name: str, save_figure_dir: Path) -> di
     }
 
 
-def process_motor_dir(motor_dir: Path, save_figure_dir: Path):
+def process_motor_dir(motor_dir: Path, save_figure_dir: Path, plot_specs: list | None = None,
+                      dpi: int = DEFAULT_DPI, save_plots: bool = False) -> list[dict]:
     """
-    Process all 24h chunk files for a given motor.
+    Process all 24h chunks for a given motor and return their result dictionaries.
+
+    A chunk store (one parquet file per motor, row group per day) is read with a single open;
+    otherwise every per-day parquet file under '24h' is read. Fresh Arrow IPC sidecars written by
+    step3_1 (`intermediate='ipc'`) are memory-mapped instead of decoding the parquet files.
+    Operating plots are only drawn with `save_plots` (see `process_chunk_frame`).
     """
+    if has_chunk_store(motor_dir):
+        store_path, _ = store_paths(motor_dir)
+        index = read_chunk_index(motor_dir)
+        days = read_chunk_days(motor_dir)
+        print(f"Processing motor: {motor_dir.name} -> {len(days)} days ({store_path.name})")
+        return [process_chunk_frame(df, store_path, motor_dir.name, save_figure_dir, plot_specs, dpi,
+                                    row_group=index[date]['row_group'], save_plots=save_plots)
+                for date, df in days.items()]
+
     # Locate all parquet files under '24h' directory
     chunk_dir = motor_dir / "24h"
-    chunk_files = sorted(chunk_dir.rglob("*.parquet"))
+    chunk_files = sorted(f for f in chunk_dir.rglob("*.parquet") if f.name != STORE_NAME)
     print(f"Processing motor: {motor_dir.name} -> {len(chunk_files)} files")
 
     # Process each chunk file
-    for file in chunk_files:
-        process_chunk_file(file, motor_dir.name, save_figure_dir)
+    return [process_chunk_file(file, motor_dir.name, save_figure_dir, plot_specs, dpi, save_plots)
+            for file in chunk_files]
+
+
+def process_motor_dir_task(motor_dir: Path, save_figure_dir: Path, plot_mode: str, dpi: int,
+                           save_plots: bool = False) -> tuple[list, list]:
+    """`process_motor_dir` in a pool worker: returns its results and plot specs (deferred mode)."""
+    plot_specs = None if plot_mode == 'inline' else []
+    results = process_motor_dir(motor_dir, save_figure_dir, plot_specs, dpi, save_plots)
+    return results, plot_specs or []
+
+
+def process_motor_dirs(motor_dirs: list[Path], save_figure_dir: Path, plot_specs: list | None = None,
+                       dpi: int = DEFAULT_DPI, workers: int = 1, save_plots: bool = False) -> list[list[dict]]:
+    """
+    `process_motor_dir` for every motor, each in its own worker process when workers > 1
+    (headless plot backend per worker). Results (and deferred plot specs, appended to `plot_specs`)
+    come back in `motor_dirs` order. Operating plots are only drawn with `save_plots`.
+    """
+    if workers <= 1 or len(motor_dirs) <= 1:
+        return [process_motor_dir(motor_dir, save_figure_dir, plot_specs, dpi, save_plots) for motor_dir in motor_dirs]
+
+    plot_mode = 'inline' if plot_specs is None else 'deferred'
+    all_results = []
+    with ProcessPoolExecutor(max_workers=min(workers, len(motor_dirs)), initializer=init_plot_worker) as executor:
+        for results, specs in executor.map(process_motor_dir_task, motor_dirs, repeat(save_figure_dir),
+                                            repeat(plot_mode), repeat(dpi), repeat(save_plots)):
+            all_results.append(results)
+            if plot_specs is not None:
+                plot_specs.extend(specs)
+    return all_results
 
 
 def main():
@@ -173,10 +216,26 @@ def main():
     motor_dirs = sorted([p for p in base_dir.iterdir() if p.is_dir()])
     #motor_dirs = motor_dirs[:1]  # For testing: process only first motor
 
+    # Operating plots were not saved originally (savefig commented out); True writes a png per chunk
+    save_plots = False
+    # Plots: 'inline', 'deferred' (numbers first, then parallel rendering) or 'none'
+    plot_mode = 'deferred'
+    plot_workers = os.cpu_count() or 1
+    dpi = 600
+    # Motors in parallel, one worker process per motor directory
+    workers = os.cpu_count() or 1
+    if plot_mode not in PLOT_MODES:
+        raise ValueError(f"Unknown plot_mode: {plot_mode} (expected one of {PLOT_MODES})")
+    plot_specs = None if plot_mode == 'inline' else []
+
     # Process each motor directory
     start_time = time.time()
-    for motor_dir in motor_dirs:
-        process_motor_dir(motor_dir, save_figure_dir)
+    process_motor_dirs(motor_dirs, save_figure_dir, plot_specs, dpi, workers=workers, save_plots=save_plots)
+    print(f"Numeric results ready: {time.time() - start_time:.2f} seconds")
+
+    if plot_mode == 'deferred':
+        rendered = render_plots(plot_specs, workers=plot_workers)
+        print(f"Plots saved: {len(rendered)}")
 
     # Print runtime summary
     elapsed = time.time() - start_time
@@ -2,17 +2,175 @@ import numpy as np
 import pandas as pd
 from pathlib import Path
 from itertools import combinations
-from sklearn.preprocessing import MinMaxScaler
+
+from partitioned_dataset import read_motor_data
+from chunk_store import read_chunk_days
+from pair_distance import pairwise_l1_scores, minmax_scale
+from score_store import load_score_store, save_score_store, update_score_store, store_results, empty_scores
+from stage_metrics import stage
 
 # pd.set_option('display.max_rows', None)
 
-def select_max_diffrate_date(df: pd.DataFrame, motor1_name: str, motor2_name: str, base_dir: Path) -> pd.DataFrame:
+# Per-day metrics compared between the two motors of a pair
+METRICS = ['diff', 'diff_rate']
+
+# Configured A/B motor pairs (motor names without the site prefix)
+MOTOR_PAIRS = [('P1730A', 'P1730B'), ('P7412A_EXT', 'P7412B_EXT'), ('P7412A_MCC', 'P7412B_MCC')]
+
+
+def pivot_summary(save_df: pd.DataFrame, metrics: list[str] = METRICS) -> dict:
     """
-    Select and analyze daily motor data:
-    - Select dates where both given motors (motor1_name, motor2_name) exist
-    - Normalize diff and diff_rate using MinMax scaling
-    - Compute scores for each pairwise date combination
-    - Return results save to file
+    Pivot the saved summary once into a (date x motor x metric) array.
+
+    Parameters
+    ----------
+    save_df : pd.DataFrame
+        Summary rows with the columns 'date', 'motor' and `metrics` (one row per motor and day).
+    metrics : list[str], optional
+        Metric columns (default ['diff', 'diff_rate']).
+
+    Returns
+    -------
+    dict
+        - 'dates'   : np.ndarray of sorted date strings
+        - 'motors'  : list of sorted motor names (e.g. 'TORAY_P1730A')
+        - 'metrics' : list of metric names
+        - 'values'  : np.ndarray (n_dates, n_motors, n_metrics), NaN where a motor has no row
+        - 'present' : np.ndarray (n_dates, n_motors) bool, True where a motor has a row for the day
+    """
+    date_codes, dates = pd.factorize(save_df['date'].astype(str), sort=True)
+    motor_codes, motors = pd.factorize(save_df['motor'], sort=True)
+
+    values = np.full((len(dates), len(motors), len(metrics)), np.nan)
+    values[date_codes, motor_codes] = save_df[metrics].to_numpy(dtype=np.float64)
+    present = np.zeros((len(dates), len(motors)), dtype=bool)
+    present[date_codes, motor_codes] = True
+
+    return {'dates': np.asarray(dates), 'motors': list(motors), 'metrics': list(metrics),
+            'values': values, 'present': present}
+
+
+def pair_rows(cube: dict, motor1_name: str, motor2_name: str, site: str = "TORAY") -> tuple[np.ndarray, np.ndarray]:
+    """
+    (dates, unscaled metric rows) of the dates where both motors exist;
+    columns: motor1 metrics, then motor2 metrics. No common date gives (0, 2 * n_metrics) rows.
+    Raises KeyError if a motor is not in the summary.
+    """
+    missing = [name for name in (motor1_name, motor2_name) if f'{site}_{name}' not in cube['motors']]
+    if missing:
+        raise KeyError(f"Motors not in the saved summary: {missing}")
+    cols = [cube['motors'].index(f'{site}_{name}') for name in (motor1_name, motor2_name)]
+    both = cube['present'][:, cols].all(axis=1)
+    return cube['dates'][both], cube['values'][both][:, cols, :].reshape(int(both.sum()), 2 * len(cube['metrics']))
+
+
+def score_motor_pair(cube: dict, motor1_name: str, motor2_name: str, top_k: int | None = None,
+                     site: str = "TORAY") -> pd.DataFrame:
+    """
+    Score the date pairs of one motor pair from a `pivot_summary` cube:
+    - Select dates where both motors exist
+    - Normalize their metrics using MinMax scaling
+    - Score every date pair by the L1 distance of its scaled rows (`pairwise_l1_scores`)
+
+    Returns
+    -------
+    pd.DataFrame
+        A DataFrame with the columns ['date_compare', 'score'] (every date pair in combinations
+        order, or the `top_k` best pairs sorted by score); empty if the motors share no date
+    """
+    dates, combined = pair_rows(cube, motor1_name, motor2_name, site)
+    if not len(dates):
+        return empty_scores()
+    scaled = minmax_scale(combined)
+
+    i, j, score = pairwise_l1_scores(scaled, top_k=top_k)
+    combi_final_df = pd.DataFrame({
+        'date_compare': pd.Series(dates[i], dtype=object) + ' - ' + pd.Series(dates[j], dtype=object),
+        'score': score,
+    })
+
+    if not combi_final_df.empty:
+        print(f'BEST max_diffrate_date {motor1_name}, {motor2_name} score idx: ', combi_final_df.loc[np.argmax(combi_final_df['score'])])
+
+    return combi_final_df
+
+
+def all_motor_pairs(cube: dict, site: str = "TORAY") -> list[tuple[str, str]]:
+    """Every pair of motors in a `pivot_summary` cube (names without the site prefix)."""
+    names = [motor.removeprefix(f'{site}_') for motor in cube['motors']]
+    return list(combinations(names, 2))
+
+
+def score_motor_pair_incremental(cube: dict, motor1_name: str, motor2_name: str, store_dir: Path,
+                                 top_k: int | None = None, site: str = "TORAY") -> pd.DataFrame:
+    """
+    Same result as `score_motor_pair`, but through the pair's persistent score store
+    ({store_dir}/scores_{motor1}_{motor2}.npz): only dates added since the last run are scored,
+    unless they move a MinMax bound (see score_store.py). Only top_k=1 costs O(n) per new date;
+    top_k=None / k > 1 still rescores every stored date pair (`store_results`), O(n^2).
+    """
+    dates, combined = pair_rows(cube, motor1_name, motor2_name, site)
+    store_path = Path(store_dir) / f'scores_{motor1_name}_{motor2_name}.npz'
+
+    store = load_score_store(store_path, combined.shape[1])
+    stats = update_score_store(store, dates, combined)
+    save_score_store(store, store_path)
+    print(f'Score store {motor1_name}, {motor2_name}: {stats}')
+
+    combi_final_df = store_results(store, top_k=top_k)
+    if not combi_final_df.empty:
+        print(f'BEST max_diffrate_date {motor1_name}, {motor2_name} score idx: ', combi_final_df.loc[np.argmax(combi_final_df['score'])])
+
+    return combi_final_df
+
+
+def compare_motor_pairs(save_df: pd.DataFrame, motor_pairs: list[tuple[str, str]] | str | None = None,
+                        top_k: int | None = None, store_dir: Path | None = None) -> dict[tuple[str, str], pd.DataFrame]:
+    """
+    Pivot the summary once and score every motor pair from the same array.
+
+    Parameters
+    ----------
+    save_df : pd.DataFrame
+        Summary rows ('date', 'motor', 'diff', 'diff_rate').
+    motor_pairs : list[tuple[str, str]] | str | None, optional
+        Pairs to compare (default `MOTOR_PAIRS`), or 'all' for every pair of motors in the summary.
+    top_k : int | None, optional
+        See `score_motor_pair`.
+    store_dir : Path | None, optional
+        Keep a persistent score store per pair here and only score new dates
+        (`score_motor_pair_incremental`); default: score from scratch.
+
+    Returns
+    -------
+    dict[tuple[str, str], pd.DataFrame]
+        {(motor1, motor2): ['date_compare', 'score'] result}; pairs with a motor missing from
+        the summary are skipped (and reported)
+    """
+    cube = pivot_summary(save_df)
+    if motor_pairs is None:
+        motor_pairs = MOTOR_PAIRS
+    elif motor_pairs == 'all':
+        motor_pairs = all_motor_pairs(cube)
+    results = {}
+    for m1, m2 in motor_pairs:
+        missing = [name for name in (m1, m2) if f'TORAY_{name}' not in cube['motors']]
+        if missing:
+            print(f'Skip motor pair {m1}, {m2}: {missing} not in the saved summary')
+            continue
+        with stage('score', pair=f'{m1}-{m2}') as m:
+            if store_dir is not None:
+                results[(m1, m2)] = score_motor_pair_incremental(cube, m1, m2, store_dir, top_k=top_k)
+            else:
+                results[(m1, m2)] = score_motor_pair(cube, m1, m2, top_k=top_k)
+            m['rows_out'] = len(results[(m1, m2)])
+    return results
+
+
+def select_max_diffrate_date(df: pd.DataFrame, motor1_name: str, motor2_name: str, base_dir: Path,
+                             top_k: int | None = None) -> pd.DataFrame:
+    """
+    Select and analyze daily motor data of one motor pair (see `score_motor_pair`).
 
     Parameters
     ----------
@@ -22,82 +180,110 @@ def select_max_diffrate_date(df: pd.DataFrame, motor1_name: str, motor2_name: st
         Example: 'P1730A', 'P7412A_EXT'
     motor2_name : str
         Example: 'P1730B', 'P7412B_EXT'
+    top_k : int | None, optional
+        Return only the k most different date pairs, sorted by score (default: every pair,
+        in combinations order). Scores are computed in blocks (`pairwise_l1_scores`), so
+        tens of thousands of dates fit in memory with `top_k`.
 
     Returns
     -------
     pd.DataFrame
         A DataFrame with the columns ['date_compare', 'score']
     """
-    date_box = []
-    combined_date_box = []
-    for date, group in df.groupby('date'):
-        if len(group) == 2:
-            row = {
-                'date': date,
-                f"{motor1_name}_diff" : group[group['motor'] == f'TORAY_{motor1_name}']['diff'].values[0],
-                f"{motor1_name}_diff_rate": group[group['motor'] == f'TORAY_{motor1_name}']['diff_rate'].values[0],
-                f"{motor2_name}_diff": group[group['motor'] == f'TORAY_{motor2_name}']['diff'].values[0],
-                f"{motor2_name}_diff_rate": group[group['motor'] == f'TORAY_{motor2_name}']['diff_rate'].values[0]
-            }
-            date_box.append(date)
-            combined_date_box.append(row)
-
-    combined_df = pd.DataFrame(combined_date_box).set_index('date')
-    scaled = MinMaxScaler().fit_transform(combined_df)
-    scaled_df = pd.DataFrame(scaled, columns=combined_df.columns, index=combined_df.index)
-
-    combi = list(combinations(date_box, 2))
-
-    combi_data = []
-    for c in combi:
-        rows_c = {
-                'date_compare': f'{c[0]} - {c[1]}',
-                'score': np.sum(np.abs(scaled_df.loc[c[1]] - scaled_df.loc[c[0]])),
-        }
-        combi_data.append(rows_c)
-
-    combi_final_df = pd.DataFrame(combi_data)
-
-    save_result_csv = base_dir / f'max_diff_rate_dates_{motor1_name}_{motor2_name}.csv'
-    #combi_final_df.to_csv(save_result_csv)
-
-    print(f'BEST max_diffrate_date {motor1_name}, {motor2_name} score idx: ', combi_final_df.loc[np.argmax(combi_final_df['score'])])
+    df = df[df['motor'].isin([f'TORAY_{motor1_name}', f'TORAY_{motor2_name}'])]
+    return score_motor_pair(pivot_summary(df), motor1_name, motor2_name, top_k=top_k)
 
-    return combi_final_df
 
+def load_saved_summary(path: Path) -> pd.DataFrame:
+    """
+    Read saved_24h_summary.csv and expose the 'diff'/'diff_rate' columns used by step4.
 
-def main():
+    step3_1 writes them as 'total_diff_Wh'/'diff_rate_Wh_per_h'; older summaries already use 'diff'/'diff_rate'.
+    """
+    save_df = pd.read_csv(path)
+    return save_df.rename(columns={'total_diff_Wh': 'diff', 'diff_rate_Wh_per_h': 'diff_rate'})
 
 
-    base_dir = Path.cwd().parents[0] / "src" / "preprocessing_results" / "active_power"
+def load_pair_days(dataset_dir: Path, motor1_name: str, motor2_name: str, date_compare: str) -> dict[str, pd.DataFrame]:
+    """
+    Read the raw rows of a selected date pair (e.g. '2024-06-21 - 2024-12-25') for both motors
+    from the partitioned dataset. Only those 2 days x 2 motors partitions are opened.
 
+    Returns
+    -------
+    dict[str, pd.DataFrame]
+        {motor name: rows of the two dates}
+    """
+    dates = [d.strip() for d in date_compare.split(' - ')]
+    return {name: read_motor_data(dataset_dir, name, dates=dates) for name in (motor1_name, motor2_name)}
 
-    save_df_result = [f for f in base_dir.glob("*.csv") if 'saved' in f.stem][0]
 
-    save_df = pd.read_csv(save_df_result)
-    print(save_df.head())
+def load_pair_chunks(chunk_dir: Path, motor1_name: str, motor2_name: str, date_compare: str,
+                     site: str = "TORAY") -> dict[str, pd.DataFrame]:
+    """
+    Read the saved 24h chunks of a selected date pair (e.g. '2024-06-21 - 2024-12-25') for both
+    motors from their step3_1 chunk stores: one file open and two row-group reads per motor.
 
+    Returns
+    -------
+    dict[str, pd.DataFrame]
+        {motor name: rows of the two dates}
+    """
+    dates = [d.strip() for d in date_compare.split(' - ')]
+    pair = {}
+    for name in (motor1_name, motor2_name):
+        days = read_chunk_days(Path(chunk_dir) / f"{site}_{name}", dates=dates)
+        pair[name] = pd.concat(days.values(), ignore_index=True) if days else pd.DataFrame()
+    return pair
+
+
+def run_step4(input_dir: Path, output_dir: Path,
+              motor_pairs: list[tuple[str, str]] | str | None = None, top_k: int | None = None,
+              incremental: bool = False) -> Path:
+    """
+    Compare every motor pair from `input_dir`/saved_24h_summary.csv and save one result csv per pair.
 
-    unique_motor_name = save_df['motor'].unique()
+    `motor_pairs` defaults to `MOTOR_PAIRS`; 'all' compares every pair of motors in the summary.
 
-    inner_df = pd.concat([save_df[save_df['motor'] == 'TORAY_P1730A'],
-                           save_df[save_df['motor'] == 'TORAY_P1730B']], axis=0)
+    With `top_k`, each csv holds only the k most different date pairs (sorted by score)
+    instead of every date combination. With `incremental`, each pair keeps a score store in
+    `output_dir`/score_store and only dates added since the last run are scored.
+
+    Cost per pair with `incremental`: top_k=1 is O(n) per new date (the store's running best;
+    O(n^2) only when a new date moves a MinMax bound). top_k=None or k > 1 rescales the stored
+    dates and rescores every date pair on each run, O(n^2) like a from-scratch run.
+
+    Returns
+    -------
+    Path
+        `output_dir` containing max_diff_rate_dates_{motor1}_{motor2}.csv files.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    save_df = load_saved_summary(Path(input_dir) / "saved_24h_summary.csv")
 
-    outer_df = pd.concat([save_df[save_df['motor'] == 'TORAY_P7412A_EXT'],
-                           save_df[save_df['motor'] == 'TORAY_P7412B_EXT'],
-                           save_df[save_df['motor'] == 'TORAY_P7412A_MCC'],
-                           save_df[save_df['motor'] == 'TORAY_P7412B_MCC']], axis=0)
+    store_dir = output_dir / "score_store" if incremental else None
+    results = compare_motor_pairs(save_df, motor_pairs, top_k=top_k, store_dir=store_dir)
+    for (motor1_name, motor2_name), result_df in results.items():
+        result_df.to_csv(output_dir / f'max_diff_rate_dates_{motor1_name}_{motor2_name}.csv', index=False)
 
-    outer_EXT_df = pd.concat([save_df[save_df['motor'] == 'TORAY_P7412A_EXT'],
-                           save_df[save_df['motor'] == 'TORAY_P7412B_EXT']], axis=0)
+    return output_dir
 
-    outer_MCC_df = pd.concat([save_df[save_df['motor'] == 'TORAY_P7412A_MCC'],
-                             save_df[save_df['motor'] == 'TORAY_P7412B_MCC']], axis=0)
+
+def main():
+
+
+    base_dir = Path.cwd().parents[0] / "src" / "preprocessing_results" / "active_power"
+
+
+    save_df_result = [f for f in base_dir.glob("*.csv") if 'saved' in f.stem][0]
+
+    save_df = load_saved_summary(save_df_result)
+    print(save_df.head())
 
 
-    inner_result_df = select_max_diffrate_date(inner_df, 'P1730A', 'P1730B', base_dir)
-    outer_EXT_result_df = select_max_diffrate_date(outer_EXT_df, 'P7412A_EXT', 'P7412B_EXT', base_dir)
-    outer_MCC_result_df = select_max_diffrate_date(outer_MCC_df, 'P7412A_MCC', 'P7412B_MCC', base_dir)
+    # One pivot of the summary, every configured pair scored from it (motor_pairs='all' for every pair)
+    results = compare_motor_pairs(save_df, MOTOR_PAIRS)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,102 @@
+import re
+import pandas as pd
+
+'''
+Shared 'collect_time' parsing.
+
+pd.to_datetime(..., format='mixed') guesses the format of every element separately, which is one
+of the slowest operations in the pipeline. Here the format is inferred once from a small sample,
+cached (per file via `cache_key`, and per string shape), and the whole column is parsed with that
+fixed format in one vectorized call. Only the rows that fail the fast path go to the 'mixed' parser.
+'''
+
+# Tried in order; the first one that parses the whole sample wins
+CANDIDATE_FORMATS = [
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%d %H:%M:%S',
+    'ISO8601',  # variable fraction length / optional fraction (e.g. '.223', '.223000000', none)
+    '%Y/%m/%d %H:%M:%S.%f',
+    '%Y/%m/%d %H:%M:%S',
+]
+
+SAMPLE_SIZE = 1000
+
+_FORMAT_CACHE: dict[object, str | None] = {}
+
+
+def _shape(value: str) -> str:
+    """Digits -> 'd' (e.g. '2024-06-04 20:36:43.223' -> 'dddd-dd-dd dd:dd:dd.ddd')."""
+    return re.sub(r'\d', 'd', value)
+
+
+def infer_timestamp_format(sample: pd.Series) -> str | None:
+    """
+    Return the first candidate format that parses every value of `sample`, or None.
+
+    The result is cached by the set of string shapes in the sample, so files with the same
+    layout never repeat the inference.
+    """
+    sample = sample.dropna().astype(str)
+    if sample.empty:
+        return None
+
+    shapes = frozenset(_shape(v) for v in sample)
+    if shapes in _FORMAT_CACHE:
+        return _FORMAT_CACHE[shapes]
+
+    fmt = None
+    for candidate in CANDIDATE_FORMATS:
+        try:
+            pd.to_datetime(sample, format=candidate)
+        except (ValueError, TypeError):
+            continue
+        fmt = candidate
+        break
+
+    _FORMAT_CACHE[shapes] = fmt
+    return fmt
+
+
+def parse_timestamps(values: pd.Series, cache_key: object = None, errors: str = 'raise') -> pd.Series:
+    """
+    Parse a timestamp column with a cached fixed format, falling back to format='mixed' only for failures.
+
+    Parameters
+    ----------
+    values : pd.Series
+        Strings (or already parsed datetimes, which are returned unchanged).
+    cache_key : object, optional
+        Key to cache the inferred format under (e.g. the source file path).
+    errors : str, optional
+        'raise' or 'coerce', applied to the rows the slow parser cannot read either.
+
+    Returns
+    -------
+    pd.Series
+        datetime64 Series with the same index.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+
+    if cache_key is not None and cache_key in _FORMAT_CACHE:
+        fmt = _FORMAT_CACHE[cache_key]
+    else:
+        # Head and tail: exports can change layout partway through a file
+        sample = pd.concat([values.head(SAMPLE_SIZE // 2), values.tail(SAMPLE_SIZE // 2)])
+        fmt = infer_timestamp_format(sample)
+        if cache_key is not None:
+            _FORMAT_CACHE[cache_key] = fmt
+
+    if fmt is None:
+        return pd.to_datetime(values, format='mixed', errors=errors)
+
+    parsed = pd.to_datetime(values, format=fmt, errors='coerce')
+    failed = parsed.isna() & values.notna()
+    if failed.any():
+        parsed[failed] = pd.to_datetime(values[failed], format='mixed', errors=errors)
+    return parsed
+
+
+def clear_format_cache():
+    """Forget every cached format."""
+    _FORMAT_CACHE.clear()
@@ -0,0 +1,256 @@
+import numpy as np
+import pandas as pd
+
+'''
+Multi-resolution window engine: diff, diff rate and validity metrics of a motor series for any
+set of window sizes and offsets.
+
+A window is described by a small spec; the name is used in the summary file names
+(e.g. 'saved_8h_summary.csv'):
+
+    {'size': '8h', 'offset': '6h', 'slot': '1h', 'max_gap_hours': 1, 'min_energy_wh': 333.3}
+
+- windows are [origin + offset + k * size, origin + offset + (k + 1) * size), origin = Monday
+  1970-01-05 00:00, so sub-day windows divide each calendar day and '7d' windows start on Monday
+- a window is complete when every `slot` inside it has at least one row (default '1h', i.e. the
+  hours-present check of the daily table); at most 63 slots per window (int64 bitmask)
+- 'max_gap_hours' (default 1) and 'min_energy_wh' (default 1000 Wh per 24h, scaled to the size)
+  are the over-gap and low-consumption thresholds
+
+The per-row work (timestamps, values, gaps, NaN mask) is done once per series (`prepare_series`);
+each resolution is then a floor division of the timestamps and a few `reduceat` calls over the
+same arrays (`window_table`), so '1h', '8h', '24h' and '7d' all come from one pass. The '24h' spec
+gives exactly the daily table of step3_1 (`compute_daily_table`).
+'''
+
+WINDOW_ORIGIN = pd.Timestamp("1970-01-05 00:00:00")  # a Monday at midnight
+SECONDS_PER_HOUR = 3600
+MAX_SLOTS = 63
+
+DEFAULT_WINDOWS = {
+    '1h': {'size': '1h', 'slot': '15min', 'max_gap_hours': 0.25},
+    '8h': {'size': '8h', 'offset': '6h'},  # shifts 06-14, 14-22, 22-06
+    '24h': {'size': '24h'},
+    '7d': {'size': '7d', 'slot': '1d'},
+}
+
+TABLE_COLUMNS = ['window_start', 'window_end', 'start_pos', 'end_pos', 'row_count', 'slots_mask', 'missing_slots',
+                 'max_gap_hours', 'mean', 'first_value', 'last_value', 'total_diff', 'start', 'end', 'delta_t',
+                 'diff_rate', 'reasons']
+
+
+def parse_window(spec: dict) -> dict:
+    """Return the spec with Timedelta 'size' / 'offset' / 'slot' and the default thresholds filled in."""
+    size = pd.Timedelta(spec['size'])
+    offset = pd.Timedelta(spec.get('offset', 0))
+    slot = min(pd.Timedelta(spec.get('slot', '1h')), size)
+    n_slots = size // slot
+    if size <= pd.Timedelta(0) or size % slot:
+        raise ValueError(f"Window size {spec['size']} must be a positive multiple of its slot {slot}")
+    if n_slots > MAX_SLOTS:
+        raise ValueError(f"Window {spec['size']} has {n_slots} slots (at most {MAX_SLOTS}); use a larger 'slot'")
+    return {
+        'size': size,
+        'offset': offset,
+        'slot': slot,
+        'n_slots': n_slots,
+        'max_gap_hours': spec.get('max_gap_hours', 1),
+        'min_energy_wh': spec.get('min_energy_wh', 1000 * (size / pd.Timedelta('24h'))),
+    }
+
+
+def window_floor(ts: pd.Timestamp, spec: dict) -> pd.Timestamp:
+    """Start of the window (of `spec`) that contains `ts`."""
+    window = parse_window(spec)
+    origin = WINDOW_ORIGIN + window['offset']
+    return origin + ((pd.Timestamp(ts) - origin) // window['size']) * window['size']
+
+
+def prepare_series(collect_time: pd.Series, target: pd.Series, interval: pd.Series | None = None) -> dict:
+    """
+    Per-row arrays shared by every resolution: timestamps (ns), values, NaN mask, gap to the previous row (h).
+
+    'mean' (the almost-zero check) is taken over `interval` when given, e.g. the per-interval
+    consumption of a persistent cumulative counter, whose own mean is far from 0 after the first day.
+
+    Rows without a timestamp (NaT, e.g. unparseable 'collect_time' coerced by step3_1) sort last and
+    are left out, like the per-day groupby they replace; row positions of the windows are unchanged.
+    """
+    t = collect_time.to_numpy().astype('datetime64[ns]')
+    values = target.to_numpy(dtype=np.float64)
+    n_timed = int((~np.isnat(t)).sum())
+    t, values = t[:n_timed], values[:n_timed]
+    gaps = np.zeros(len(t))
+    gaps[1:] = (t[1:] - t[:-1]) / np.timedelta64(1, 's') / SECONDS_PER_HOUR
+    mean_values = values if interval is None else interval.to_numpy(dtype=np.float64)[:n_timed]
+    valid = ~np.isnan(mean_values)
+    return {'t': t, 'values': values, 'gaps': gaps, 'valid': valid, 'filled': np.where(valid, mean_values, 0.0)}
+
+
+def _slot_name(slot: pd.Timedelta) -> str:
+    """'hour' / 'day' for the usual slots (skip reason 'missing_hour'), else the slot length (e.g. '15min')."""
+    names = {pd.Timedelta('1h'): 'hour', pd.Timedelta('1d'): 'day'}
+    if slot in names:
+        return names[slot]
+    return f"{slot / pd.Timedelta('1min'):g}min"
+
+
+def window_table(series: dict, spec: dict, required_slots: set | None = None, carry_over: bool = False) -> pd.DataFrame:
+    """
+    Compute the validity/quality table of one resolution from `prepare_series` arrays.
+
+    Parameters
+    ----------
+    series : dict
+        Output of `prepare_series` (time-sorted series).
+    spec : dict
+        Window spec ('size', optional 'offset', 'slot', 'max_gap_hours', 'min_energy_wh').
+    required_slots : set | None, optional
+        Slots (0 .. n_slots - 1) that must be present for a complete window (default: all).
+    carry_over : bool, optional
+        The values are a persistent cumulative column: 'total_diff' is last value of the window -
+        last value of the previous row, so the interval crossing a window edge counts in the window
+        it ends in, and so does its gap for 'max_gap_hours' (default False: last - second value of
+        the window, edge gap not counted).
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per window with:
+        - 'window_start', 'window_end', 'start_pos', 'end_pos' : window and its row slice [start_pos, end_pos)
+        - 'row_count', 'slots_mask' (bit s set = slot s present), 'missing_slots'
+        - 'max_gap_hours' : largest gap between consecutive rows inside the window (with `carry_over`
+          also the gap into its first row)
+        - 'mean', 'first_value', 'last_value', 'total_diff', 'start', 'end', 'delta_t', 'diff_rate'
+        - 'reasons' : list of skip reasons ('over_{max_gap_hours}h_gap', 'missing_{slot}',
+          'almost_zero_mean', 'total_consumption_under_{min_energy_wh}Wh'); empty for valid windows
+    """
+    window = parse_window(spec)
+    t, values = series['t'], series['values']
+    if len(t) == 0:
+        return pd.DataFrame(columns=TABLE_COLUMNS)
+
+    origin = np.datetime64(WINDOW_ORIGIN + window['offset'], 'ns')
+    size = np.timedelta64(window['size'].value, 'ns')
+    slot = np.timedelta64(window['slot'].value, 'ns')
+
+    # t is sorted, so window numbers are non-decreasing and each window is one contiguous slice
+    window_no = (t - origin) // size
+    starts = np.flatnonzero(np.r_[True, window_no[1:] != window_no[:-1]])
+    ends = np.r_[starts[1:], len(t)]
+    counts = ends - starts
+    window_idx = np.repeat(np.arange(len(starts)), counts)
+    window_start = origin + window_no[starts] * size
+
+    # Slots present: OR of (1 << slot) per window, in int64 (float weights would lose bits above 2**53)
+    n_slots = window['n_slots']
+    slots = ((t - window_start[window_idx]) // slot).astype(np.int64)
+    slots_mask = np.bitwise_or.reduceat(np.left_shift(np.int64(1), slots), starts)
+    if required_slots is None:
+        required_slots = set(range(n_slots))
+    required_mask = sum(1 << s for s in required_slots)
+
+    # Largest gap inside each window. The gap across the window edge is not counted, unless the
+    # interval ending at the first row is charged to the window (carry_over)
+    gaps = series['gaps']
+    if not carry_over:
+        gaps = gaps.copy()
+        gaps[starts] = 0.0
+    max_gap = np.maximum.reduceat(gaps, starts)
+
+    # NaN-aware mean (of the interval values, if any)
+    sums = np.add.reduceat(series['filled'], starts)
+    n_valid = np.add.reduceat(series['valid'].astype(np.int64), starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / n_valid
+
+    first_value = values[starts]
+    last_value = values[ends - 1]
+    if carry_over:
+        base_value = values[np.maximum(starts - 1, 0)]
+    else:
+        base_value = np.where(counts > 1, values[np.minimum(starts + 1, len(values) - 1)], np.nan)
+    total_diff = last_value - base_value
+
+    start = t[starts]
+    end = t[ends - 1]
+    delta_t = (end - start) / np.timedelta64(1, 's') / SECONDS_PER_HOUR
+    with np.errstate(invalid='ignore', divide='ignore'):
+        diff_rate = np.where(delta_t > 0, total_diff / np.where(delta_t > 0, delta_t, 1), np.nan)
+
+    over_gap = max_gap >= window['max_gap_hours']
+    missing_slot = (slots_mask & required_mask) != required_mask
+    zero_mean = mean < 1e-6     # nearly zero (unit: Wh) 0.000001 Wh
+    under_energy = ~(np.abs(total_diff) >= window['min_energy_wh'])
+    gap_reason = f"over_{window['max_gap_hours']:g}h_gap"
+    slot_reason = f"missing_{_slot_name(window['slot'])}"
+    energy_reason = f"total_consumption_under_{window['min_energy_wh']:g}Wh"
+
+    reasons = [
+        [r for r, flag in ((gap_reason, g), (slot_reason, m), ('almost_zero_mean', z), (energy_reason, u)) if flag]
+        for g, m, z, u in zip(over_gap, missing_slot, zero_mean, under_energy)
+    ]
+    missing_slots = [
+        [s for s in sorted(required_slots) if not (mask >> s) & 1] for mask in slots_mask
+    ]
+
+    return pd.DataFrame({
+        'window_start': pd.to_datetime(window_start),
+        'window_end': pd.to_datetime(window_start + size),
+        'start_pos': starts,
+        'end_pos': ends,
+        'row_count': counts,
+        'slots_mask': slots_mask,
+        'missing_slots': missing_slots,
+        'max_gap_hours': max_gap,
+        'mean': mean,
+        'first_value': first_value,
+        'last_value': last_value,
+        'total_diff': total_diff,
+        'start': pd.to_datetime(start),
+        'end': pd.to_datetime(end),
+        'delta_t': delta_t,
+        'diff_rate': diff_rate,
+        'reasons': reasons,
+    })
+
+
+def compute_window_tables(collect_time: pd.Series, target: pd.Series, windows: dict, carry_over: bool = False,
+                          interval: pd.Series | None = None) -> dict[str, pd.DataFrame]:
+    """Return {window name: `window_table`} for every spec in `windows`, from one `prepare_series` pass."""
+    series = prepare_series(collect_time, target, interval)
+    return {name: window_table(series, spec, carry_over=carry_over) for name, spec in windows.items()}
+
+
+def window_key(ts) -> str:
+    """Sortable summary key of a window start ('YYYY-MM-DD HH:MM:SS')."""
+    return pd.Timestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def window_rows(motor_name: str, table: pd.DataFrame, since: pd.Timestamp | None = None) -> tuple[list, list]:
+    """
+    Summary rows (missing_rows, saved_rows) of one resolution, like step3_1's 24h summaries but keyed
+    by 'window_start'. With `since`, only the windows ending after it are returned.
+    """
+    missing_rows = []
+    saved_rows = []
+    for window in table.itertuples(index=False):
+        if since is not None and window.window_end <= pd.Timestamp(since):
+            continue
+        key = {'motor': motor_name, 'window_start': window_key(window.window_start),
+               'window_end': window_key(window.window_end), 'row_count': int(window.row_count)}
+        if window.reasons:
+            missing_rows.append({**key, 'missing_reason': ';'.join(window.reasons),
+                                 'missing_slots': window.missing_slots if window.missing_slots else None})
+            continue
+        saved_rows.append({
+            **key,
+            'total_diff_Wh': window.total_diff,
+            'diff_rate_Wh_per_h': float(window.diff_rate) if np.isfinite(window.diff_rate) else None,
+            'delta_t_hours': float(window.delta_t),
+            'first_value_Wh': float(window.first_value),
+            'last_value_Wh': float(window.last_value),
+            'start': window.start,
+            'end': window.end,
+        })
+    return missing_rows, saved_rows
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# The pipeline steps are flat scripts in src/ (and the synthetic data generator is in benchmarks/)
+EEMS_DIR = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(EEMS_DIR / "src"), str(EEMS_DIR / "benchmarks")]
+
+
+def pytest_configure(config):
+    # step1 / step2 set up their logs in {cwd}/preprocessing_logs at import time: keep them out of the tree
+    os.chdir(tempfile.mkdtemp(prefix="eems-tests-"))
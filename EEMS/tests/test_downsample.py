@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from downsample import plot_indices
+
+
+@pytest.mark.parametrize("method", ['minmax', 'lttb'])
+@pytest.mark.parametrize("n_points", [40, 100_000])
+def test_nan_gaps_survive_downsampling(method, n_points):
+    x = np.arange('2024-06-01T00:00', '2024-06-01T06:00', dtype='datetime64[s]')
+    y = np.sin(np.arange(len(x)) / 500.0)
+    y[:10] = np.nan            # leading run: no gap, nothing to keep
+    y[5000:5600] = np.nan      # two gaps inside the series
+    y[12000:12001] = np.nan
+    y[-3:] = np.nan            # trailing run
+
+    idx = plot_indices(x, y, n_points, method)
+
+    assert np.all(np.diff(idx) > 0)
+    assert list(idx[np.isnan(y[idx])]) == [5000, 12000]
+    # every NaN run between two kept points is still marked, so the drawn line breaks there
+    kept = idx[~np.isnan(y[idx])]
+    assert kept[0] == 10 and kept[-1] == len(y) - 4
+    for a, b in zip(kept[:-1], kept[1:]):
+        assert np.isnan(y[a:b]).any() == np.isnan(y[idx[(idx > a) & (idx < b)]]).any()
@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+from natsort import os_sorted
+
+from make_synthetic_toray import make_line_files
+from step1_data_filter import run_step1_main
+from step2_data_decomposed import run_step2
+from step3_1_data_split_chunk import run_step3
+from live_ingest import parse_message, replay_csv_messages, run_live_ingest
+
+
+@pytest.fixture(scope="module")
+def exports(tmp_path_factory):
+    """Tiny synthetic inner-line export (2 motors, ~4 days in 2 consecutive files)."""
+    original = tmp_path_factory.mktemp("original")
+    make_line_files(original, 'inner', rows_per_file=100_000, n_files=2)
+    return os_sorted(original.glob("*.csv"))
+
+
+def read_summary(path):
+    df = pd.read_csv(path, float_precision='round_trip')
+    return df.sort_values(['motor', 'date'], kind='stable').reset_index(drop=True)
+
+
+@pytest.mark.parametrize("include_power", [False, True])
+def test_replay_matches_batch(exports, tmp_path, include_power):
+    filtered = run_step1_main(exports[0].parent, tmp_path / "filtered", include_power=include_power)
+    decomposed = run_step2(filtered, tmp_path / "decomposed")
+    batch_dir = run_step3(decomposed, tmp_path / "batch", include_power=include_power, plot_mode='none')
+
+    live_dir = tmp_path / "live"
+    stats = run_live_ingest(replay_csv_messages(exports), live_dir, include_power=include_power, flush=True)
+    assert stats['_malformed'] == {'records': 0}
+
+    for name in ("saved_24h_summary.csv", "missing_24h_summary.csv"):
+        pd.testing.assert_frame_equal(read_summary(live_dir / name), read_summary(batch_dir / name))
+
+    batch_chunks = sorted(p.relative_to(batch_dir) for p in batch_dir.glob("*/24h/parquets/*.parquet"))
+    live_chunks = sorted(p.relative_to(live_dir) for p in live_dir.glob("*/24h/parquets/*.parquet"))
+    assert live_chunks == batch_chunks and batch_chunks
+    for chunk in batch_chunks:
+        # step2 stores 'machine_code' as a categorical, the live chunks as strings
+        batch = pd.read_parquet(batch_dir / chunk).astype({'machine_code': object})
+        live = pd.read_parquet(live_dir / chunk).astype({'machine_code': object})
+        pd.testing.assert_frame_equal(live[batch.columns], batch, check_dtype=False)
+
+
+def test_malformed_messages_are_skipped(tmp_path):
+    topic = "eems/toray/inner/FEMS11_01"
+    good = '{"collect_time": "2024-06-01 00:00:01.000", "Load_Total_Power_Consumption": 1.0, "Load_Active_Power": 2.0}'
+    messages = [
+        (topic, b'{"collect_time": '),                             # truncated JSON
+        (topic, b'\xff\xfe'),                                      # not UTF-8
+        (topic, '[1, 2]'),                                         # not an object
+        (topic, '{"Load_Active_Power": 1.0}'),                     # no collect_time
+        (topic, '{"collect_time": "yesterday"}'),                  # unparseable collect_time
+        (topic, '{"collect_time": null}'),
+        (topic, '{"collect_time": "2024-06-01 00:00:00", "Load_Active_Power": "n/a"}'),
+        (topic, good),
+    ]
+    events = []
+    stats = run_live_ingest(messages, include_power=True, on_day=events.append, flush=True)
+
+    assert stats['_malformed'] == {'records': 7}
+    assert stats['TORAY_P1730A']['days'] == 1
+    assert len(events) == 1 and len(events[0]['chunk']) == 1
+    with pytest.raises(ValueError):
+        parse_message(topic, '{"collect_time": "yesterday"}')
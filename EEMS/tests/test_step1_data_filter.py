@@ -0,0 +1,33 @@
+import pandas as pd
+
+from step1_data_filter import stream_csv_to_parquet
+
+COLS = ['collect_time', 'machine_code', 'Load_Total_Power_Consumption']
+
+
+def write_export(path, stamps):
+    rows = ''.join(f"{stamp},FEMS11_01,{i}.5,1.0\n" for i, stamp in enumerate(stamps))
+    path.write_text("collect_time,machine_code,Load_Total_Power_Consumption,Voltage_R\n" + rows)
+    return path
+
+
+def test_iso_timestamps_are_parsed_by_the_reader(tmp_path):
+    csv = write_export(tmp_path / "a.csv", ["2024-06-01 00:00:00.100", "2024-06-01 00:00:03.770"])
+    start, end, n_rows = stream_csv_to_parquet(csv, tmp_path / "a.parquet", COLS)
+
+    df = pd.read_parquet(tmp_path / "a.parquet")
+    assert n_rows == 2 and list(df.columns) == COLS
+    assert df['collect_time'].dtype == 'datetime64[ns]'
+    assert (start, end) == (pd.Timestamp("2024-06-01 00:00:00.100"), pd.Timestamp("2024-06-01 00:00:03.770"))
+
+
+def test_odd_timestamps_fall_back_to_parse_timestamps(tmp_path):
+    # A malformed row and a slash-separated row no longer stop the conversion of the whole file
+    csv = write_export(tmp_path / "b.csv", ["2024-06-01 00:00:00.100", "not a time", "2024/06/01 00:00:10"])
+    _, _, n_rows = stream_csv_to_parquet(csv, tmp_path / "b.parquet", COLS)
+
+    df = pd.read_parquet(tmp_path / "b.parquet")
+    assert n_rows == 3
+    assert df['collect_time'].dtype == 'datetime64[ns]'
+    assert df['collect_time'].tolist() == [pd.Timestamp("2024-06-01 00:00:00.100"), pd.NaT,
+                                           pd.Timestamp("2024-06-01 00:00:10")]
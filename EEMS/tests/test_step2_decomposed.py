@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from step2_data_decomposed import MOTOR_MAPS, append_decomposed, decompose_streaming, same_record
+
+MOTOR_FILE = "TORAY_P1730A_filtered_decomposed.parquet"
+
+
+def filtered_file(path, start, n_rows, nan_last=False, nan_first=False):
+    """One inner filtered export of motor P1730A (FEMS11_01), 1 row per minute."""
+    power = np.arange(start, start + n_rows, dtype=np.float32) * 10
+    if nan_last:
+        power[-1] = np.nan
+    if nan_first:
+        power[0] = np.nan
+    df = pd.DataFrame({
+        'collect_time': pd.Timestamp('2024-06-01') + pd.to_timedelta(np.arange(start, start + n_rows), unit='min'),
+        'machine_code': pd.Categorical(['FEMS11_01'] * n_rows),
+        'Load_Total_Power_Consumption': np.arange(start, start + n_rows, dtype=np.float32) * 100,
+        'Load_Active_Power': power,
+    })
+    df.to_parquet(path, index=False)
+    return path
+
+
+@pytest.fixture
+def exports(tmp_path):
+    """Two consecutive exports sharing their boundary record, whose Load_Active_Power is NaN."""
+    first = filtered_file(tmp_path / "TORAY_inner_1_filtered.parquet", 0, 4, nan_last=True)
+    second = filtered_file(tmp_path / "TORAY_inner_2_filtered.parquet", 3, 4, nan_first=True)
+    return first, second
+
+
+def test_same_record_nan_equal():
+    a = pd.Series([pd.Timestamp('2024-06-01'), 'FEMS11_01', 1.0, np.nan])
+    assert same_record(a, a.copy())
+    assert not same_record(a, a.replace(1.0, 2.0))
+
+
+def test_streaming_drops_nan_boundary_record(exports, tmp_path):
+    out = tmp_path / "decomposed"
+    stats = decompose_streaming(list(exports), MOTOR_MAPS, out)
+
+    df = pd.read_parquet(out / MOTOR_FILE)
+    assert stats['P1730A']['rows'] == 7
+    assert len(df) == 7
+    assert df['collect_time'].is_unique
+
+
+def test_append_drops_nan_boundary_record(exports, tmp_path):
+    first, second = exports
+    out = tmp_path / "decomposed"
+    decompose_streaming([first], MOTOR_MAPS, out)
+    appended = append_decomposed([second], out)
+
+    df = pd.read_parquet(out / MOTOR_FILE)
+    assert appended['P1730A']['rows_added'] == 3
+    assert len(df) == 7
+    assert df['collect_time'].is_unique
@@ -0,0 +1,89 @@
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import MinMaxScaler
+
+from pair_distance import minmax_scale, pairwise_l1_scores
+from step4_select_max_diffrate_date import pivot_summary, run_step4, score_motor_pair
+
+
+def baseline_scores(df: pd.DataFrame, motor1_name: str, motor2_name: str) -> pd.DataFrame:
+    """The original step4 loop (select_max_diffrate_date before the pairwise engine)."""
+    date_box, combined_date_box = [], []
+    for date, group in df.groupby('date'):
+        if len(group) == 2:
+            m1 = group[group['motor'] == f'TORAY_{motor1_name}']
+            m2 = group[group['motor'] == f'TORAY_{motor2_name}']
+            combined_date_box.append({'date': date,
+                                      f"{motor1_name}_diff": m1['diff'].values[0],
+                                      f"{motor1_name}_diff_rate": m1['diff_rate'].values[0],
+                                      f"{motor2_name}_diff": m2['diff'].values[0],
+                                      f"{motor2_name}_diff_rate": m2['diff_rate'].values[0]})
+            date_box.append(date)
+    combined_df = pd.DataFrame(combined_date_box).set_index('date')
+    scaled_df = pd.DataFrame(MinMaxScaler().fit_transform(combined_df), columns=combined_df.columns,
+                             index=combined_df.index)
+    return pd.DataFrame([
+        {'date_compare': f'{d1} - {d2}', 'score': np.sum(np.abs(scaled_df.loc[d2] - scaled_df.loc[d1]))}
+        for d1, d2 in combinations(date_box, 2)
+    ])
+
+
+@pytest.fixture
+def summary():
+    """Two motors over 8 days: repeated rows (tied scores), a NaN diff_rate and a day with one motor only."""
+    rows = [
+        ('2024-06-01', 10.0, 1.0, 12.0, 1.2),
+        ('2024-06-02', 10.0, 1.0, 12.0, 1.2),   # same as 06-01: ties
+        ('2024-06-03', 30.0, np.nan, 11.0, 0.9),  # NaN day
+        ('2024-06-04', 20.0, 2.0, 20.0, 2.0),
+        ('2024-06-05', 0.0, 0.0, 40.0, 4.0),
+        ('2024-06-06', 0.0, 0.0, 40.0, 4.0),    # same as 06-05: ties
+        ('2024-06-07', 25.0, 2.5, 5.0, np.nan),
+    ]
+    records = []
+    for date, d1, r1, d2, r2 in rows:
+        records.append({'date': date, 'motor': 'TORAY_P1730A', 'diff': d1, 'diff_rate': r1})
+        records.append({'date': date, 'motor': 'TORAY_P1730B', 'diff': d2, 'diff_rate': r2})
+    records.append({'date': '2024-06-08', 'motor': 'TORAY_P1730A', 'diff': 99.0, 'diff_rate': 9.9})
+    return pd.DataFrame(records)
+
+
+def test_pairwise_engine_matches_baseline_loop(summary):
+    expected = baseline_scores(summary, 'P1730A', 'P1730B')
+
+    result = score_motor_pair(pivot_summary(summary), 'P1730A', 'P1730B')
+    pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize("block_elements", [1, 3, 1 << 22])
+def test_pairwise_l1_scores_blocks_and_top_k(summary, block_elements):
+    cube = pivot_summary(summary)
+    rows = cube['values'][cube['present'].all(axis=1)].reshape(-1, 4)
+    scaled = minmax_scale(rows)
+    brute = [(i, j, np.nansum(np.abs(scaled[j] - scaled[i]))) for i, j in combinations(range(len(scaled)), 2)]
+
+    i, j, score = pairwise_l1_scores(scaled, block_elements=block_elements)
+    assert list(zip(i, j)) == [(a, b) for a, b, _ in brute]
+    np.testing.assert_array_equal(score, [s for _, _, s in brute])
+
+    # top_k: best scores first, ties in combinations order (top_k=1 is the baseline's argmax)
+    best = sorted(brute, key=lambda p: (-p[2], p[0], p[1]))[:4]
+    i, j, score = pairwise_l1_scores(scaled, top_k=4, block_elements=block_elements)
+    assert list(zip(i, j, score)) == best
+    assert (i[0], j[0]) == brute[int(np.argmax([s for _, _, s in brute]))][:2]
+
+
+def test_run_step4_default_writes_the_baseline_csv(summary, tmp_path):
+    input_dir = tmp_path / "chunked"
+    input_dir.mkdir()
+    summary.rename(columns={'diff': 'total_diff_Wh', 'diff_rate': 'diff_rate_Wh_per_h'}).to_csv(
+        input_dir / "saved_24h_summary.csv", index=False)
+
+    for incremental in (False, True):
+        output_dir = run_step4(input_dir, tmp_path / f"analysis_{incremental}", motor_pairs=[('P1730A', 'P1730B')],
+                               incremental=incremental)
+        written = pd.read_csv(output_dir / "max_diff_rate_dates_P1730A_P1730B.csv", float_precision='round_trip')
+        pd.testing.assert_frame_equal(written, baseline_scores(summary, 'P1730A', 'P1730B'))
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from window_engine import MAX_SLOTS, prepare_series, window_table
+
+
+def table_of(times, spec, values=None):
+    collect_time = pd.Series(pd.to_datetime(times))
+    if values is None:
+        values = np.arange(len(collect_time), dtype=np.float64) * 1000
+    return window_table(prepare_series(collect_time, pd.Series(values)), spec)
+
+
+@pytest.mark.parametrize("n_slots", [53, 54, 60, MAX_SLOTS])
+def test_full_window_with_many_slots(n_slots):
+    spec = {'size': f'{n_slots}min', 'slot': '1min', 'min_energy_wh': 0}
+    start = pd.Timestamp('2024-06-03 00:00:00')  # a window start for every size dividing a day from the origin
+    start = start + (pd.Timestamp('1970-01-05') - start) % pd.Timedelta(spec['size'])
+    times = start + pd.to_timedelta(np.arange(n_slots * 2) * 30, unit='s')
+    table = table_of(times, spec)
+
+    assert len(table) == 1
+    row = table.iloc[0]
+    assert row['slots_mask'] == (1 << n_slots) - 1
+    assert row['missing_slots'] == []
+    assert row['reasons'] == []
+
+
+def test_hour_of_minutes():
+    spec = {'size': '1h', 'slot': '1min', 'min_energy_wh': 0}
+    times = pd.date_range('2024-06-03 00:00:00', periods=120, freq='30s')
+    row = table_of(times, spec).iloc[0]
+    assert row['slots_mask'] == 2 ** 60 - 1
+    assert row['reasons'] == []
+
+    # Dropping the last minute is reported as exactly that slot
+    row = table_of(times[:-2], spec).iloc[0]
+    assert row['missing_slots'] == [59]
+    assert row['reasons'] == ['missing_1min']
+